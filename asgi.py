@@ -0,0 +1,674 @@
+## Async serving path: the /progress pipeline and job event streams on asyncio, everything
+## else through the Flask app
+##
+## Run with an ASGI server, e.g. `uvicorn asgi:app --port 81` (see the "asgi" extra in
+## pyproject.toml). Each open /progress stream is a task on the event loop rather than a
+## pinned worker thread: SerpAPI, SEMRush, Jina and OpenAI-compatible chat completions are
+## called through httpx.AsyncClient (one pool per provider), with the same caches, metrics, per-provider
+## concurrency limits and SSE wire format as main.py. /jobs/<id>/events tails the job log
+## from the event loop too; the jobs themselves run on main.py's worker threads. Resuming or
+## rerunning a checkpointed run (/progress?run_id=...) goes to main.py's route.
+import io
+import sys
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import httpx
+
+import main
+from main import (
+    config, format_sse_message, cache_get, cache_set, measured_call, note_ai_usage, job_store,
+    RunMetrics, active_run_metrics, metrics, response_cache, PipelineHalted, PipelineStage, PIPELINE_STAGES,
+    AI_STEPS, prompt_for, SSEEncoder, SerpResult
+)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# httpx logs every request at INFO; the metrics already cover upstream calls.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# --- Async Upstreams ---
+
+class AsyncUpstreams:
+    """The httpx clients and per-provider concurrency slots of the async path.
+
+    Requests first wait for the provider's rate limiter in main.py, which the
+    threaded path shares, so both count against the same buckets and budgets.
+    Connection failures are retried by the transport; 429/5xx responses are retried
+    here with the same exponential backoff (and ``Retry-After``) as the requests
+    session in main.py. Read timeouts are not retried.
+    """
+
+    def __init__(self):
+        # One client per provider, each pooled to that provider's limit: httpcore scans
+        # its whole pool for every request, so one big shared pool gets slow under load.
+        self.clients = {provider: httpx.AsyncClient(
+            timeout=httpx.Timeout(30, connect=config["http_connect_timeout"]),
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+            transport=httpx.AsyncHTTPTransport(retries=config["http_retries"])
+        ) for provider, limit in config["upstream_concurrency"].items()}
+        self.slots = {provider: asyncio.Semaphore(limit) for provider, limit in config["upstream_concurrency"].items()}
+
+    async def get(self, provider, url, units=1, **kwargs):
+        limiter = main.rate_limiters.get(provider)
+        if limiter is not None:
+            main.note_call(throttled=await admit(limiter, active_run_metrics.get(), units))
+        try:
+            async with self.slots[provider]:
+                for attempt in range(config["http_retries"] + 1):
+                    response = await self.clients[provider].get(url, **kwargs)
+                    if response.status_code not in RETRY_STATUSES or attempt == config["http_retries"]:
+                        break
+                    await asyncio.sleep(retry_delay(response, attempt))
+                    call = main.current_call.get()
+                    if call is not None:
+                        call["retries"] += 1
+        except BaseException:
+            # No response (an error, or the run was cancelled), so nothing was billed.
+            await refund_units(provider, units)
+            raise
+        call = main.current_call.get()
+        if call is not None:
+            call["responses"].append(response)
+        return response
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+async def admit(limiter, owner, units):
+    """``RateLimiter.acquire`` for the event loop: sleeps between polls instead of blocking."""
+    ticket = await off_loop_if_persistent(limiter, limiter.request, owner, units)
+    started = time.monotonic()
+    try:
+        while (delay := limiter.poll(ticket)) > 0:
+            await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        await off_loop_if_persistent(limiter, limiter.cancel, ticket, units)
+        raise
+    return time.monotonic() - started
+
+async def off_loop_if_persistent(limiter, method, *args):
+    """Call a limiter method, on a worker thread when it commits to the quota store."""
+    if limiter.persistent:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def refund_units(provider, units):
+    """``main.refund_units`` without blocking the event loop on the quota store."""
+    limiter = main.rate_limiters.get(provider)
+    if limiter is not None:
+        await off_loop_if_persistent(limiter, limiter.refund, units)
+
+def retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return config["http_backoff_factor"] * (2 ** attempt)
+
+upstreams = None
+
+def get_upstreams():
+    """Create the shared client on first use (or at lifespan startup) inside the running loop."""
+    global upstreams
+    if upstreams is None:
+        upstreams = AsyncUpstreams()
+    return upstreams
+
+def timeout(read_timeout):
+    return httpx.Timeout(read_timeout, connect=config["http_connect_timeout"])
+
+# --- Async Retrieval ---
+
+async def get_serpapi_data(topic_query):
+    with measured_call("serpapi", topic_query):
+        params, cache_key = main.serpapi_request(topic_query)
+        cached = await asyncio.to_thread(cache_get, "serpapi", cache_key)
+        if cached is not None:
+            return [SerpResult.from_row(row) for row in cached]
+        try:
+            response = await get_upstreams().get("serpapi", config["serpapi_url"], params=params, timeout=timeout(config["serpapi_timeout"]))
+        except httpx.HTTPError as e:
+            logging.error(f"Request error retrieving SerpAPI data: {e}")
+            return []
+        if not main.handle_api_errors(response, "SerpAPI"):
+            return []
+        data = main.parse_serpapi_results(response.json())
+        if data:
+            await asyncio.to_thread(cache_set, "serpapi", cache_key, data)
+        logging.info("Successfully retrieved SerpAPI data.")
+        return [SerpResult.from_row(row) for row in data]
+
+async def get_semrush_data(url, api_key=None):
+    with measured_call("semrush", url):
+        full_url, cache_key = main.semrush_request(url, api_key or main.get_settings().semrush_api_key)
+        cached = await asyncio.to_thread(cache_get, "semrush", cache_key)
+        if cached is not None:
+            return main.KeywordTable.from_columns(cached)
+        units = config["semrush_display_limit"]
+        response = await get_upstreams().get("semrush", full_url, units=units, timeout=timeout(config["semrush_timeout"]))
+        if not main.handle_api_errors(response, "SEMRush"):
+            await refund_units("semrush", units)
+            return None
+        keywords = main.parse_semrush_response(response.text.splitlines(), url)
+        if keywords is None:
+            await refund_units("semrush", units)
+            return None
+        await refund_units("semrush", units - len(keywords))
+        await asyncio.to_thread(cache_set, "semrush", cache_key, keywords.to_columns())
+        return keywords
+
+async def fetch_content(url):
+    with measured_call("jina", url):
+        full_url, headers, cache_key = main.jina_request(url)
+        cached = await asyncio.to_thread(cache_get, "jina", cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = await get_upstreams().get("jina", full_url, headers=headers, timeout=timeout(config["jina_read_timeout"]))
+            if main.handle_api_errors(response, "Jina AI Reader"):
+                return await asyncio.to_thread(main.parse_jina_response, url, response.json(), cache_key)
+            return f"ERROR: Failed to use Jina API for {url}."
+        except httpx.HTTPError as e:
+            logging.error(f"Request error fetching content from {url}: {e}")
+            return f"ERROR: Request failed for {url}."
+        except Exception as e:
+            logging.error(f"Unknown error fetching content from {url}: {e}")
+            return f"ERROR: Unknown error processing {url}."
+
+async def interact_with_ai(messages, model=None, temperature=None, bypass_cache=False, step=None, on_delta=None):
+    """Async ``interact_with_ai``; streams deltas to ``on_delta`` when it is given.
+
+    Models are routed and fall back exactly as in main.py, and a streamed call
+    only falls back while no delta has been passed on. Only ``openai:`` models
+    are called natively (any OpenAI-compatible endpoint via ``openai_base_url``);
+    other providers run on the blocking aisuite client on a worker thread.
+    """
+    with measured_call("ai", step or "other"):
+        models, params = main.route_for(step, messages, model, temperature)
+        use_cache = config["ai_cache_enabled"] and not bypass_cache
+        cache_key = main.completion_cache_key(step, model, params["temperature"], messages)
+        if use_cache:
+            cached = await asyncio.to_thread(main.get_cached_completion, cache_key)
+            if cached is not None:
+                if on_delta:
+                    on_delta(cached)
+                return cached
+        sent = []
+
+        def forward(delta):
+            sent.append(delta)
+            on_delta(delta)
+
+        for attempt, candidate in enumerate(models):
+            provider, _, model_name = candidate.partition(":")
+            started = time.perf_counter()
+            try:
+                if provider != "openai":
+                    response = await asyncio.to_thread(main.get_client().chat.completions.create, model=candidate, messages=messages, **params)
+                    result, usage = response.choices[0].message.content, getattr(response, "usage", None)
+                    if on_delta and result:
+                        forward(result)
+                else:
+                    async with get_upstreams().slots["ai"]:
+                        result, usage = await chat_completion(model_name, messages, params, forward if on_delta else None)
+            except Exception as e:
+                main.model_latency.record(step, candidate, params["timeout"])
+                if sent:
+                    logging.error(f"Streaming AI call to {candidate} for {step or 'other'} failed mid-stream: {e}")
+                    return None
+                logging.warning(f"AI call to {candidate} for {step or 'other'} failed: {e}")
+                continue
+            main.model_latency.record(step, candidate, time.perf_counter() - started)
+            main.note_call(model=candidate, fallbacks=attempt)
+            note_ai_usage(candidate, messages, result, usage)
+            if use_cache and result is not None:
+                await asyncio.to_thread(main.set_cached_completion, cache_key, result)
+            return result
+        logging.error(f"Error during AI interaction: every model failed for {step or 'other'} ({', '.join(models)}).")
+        return None
+
+async def chat_completion(model_name, messages, params, on_delta=None):
+    """POST to ``/chat/completions``; returns ``(text, usage)``."""
+    url = f"{config['openai_base_url'].rstrip('/')}/chat/completions"
+    headers = {"Authorization": f"Bearer {main.get_settings().openai_api_key}"}
+    payload = {"model": model_name, "messages": messages, "temperature": params["temperature"], "stream": on_delta is not None}
+    client = get_upstreams().clients["ai"]
+    if on_delta is None:
+        response = await client.post(url, json=payload, headers=headers, timeout=timeout(params["timeout"]))
+        response.raise_for_status()
+        body = response.json()
+        usage = body.get("usage") or {}
+        return body["choices"][0]["message"]["content"], SimpleNamespace(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+    parts = []
+    async with client.stream("POST", url, json=payload, headers=headers, timeout=timeout(params["timeout"])) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            choices = json.loads(line[len("data: "):]).get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+    return "".join(parts), None
+
+# --- Async Pipeline ---
+
+async def run_ai_step(step, message, title, messages, emit):
+    emit(format_sse_message("progress", step=step, message=message))
+    on_delta = (lambda delta: emit(format_sse_message("delta", step=step, data=delta))) if config["stream_ai_output"] else None
+    result = await interact_with_ai(messages, step=step, on_delta=on_delta)
+    if result is None:
+        raise RuntimeError(f"The AI model returned no output for the {step} step.")
+    emit(format_sse_message("complete", step=step, title=title, data=result))
+    return result
+
+async def serp_stage(context, emit):
+    emit(format_sse_message("progress", step="serp", message="Retrieving SERP Data..."))
+    serp_results = await get_serpapi_data(context["topic_query"])
+    if not serp_results:
+        error_message = "Failed to retrieve data from SerpAPI."
+        emit(format_sse_message("complete", step="serp", title="Could not retrieve SERP data.", data=error_message))
+        raise PipelineHalted(error_message)
+    emit(format_sse_message("complete", step="serp", title="SERP Data Retrieved", data=main.serp_rows(serp_results)))
+    return serp_results
+
+async def semrush_stage(context, emit):
+    emit(format_sse_message("progress", step="semrush", message="Processing SEMRush Data..."))
+    serp_results = context["serp"]
+    urls = [result.link for result in serp_results]
+    outcomes = await asyncio.gather(*(get_semrush_data(url) for url in urls), return_exceptions=True)
+    semrush_results, failures = [], []
+    for url, outcome in zip(urls, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"SEMRush lookup failed for {url}: {outcome}")
+        if isinstance(outcome, Exception) or outcome is None:
+            failures.append(url)
+            semrush_results.append(main.KeywordTable())
+        else:
+            semrush_results.append(outcome)
+    if failures:
+        emit(format_sse_message("progress", step="semrush",
+                                message=f"SEMRush data unavailable for {len(failures)} of {len(urls)} URLs",
+                                failed_urls=failures))
+    final_keywords = main.select_final_keywords(main.build_keyword_index(urls, semrush_results))
+    output, complete_data = main.semrush_stage_output(serp_results, semrush_results, final_keywords)
+    emit(format_sse_message("complete", step="semrush", title="SEMRush Data Retrieved and Processed", data=complete_data))
+    return output
+
+async def content_stage(context, emit):
+    serp_results = context["serp"]
+    total_urls = len(serp_results)
+    content_fetch_results = [None] * total_urls
+    emit(format_sse_message("progress", step="content", message=f"Fetching content from {total_urls} URLs...",
+                            current=0, total=total_urls))
+
+    async def fetch(index):
+        return index, await fetch_content(serp_results[index].link)
+
+    for completed, next_result in enumerate(asyncio.as_completed([fetch(index) for index in range(total_urls)]), start=1):
+        index, content = await next_result
+        content_fetch_results[index] = await asyncio.to_thread(main.content_result, serp_results[index], content)
+        emit(format_sse_message("url_complete", url=serp_results[index].link, success=content_fetch_results[index]['Success'],
+                                current=completed, total=total_urls))
+    emit(format_sse_message("complete", step="content", title="Content Fetching Complete", data=content_fetch_results))
+    return content_fetch_results
+
+async def analysis_stage(context, emit):
+    # Reads the pages back from the content store.
+    pages = await asyncio.to_thread(main.analyzable_pages, context["content"])
+    if not pages:
+        error_message = "No competitor page content is available to analyze."
+        emit(format_sse_message("error", step="analysis", message=error_message))
+        raise PipelineHalted(error_message)
+    if config["analysis_mode"] == "map_reduce":
+        # Page digests run on the blocking client in a bounded worker pool.
+        emit(format_sse_message("progress", step="analysis", message=f"Summarizing {len(pages)} pages...",
+                                current=0, total=len(pages)))
+        digests = await asyncio.to_thread(lambda: dict(main.summarize_pages_concurrently(pages)))
+        digests = [digests[index] for index in range(len(pages)) if digests.get(index)]
+        if not digests:
+            error_message = "Could not summarize any competitor page."
+            emit(format_sse_message("error", step="analysis", message=error_message))
+            raise PipelineHalted(error_message)
+        analysis_messages = main.build_digest_analysis_messages(digests, context["topic_query"])
+    else:
+        # Packing is CPU-bound; keep it off the event loop.
+        content_list, packing_stats = await asyncio.to_thread(main.pack_context, pages)
+        emit(format_sse_message("progress", step="analysis",
+                                message=f"Packed competitor content into {packing_stats['packed_tokens']} tokens ({packing_stats['tokens_saved']} saved)",
+                                stats=packing_stats))
+        analysis_messages = main.build_content_analysis_messages(content_list, context["topic_query"])
+    return await run_ai_step("analysis", "Analyzing Content...", "Analyzing Content",
+                             prompt_for(context, "analysis", analysis_messages), emit)
+
+def ai_stage(step):
+    message, title, build_messages = AI_STEPS[step]
+
+    async def run(context, emit):
+        return await run_ai_step(step, message, title, prompt_for(context, step, build_messages(context)), emit)
+    return run
+
+async def draft_stage(context, emit):
+    """Async ``main.draft_stage``: drafts still being written after the grace period are cancelled."""
+    variants = config["draft_variants"]
+    if len(variants) < 2:
+        return await ai_stage("draft")(context, emit)
+    message, title, build_messages = AI_STEPS["draft"]
+    emit(format_sse_message("progress", step="draft", message=f"Writing {len(variants)} candidate drafts..."))
+    messages = prompt_for(context, "draft", build_messages(context))
+    tasks = {asyncio.ensure_future(interact_with_ai(messages, variant.get("model"), variant.get("temperature"), step="draft")): index
+             for index, variant in enumerate(variants)}
+    drafts = [None] * len(variants)
+    pending, deadline, completed = set(tasks), None, 0
+    try:
+        while pending:
+            wait_for = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            if not finished:
+                logging.info(f"Selecting among drafts after the grace period; {len(pending)} still being written.")
+                break
+            for task in finished:
+                completed += 1
+                drafts[tasks[task]] = None if task.exception() else task.result()
+                if drafts[tasks[task]] and deadline is None:
+                    deadline = time.monotonic() + config["draft_grace"]
+                emit(format_sse_message("progress", step="draft", message=f"Finished {completed} of {len(variants)} drafts",
+                                        current=completed, total=len(variants)))
+    finally:
+        for task in pending:
+            task.cancel()
+    winner, scores = main.select_draft(drafts, context["plan"], context["semrush"]["keywords"])
+    if winner is None:
+        raise RuntimeError("The AI model returned no output for the draft step.")
+    emit(format_sse_message("complete", step="draft", title=title, data=drafts[winner], winner=winner, scores=scores))
+    return drafts[winner]
+
+ASYNC_STAGE_RUNNERS = {"serp": serp_stage, "semrush": semrush_stage, "content": content_stage, "analysis": analysis_stage,
+                       "draft": draft_stage}
+# Same dependency graph as the threaded pipeline in main.py.
+ASYNC_PIPELINE_STAGES = [
+    PipelineStage(stage.name, stage.deps, ASYNC_STAGE_RUNNERS.get(stage.name) or ai_stage(stage.name))
+    for stage in PIPELINE_STAGES
+]
+
+async def run_pipeline(stages, context, emit):
+    """Async counterpart of ``main.run_pipeline`` (without checkpoints)."""
+    run_started = time.perf_counter()
+    timings = {}
+    done = set()
+    failed = set()
+    running = {}
+
+    async def run_stage(stage):
+        started = time.perf_counter()
+        context[stage.name] = await stage.run(context, emit)
+        return started, time.perf_counter()
+
+    try:
+        while True:
+            for stage in stages:
+                if stage.name not in done and stage.name not in failed and stage.name not in running \
+                        and all(dep in done for dep in stage.deps):
+                    running[stage.name] = asyncio.create_task(run_stage(stage))
+            if not running:
+                break
+            finished, _ = await asyncio.wait(running.values(), return_when=asyncio.FIRST_COMPLETED)
+            for name, task in list(running.items()):
+                if task not in finished:
+                    continue
+                del running[name]
+                try:
+                    started, ended = task.result()
+                except PipelineHalted as e:
+                    logging.warning(f"Pipeline halted at {name}: {e}")
+                    failed.add(name)
+                    continue
+                except Exception as e:
+                    logging.exception(f"Pipeline stage {name} failed.")
+                    emit(format_sse_message("error", step=name, message=str(e)))
+                    failed.add(name)
+                    continue
+                done.add(name)
+                timings[name] = {"start": round(started - run_started, 3), "duration": round(ended - started, 3)}
+    finally:
+        # Cancelled (client went away): stop the stages still in flight.
+        for task in running.values():
+            task.cancel()
+
+    timings["total"] = round(time.perf_counter() - run_started, 3)
+    logging.info(f"Pipeline stage timings: {timings}")
+    return timings
+
+async def run_topic(topic_query, emit):
+    """Async counterpart of ``main.run_topic``; emits every SSE message except ``done``."""
+    run_id = uuid.uuid4().hex
+    run_metrics = RunMetrics()
+    active_run_metrics.set(run_metrics)
+    emit(format_sse_message("start", message=f"Starting content generation for topic: {topic_query}", run_id=run_id))
+    context = {"topic_query": topic_query, "run_id": run_id}
+    timings = await run_pipeline(ASYNC_PIPELINE_STAGES, context, emit)
+    metrics.record_stages(timings)
+    emit(format_sse_message("timings", data=timings))
+    emit(format_sse_message("cache_stats", data=response_cache.stats()))
+    emit(format_sse_message("metrics", data=run_metrics.summary()))
+    emit(format_sse_message("quota", data=await asyncio.to_thread(main.quota_status)))
+    return context
+
+# --- ASGI Application ---
+
+JOB_EVENTS_PATH = re.compile(r"^/jobs/([^/]+)/events$")
+
+# Bridged Flask requests get their own threads, so they cannot hold up the pipeline's
+# asyncio.to_thread work (context packing, page digests, non-OpenAI models) or vice versa.
+bridge_executor = ThreadPoolExecutor(max_workers=config["asgi_bridge_workers"], thread_name_prefix="wsgi-bridge")
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/progress" and scope["method"] == "GET" and not resumes_run(scope):
+        await progress(scope, receive, send)
+    elif scope["type"] == "http" and scope["method"] == "GET" and (match := JOB_EVENTS_PATH.match(scope["path"])):
+        await job_events(scope, receive, send, match.group(1))
+    elif scope["type"] == "http":
+        await wsgi_fallback(scope, receive, send)
+
+def resumes_run(scope):
+    """Whether a /progress request resumes or reruns a checkpointed run, which only main.py's route does."""
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    return "run_id" in query or "rerun" in query
+
+async def lifespan(receive, send):
+    global upstreams
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_upstreams()
+            main.start_job_workers()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if upstreams is not None:
+                await upstreams.aclose()
+                upstreams = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key.decode("latin-1").lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+async def start_sse(scope, send):
+    """Start an event-stream response (gzipped if accepted); returns ``write(text, more_body=True)``."""
+    gzip = "gzip" in header(scope, "accept-encoding")
+    headers = [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+    if gzip:
+        headers += [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+    compressor = main.zlib.compressobj(6, main.zlib.DEFLATED, 31) if gzip else None
+
+    async def write(text, more_body=True):
+        body = text.encode("utf-8")
+        if compressor:
+            body = compressor.compress(body) + compressor.flush(main.zlib.Z_SYNC_FLUSH if more_body else main.zlib.Z_FINISH)
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    return write
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]})
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+
+async def progress(scope, receive, send):
+    topic_query = (parse_qs(scope["query_string"].decode("latin-1")).get("topic") or [""])[0]
+    if not topic_query.strip():
+        return await send_json(send, 400, {"error": "A topic is required."})
+    events = asyncio.Queue()
+    run = asyncio.create_task(run_topic(topic_query, events.put_nowait))
+    run.add_done_callback(lambda task: events.put_nowait(None))
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        run.cancel()
+    watcher = asyncio.create_task(watch_disconnect())
+
+    encoder = SSEEncoder()
+    try:
+        write = await start_sse(scope, send)
+        while (message := await events.get()) is not None:
+            for part in encoder.encode(message):
+                await write(part)
+        if run.cancelled():
+            return
+        if run.exception() is not None:
+            logging.error(f"Async run failed: {run.exception()}")
+            for part in encoder.encode(format_sse_message("error", message=str(run.exception()))):
+                await write(part)
+        await write(format_sse_message("done"), more_body=False)
+    except OSError:
+        # The client disconnected mid-write.
+        run.cancel()
+    finally:
+        watcher.cancel()
+
+def job_progress(job_id, seq):
+    """Whether the job has finished, and its events after ``seq``; both read from the job store."""
+    finished = job_store.get(job_id)["status"] in ("done", "failed")
+    return finished, job_store.events_after(job_id, seq)
+
+async def job_events(scope, receive, send, job_id):
+    """``main.job_events`` on the event loop: polls the job log instead of holding a thread."""
+    if await asyncio.to_thread(job_store.get, job_id) is None:
+        return await send_json(send, 404, {"error": "Job not found."})
+    # Without lifespan events, the first job stream starts the workers instead.
+    main.start_job_workers()
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    # EventSource sends Last-Event-ID when it reconnects; replay everything after it.
+    last_event_id = header(scope, "last-event-id")
+    after = (query.get("after") or ["0"])[0]
+    seq = int(last_event_id) if last_event_id.isdigit() else int(after) if after.isdigit() else 0
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+    watcher = asyncio.create_task(watch_disconnect())
+
+    encoder = SSEEncoder()
+    try:
+        write = await start_sse(scope, send)
+        while not disconnected.is_set():
+            finished, events = await asyncio.to_thread(job_progress, job_id, seq)
+            for seq, message in events:
+                # Only the last message of a group carries the id, as in main.py.
+                *leading, last = encoder.encode(message)
+                for part in leading:
+                    await write(part)
+                await write(f"id: {seq}\n{last}")
+            if finished and not events:
+                await write(format_sse_message("done"), more_body=False)
+                return
+            if not events:
+                try:
+                    await asyncio.wait_for(disconnected.wait(), timeout=config["asgi_job_poll_interval"])
+                except asyncio.TimeoutError:
+                    pass
+    except OSError:
+        # The client disconnected mid-write.
+        pass
+    finally:
+        watcher.cancel()
+
+async def wsgi_fallback(scope, receive, send):
+    """Serve every other route with the Flask app on the bridge's worker threads."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+    }
+    for key, value in scope["headers"]:
+        name = key.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            environ[f"HTTP_{name}"] = f"{environ[f'HTTP_{name}']},{value}" if f"HTTP_{name}" in environ else value
+
+    response_start = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response_headers]
+
+    loop = asyncio.get_running_loop()
+    iterable = await loop.run_in_executor(bridge_executor, main.app.wsgi_app, environ, start_response)
+    iterator = iter(iterable)
+    started = False
+    try:
+        while True:
+            chunk = await loop.run_in_executor(bridge_executor, next, iterator, None)
+            if not started:
+                await send({"type": "http.response.start", "status": response_start["status"], "headers": response_start["headers"]})
+                started = True
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(iterable, "close"):
+            await loop.run_in_executor(bridge_executor, iterable.close)
@@ -0,0 +1,718 @@
+## Benchmarks: the real main.py pipeline against the local stand-ins in fake_services.py
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import resource
+import threading
+import subprocess
+import tracemalloc
+from collections import Counter, defaultdict
+
+import pandas as pd
+import requests
+from werkzeug.serving import make_server
+
+import main
+from fake_services import Behaviour, FakeAIClient, FakeServer, FakeUpstreams, Latency
+
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+def upstream_behaviours(latency_scale=0.2, error_rate=0.0, payload_scale=1.0):
+    """Latency shaped like the live services, scaled down for quick runs.
+
+    ``ai`` is the default model; ``ai_models`` gives the other routed models
+    their rough relative speeds.
+    """
+    def behaviour(median, shape, payload_size, seed):
+        return Behaviour(Latency("lognormal", median, shape, scale=latency_scale), error_rate,
+                         max(1, int(payload_size * payload_scale)), seed)
+    return {
+        "serpapi": behaviour(1.2, 0.3, 10, 0),
+        "semrush": behaviour(0.8, 0.5, 50, 1),
+        "jina": behaviour(1.5, 0.6, 8000, 2),
+        "ai": behaviour(5.0, 0.4, 300, 3),
+        "ai_models": {
+            "openai:gpt-4.1-nano": behaviour(2.0, 0.4, 300, 4),
+            "openai:gpt-4.1-mini": behaviour(4.0, 0.4, 300, 5),
+            "openai:gpt-4o": behaviour(8.0, 0.4, 300, 6)
+        }
+    }
+
+def build_upstreams(latency_scale=0.2, error_rate=0.0, payload_scale=1.0):
+    return FakeUpstreams(**upstream_behaviours(latency_scale, error_rate, payload_scale))
+
+def scale_rate_limits(latency_scale):
+    """Speed the rate limiters up by the same factor the fakes' latencies are scaled down."""
+    for limits in main.config["rate_limits"].values():
+        if limits["rate"] is not None:
+            limits["rate"] = limits["rate"] / latency_scale
+    main.rate_limiters = main.build_rate_limiters()
+
+def use_single_model():
+    """Send every AI step to the default route, as before per-step routing."""
+    main.config["ai_routes"] = {"default": main.config["ai_routes"]["default"]}
+
+DRAFT_VARIANTS = [{"temperature": 0.7}, {"model": "openai:gpt-4.1-mini", "temperature": 0.8},
+                  {"temperature": 1.0}, {"model": "openai:gpt-4o", "temperature": 0.8}]
+
+def use_draft_variants(count, grace):
+    """Write ``count`` drafts per run in parallel; ``grace`` is scaled like the fakes' latencies."""
+    main.config["draft_variants"] = DRAFT_VARIANTS[:count]
+    main.config["draft_grace"] = grace
+
+def isolate_state(directory):
+    """Keep the benchmark's caches, jobs, checkpoints and quota counts out of the working tree."""
+    main.config["cache_enabled"] = False
+    main.config["ai_cache_enabled"] = False
+    main.checkpoint_store = main.CheckpointStore(os.path.join(directory, "checkpoints.sqlite3"))
+    main.job_store = main.JobStore(os.path.join(directory, "jobs.sqlite3"))
+    main.quota_store = main.QuotaStore(os.path.join(directory, "quota.sqlite3"))
+    for limiter in main.rate_limiters.values():
+        limiter.store, limiter.day = main.quota_store, None
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def latency_summary(values):
+    return {"p50": round(percentile(values, 0.5), 3), "p95": round(percentile(values, 0.95), 3), "n": len(values)}
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def bench_content_fetch(n_urls=10):
+    urls = [f"https://competitor{i}.example/post" for i in range(n_urls)]
+    start = time.perf_counter()
+    for url in urls:
+        main.fetch_content(url)
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in main.fetch_contents_concurrently(urls):
+        pass
+    concurrent = time.perf_counter() - start
+
+    workers = main.config["content_fetch_workers"]
+    print(f"content fetch ({n_urls} URLs): serial {serial:.2f}s, "
+          f"concurrent ({workers} workers) {concurrent:.2f}s, speedup {serial / concurrent:.1f}x")
+    return {"serial": round(serial, 3), "concurrent": round(concurrent, 3)}
+
+def bench_semrush(n_urls=10):
+    urls = [f"https://competitor{i}.example/post" for i in range(n_urls)]
+    start = time.perf_counter()
+    for url in urls:
+        main.get_semrush_data(url)
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main.fetch_semrush_concurrently(urls)
+    concurrent = time.perf_counter() - start
+
+    workers = main.config["semrush_workers"]
+    print(f"SEMRush lookups ({n_urls} URLs): serial {serial:.2f}s, "
+          f"concurrent ({workers} workers) {concurrent:.2f}s, speedup {serial / concurrent:.1f}x")
+    return {"serial": round(serial, 3), "concurrent": round(concurrent, 3)}
+
+def legacy_keyword_aggregation(semrush_results):
+    """The nested-scan aggregation process_semrush_data used before the keyword index."""
+    all_keywords = [item['Keyword'] for data in semrush_results if data for item in data]
+    keyword_counts = Counter(all_keywords)
+    highest_count = max(keyword_counts.values())
+    second_highest_count = sorted(set(keyword_counts.values()), reverse=True)[1] if len(set(keyword_counts.values())) > 1 else 0
+    top_keywords = [keyword for keyword, count in keyword_counts.items() if count == highest_count or count == second_highest_count]
+    if highest_count == 2:
+        top_keywords = [keyword for keyword, count in keyword_counts.items() if count in [1, 2]]
+    search_volume_keywords = sorted(
+        [(item['Keyword'], int(item['Search Volume'])) for data in semrush_results if data for item in data],
+        key=lambda x: x[1], reverse=True)[:10]
+    final_keywords = set(top_keywords + [keyword for keyword, _ in search_volume_keywords])
+    final_keywords_df = pd.DataFrame(
+        [(keyword,
+          next((item['Search Volume'] for data in semrush_results if data for item in data if item['Keyword'] == keyword), 0),
+          keyword_counts[keyword])
+         for keyword in final_keywords],
+        columns=['Keyword', 'Search Volume', 'Frequency'])
+    return final_keywords_df.sort_values(by=['Frequency', 'Search Volume'], ascending=[False, False])
+
+def synthetic_semrush_results(n_urls=100, n_keywords=50, vocabulary=1000, seed=0):
+    rng = random.Random(seed)
+    urls = [f"http://example.com/{i}" for i in range(n_urls)]
+    results = [
+        main.KeywordTable.from_rows([{'Keyword': f"keyword {rng.randrange(vocabulary)}", 'Position': position,
+                                      'Search Volume': rng.randrange(10, 100000)}
+                                     for position in range(1, n_keywords + 1)])
+        for _ in urls
+    ]
+    return urls, results
+
+def bench_keyword_aggregation(cases=((10, 50, 1000), (10, 50, 100000), (10, 500, 100000), (100, 50, 1000), (100, 200, 100000))):
+    for n_urls, n_keywords, vocabulary in cases:
+        urls, results = synthetic_semrush_results(n_urls, n_keywords, vocabulary)
+        # The nested scan read row dicts.
+        rows = [table.rows() for table in results]
+        selected = len(legacy_keyword_aggregation(rows))
+        legacy_time = best_of(lambda: legacy_keyword_aggregation(rows))
+        indexed_time = best_of(lambda: main.select_final_keywords(main.build_keyword_index(urls, results)))
+        print(f"keyword aggregation ({n_urls} URLs x {n_keywords} keywords, vocabulary {vocabulary}, "
+              f"{selected} selected): nested scan {legacy_time * 1000:.1f}ms, keyword index {indexed_time * 1000:.1f}ms")
+
+def legacy_semrush_parse(body):
+    """The split-based parser get_semrush_data used before parse_semrush_csv."""
+    lines = body.decode('utf-8').split('\r\n')
+    headers = lines[0].split(';')
+    return [dict(zip(headers, line.split(';'))) for line in lines[1:] if line]
+
+def bench_semrush_parse(n_rows=5000):
+    rng = random.Random(0)
+    body = ("Keyword;Position;Search Volume;CPC;Competition\r\n" + "".join(
+        f"keyword {i};{rng.randrange(1, 100)};{rng.randrange(10, 100000)};{rng.random() * 5:.2f};{rng.random():.2f}\r\n"
+        for i in range(n_rows))).encode('utf-8')
+
+    def legacy():
+        records = legacy_semrush_parse(body)
+        # Downstream code cast the volume on every use.
+        return sorted(records, key=lambda item: int(item['Search Volume']), reverse=True)
+
+    def parse():
+        lines = (line.decode('utf-8') for line in io.BytesIO(body))
+        return main.parse_semrush_csv(line.rstrip('\r\n') for line in lines)
+
+    def streamed():
+        volumes = parse().column('Search Volume')
+        return sorted(range(len(volumes)), key=volumes.__getitem__, reverse=True)
+
+    print(f"SEMRush parse + volume sort ({n_rows} rows): split parser {best_of(legacy) * 1000:.1f}ms, "
+          f"typed streaming parser {best_of(streamed) * 1000:.1f}ms")
+    _, table_peak = measure_memory(parse)
+    _, rows_peak = measure_memory(lambda: parse().rows())
+    print(f"SEMRush keywords in memory ({n_rows} rows): columns {table_peak:.1f} MiB peak, "
+          f"as row dicts {rows_peak:.1f} MiB peak")
+
+def legacy_frame_flow(serp_rows, urls, semrush_results, contents):
+    """How the serp, semrush and content stages shaped their data when they passed DataFrames around."""
+    df_serp = pd.DataFrame(serp_rows)
+    [{'Position': row['Position'], 'Link': row['Link'], 'Title': row['Title']} for _, row in df_serp.iterrows()]
+    df_results = df_serp.copy()
+    df_results['SEMRush_Data'] = semrush_results
+    keywords = main.select_final_keywords(main.build_keyword_index(urls, semrush_results))
+    keywords_df = pd.DataFrame([record.row() for record in keywords], columns=['Keyword', 'Search Volume', 'Frequency'])
+    semrush_data = [{'Position': row['Position'], 'Link': row['Link'], 'Title': row['Title'], 'SEMRush Data': row['SEMRush_Data']}
+                    for _, row in df_results.iterrows()]
+    common = [{'Keyword': row['Keyword'], 'Frequency': row['Frequency'], 'Search Volume': row['Search Volume']}
+              for _, row in keywords_df.iterrows()]
+    rows = df_serp.to_dict('records')
+    pages = [{'Position': row['Position'], 'Link': row['Link'], 'Title': row['Title'], 'Content': content}
+             for row, content in zip(rows, contents)]
+    return semrush_data, common, pages
+
+def record_flow(serp_rows, urls, semrush_results, contents):
+    serp_results = [main.SerpResult.from_row(row) for row in serp_rows]
+    main.serp_rows(serp_results)
+    keywords = main.select_final_keywords(main.build_keyword_index(urls, semrush_results))
+    output, complete_data = main.semrush_stage_output(serp_results, semrush_results, keywords)
+    pages = [{**result.row(), 'Content': content} for result, content in zip(serp_results, contents)]
+    return output["results"], complete_data["common_keywords"], pages
+
+def bench_records(n_urls=10, n_keywords=50, repeat=20):
+    """CPU time and allocation peak of the per-run result shaping, DataFrames against records."""
+    urls, semrush_results = synthetic_semrush_results(n_urls, n_keywords)
+    serp_rows = [{'Position': i + 1, 'Link': url, 'Title': f"Result {i + 1}"} for i, url in enumerate(urls)]
+    contents = [f"content {i}" for i in range(n_urls)]
+    results = {}
+    for name, flow in (("dataframe", legacy_frame_flow), ("records", record_flow)):
+        flow(serp_rows, urls, semrush_results, contents)
+        start = time.process_time()
+        for _ in range(repeat):
+            flow(serp_rows, urls, semrush_results, contents)
+        cpu = (time.process_time() - start) / repeat
+        _, peak = measure_memory(flow, serp_rows, urls, semrush_results, contents)
+        results[name] = {"cpu_ms": round(cpu * 1000, 2), "peak_kib": round(peak * 1024, 1)}
+    print(f"result shaping per run ({n_urls} URLs x {n_keywords} keywords): DataFrames {results['dataframe']['cpu_ms']:.2f}ms CPU, "
+          f"{results['dataframe']['peak_kib']:.0f} KiB peak; records {results['records']['cpu_ms']:.2f}ms CPU, "
+          f"{results['records']['peak_kib']:.0f} KiB peak")
+    return results
+
+def bench_prompt_tables(n_urls=10, n_keywords=50):
+    """Prompt tokens of the keyword and competitor sections, as interpolated before and as tables."""
+    urls, semrush_results = synthetic_semrush_results(n_urls, n_keywords)
+    serp_results = [main.SerpResult(i + 1, url, f"Result {i + 1}") for i, url in enumerate(urls)]
+    keywords = main.select_final_keywords(main.build_keyword_index(urls, semrush_results))
+    output, _ = main.semrush_stage_output(serp_results, semrush_results, keywords)
+    sections = {
+        # /progress passed every URL's SEMRush rows; the CLI passed the keyword DataFrame.
+        "keywords (/progress)": (f"{output['results']}", main.keywords_table(keywords)),
+        "keywords (CLI)": (f"{pd.DataFrame([record.row() for record in keywords])}", main.keywords_table(keywords)),
+        "competitors": (f"{pd.DataFrame([result.row() for result in serp_results])}", main.competitors_table(serp_results))
+    }
+    results = {}
+    for name, (before, after) in sections.items():
+        results[name] = {"before": main.estimate_tokens(before), "after": main.estimate_tokens(after)}
+        print(f"prompt section {name} ({n_urls} URLs x {n_keywords} keywords): "
+              f"{results[name]['before']} -> {results[name]['after']} tokens")
+    return results
+
+def bench_pipeline(iterations=5):
+    """End-to-end and per-stage latency of sequential ``run_topic`` calls."""
+    stage_durations = defaultdict(list)
+    totals = []
+    for i in range(iterations):
+        events = []
+        started = time.perf_counter()
+        context = main.run_topic(f"benchmark topic {i}", events.append)
+        totals.append(time.perf_counter() - started)
+        if "final" not in context:
+            print(f"  run {i} did not complete")
+        timings = next(json.loads(message[6:])["data"] for message in events if message.startswith('data: {"type": "timings"'))
+        for name, timing in timings.items():
+            if name != "total":
+                stage_durations[name].append(timing["duration"])
+    stages = {name: latency_summary(values) for name, values in stage_durations.items()}
+    result = {"end_to_end": latency_summary(totals), "stages": stages}
+    print(f"pipeline ({iterations} runs): end-to-end p50 {result['end_to_end']['p50']:.2f}s, "
+          f"p95 {result['end_to_end']['p95']:.2f}s")
+    for name, summary in stages.items():
+        print(f"  {name:<10} p50 {summary['p50']:6.2f}s  p95 {summary['p95']:6.2f}s")
+    return result
+
+def bench_rate_limits(runs=4, urls_per_run=10, provider_rate=10):
+    """Overlapping runs' content fetches against a Jina stand-in that answers 429 above ``provider_rate``/s.
+
+    Compares the shared token bucket switched off with one set a little under the
+    provider's limit, as the rates in ``config["rate_limits"]`` should be.
+    """
+    saved_url, saved_limiter = main.config["jina_url"], main.rate_limiters.get("jina")
+    results = {}
+    try:
+        for name, rate in (("unthrottled", None), ("rate limited", provider_rate * 0.9)):
+            server = FakeServer("jina", Behaviour(Latency("fixed", 0.05), payload_size=2000, seed=7, rate_limit=provider_rate))
+            main.config["jina_url"] = server.url
+            main.http_session = main.build_http_session()
+            main.rate_limiters["jina"] = main.RateLimiter("jina", rate=rate, burst=provider_rate // 2)
+            failures = []
+
+            def run(index):
+                main.active_run_metrics.set(main.RunMetrics())
+                urls = [f"https://competitor{index}-{i}.example/" for i in range(urls_per_run)]
+                failures.extend(content for _, content in main.fetch_contents_concurrently(urls) if content.startswith("ERROR:"))
+
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(runs)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = {"seconds": round(time.perf_counter() - started, 2), "requests": server.requests,
+                             "429s": server.throttled, "failed": len(failures)}
+            server.shutdown()
+            server.server_close()
+            print(f"rate limits ({runs} runs x {urls_per_run} pages, provider limit {provider_rate}/s), {name}: "
+                  f"{results[name]['seconds']:.2f}s, {results[name]['requests']} requests, "
+                  f"{results[name]['429s']} answered 429, {results[name]['failed']} pages failed")
+    finally:
+        main.config["jina_url"] = saved_url
+        main.http_session = main.build_http_session()
+        if saved_limiter is not None:
+            main.rate_limiters["jina"] = saved_limiter
+    return results
+
+def stream_progress(base_url, topic):
+    """Consume one /progress stream; returns (seconds, completed)."""
+    started = time.perf_counter()
+    completed = False
+    with requests.get(f"{base_url}/progress", params={"topic": topic}, stream=True, timeout=600) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("data: "):
+                event = json.loads(line[6:])
+                if event["type"] == "complete" and event.get("step") == "final":
+                    completed = True
+                elif event["type"] == "done":
+                    break
+    return time.perf_counter() - started, completed
+
+def bench_concurrent_clients(clients=4, runs_per_client=2):
+    """Throughput of the Flask app with ``clients`` concurrent /progress streams."""
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def client(index):
+        for run in range(runs_per_client):
+            seconds, completed = stream_progress(base_url, f"concurrent topic {index}-{run}")
+            with lock:
+                latencies.append(seconds)
+                if not completed:
+                    failures.append(index)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    server.shutdown()
+
+    runs = clients * runs_per_client
+    result = {"clients": clients, "runs": runs, "failed": len(failures), "wall": round(wall, 3),
+              "runs_per_minute": round(runs / wall * 60, 2), "latency": latency_summary(latencies)}
+    print(f"/progress with {clients} concurrent clients ({runs} runs, {len(failures)} incomplete): "
+          f"{result['runs_per_minute']:.1f} runs/min, latency p50 {result['latency']['p50']:.2f}s "
+          f"p95 {result['latency']['p95']:.2f}s")
+    return result
+
+def completed_run(lines):
+    """Whether an SSE stream (an iterable of lines) reached the final step before ``done``."""
+    completed = False
+    for line in lines:
+        if line.startswith("data: "):
+            event = json.loads(line[6:])
+            if event["type"] == "complete" and event.get("step") == "final":
+                completed = True
+            elif event["type"] == "done":
+                break
+    return completed
+
+class ProcessSampler:
+    """Track this process's peak RSS and thread count from /proc while a load test runs."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def status():
+        fields = {}
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value.split()
+        return int(fields["VmRSS"][0]) * 1024, int(fields["Threads"][0])
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss, threads = self.status()
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_threads = max(self.peak_threads, threads)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+METRICS_PROBE_INTERVAL = 0.5
+
+def drive_flask(connections, topic, route="progress"):
+    """Hold ``connections`` concurrent streams open on the Flask app, one thread each.
+
+    ``route`` is "progress" (GET /progress) or "jobs" (POST /jobs, then tail its
+    events, as the UI does). Returns the per-connection results and the latencies of
+    /metrics requests made while the streams are open.
+    """
+    results = [None] * connections
+    probes = []
+    finished = threading.Event()
+
+    def client(index):
+        started = time.perf_counter()
+        test_client = main.app.test_client()
+        if route == "jobs":
+            events_url = test_client.post("/jobs", json={"topic": f"{topic} {index}"}).get_json()["events_url"]
+            response = test_client.get(events_url, buffered=False)
+        else:
+            response = test_client.get("/progress", query_string={"topic": f"{topic} {index}"}, buffered=False)
+        try:
+            completed = completed_run(line for chunk in response.response for line in chunk.decode("utf-8").splitlines())
+        finally:
+            response.close()
+        results[index] = (time.perf_counter() - started, completed)
+
+    def probe():
+        while not finished.wait(METRICS_PROBE_INTERVAL):
+            started = time.perf_counter()
+            main.app.test_client().get("/metrics")
+            probes.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(connections)]
+    prober = threading.Thread(target=probe)
+    for thread in threads + [prober]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished.set()
+    prober.join()
+    return results, probes
+
+async def asgi_request(method, path, query="", body=None):
+    """Make one request to the ASGI app; returns the response body."""
+    import asgi
+
+    finished = asyncio.Event()
+    chunks = []
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": json.dumps(body).encode("utf-8") if body else b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message["body"])
+            if not message.get("more_body"):
+                finished.set()
+
+    scope = {"type": "http", "method": method, "path": path, "headers": [(b"content-type", b"application/json")],
+             "query_string": query.encode("latin-1")}
+    await asgi.app(scope, receive, send)
+    finished.set()
+    return b"".join(chunks)
+
+def drive_asgi(connections, topic, route="progress"):
+    """Hold ``connections`` concurrent streams open on the ASGI app, one task each (see ``drive_flask``)."""
+    import asgi
+
+    probes = []
+    finished = asyncio.Event()
+
+    async def client(index):
+        started = time.perf_counter()
+        if route == "jobs":
+            job = json.loads(await asgi_request("POST", "/jobs", body={"topic": f"{topic} {index}"}))
+            body = await asgi_request("GET", job["events_url"])
+        else:
+            body = await asgi_request("GET", "/progress", f"topic={topic.replace(' ', '+')}+{index}")
+        return time.perf_counter() - started, completed_run(body.decode("utf-8").splitlines())
+
+    async def probe():
+        while True:
+            try:
+                await asyncio.wait_for(finished.wait(), METRICS_PROBE_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                started = time.perf_counter()
+                await asgi_request("GET", "/metrics")
+                probes.append(time.perf_counter() - started)
+
+    async def run():
+        prober = asyncio.create_task(probe())
+        try:
+            results = await asyncio.gather(*(client(index) for index in range(connections)))
+            finished.set()
+            await prober
+            return results, probes
+        finally:
+            await asgi.get_upstreams().aclose()
+            asgi.upstreams = None
+    return asyncio.run(run())
+
+SERVING_UPSTREAM_CONCURRENCY = 64
+
+def serving_worker(path, connections, urls, latency_scale, error_rate, payload_scale, route="progress"):
+    """Load-test one serving path in this (fresh) process; returns its measurements.
+
+    The fake upstreams run in the parent process, so the RSS and thread counts
+    sampled here belong to the app alone. Both paths get the same raised
+    per-provider concurrency limit, as a deployment serving many streams would.
+    Through /jobs, there is a job worker per connection so every job runs at once.
+    """
+    main.config.update(urls)
+    main.config["upstream_concurrency"] = {provider: max(limit, SERVING_UPSTREAM_CONCURRENCY) for provider, limit in main.config["upstream_concurrency"].items()}
+    main.upstream_slots = {provider: threading.BoundedSemaphore(limit) for provider, limit in main.config["upstream_concurrency"].items()}
+    # Provider rate limits would throttle this many streams; the load test measures the serving paths.
+    main.rate_limiters = {}
+    main.http_session = main.build_http_session()
+    behaviours = upstream_behaviours(latency_scale, error_rate, payload_scale)
+    main.client = FakeAIClient(behaviours["ai"], behaviours["ai_models"])
+    if route == "jobs":
+        main.config["job_workers"] = max(main.config["job_workers"], connections)
+    drive = drive_flask if path == "flask" else drive_asgi
+    with tempfile.TemporaryDirectory() as directory:
+        isolate_state(directory)
+        # One warm-up run so imports, caches, pools and job workers are not counted per connection.
+        drive(1, "warm-up topic", route)
+        baseline_rss, baseline_threads = ProcessSampler.status()
+        started = time.perf_counter()
+        with ProcessSampler() as sampler:
+            results, probes = drive(connections, "load topic", route)
+        wall = time.perf_counter() - started
+    return {
+        "path": path, "route": route, "connections": connections, "completed": sum(1 for _, completed in results if completed),
+        "wall": round(wall, 3), "latency": latency_summary([seconds for seconds, _ in results]),
+        "metrics_latency": latency_summary(probes),
+        "baseline_rss_mib": round(baseline_rss / 2 ** 20, 1), "peak_rss_mib": round(sampler.peak_rss / 2 ** 20, 1),
+        "kib_per_connection": round((sampler.peak_rss - baseline_rss) / 1024 / connections, 1),
+        "baseline_threads": baseline_threads, "peak_threads": sampler.peak_threads
+    }
+
+def bench_serving_load(connection_counts, args):
+    """Compare the Flask and ASGI serving paths at each concurrent connection count, through ``args.serving_route``."""
+    urls = {
+        "serpapi_url": main.config["serpapi_url"], "semrush_url": main.config["semrush_url"],
+        "jina_url": main.config["jina_url"], "openai_base_url": main.config["openai_base_url"]
+    }
+    results = []
+    for connections in connection_counts:
+        for path in ("flask", "asgi"):
+            command = [sys.executable, os.path.abspath(__file__), "--serving-worker", path, str(connections), json.dumps(urls),
+                       "--serving-route", args.serving_route,
+                       "--latency-scale", str(args.latency_scale), "--error-rate", str(args.error_rate),
+                       "--payload-scale", str(args.payload_scale)]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{path:<5} {connections:>4} connections: {result['completed']}/{connections} completed in {result['wall']:.1f}s, "
+                  f"p50 {result['latency']['p50']:.2f}s p95 {result['latency']['p95']:.2f}s, "
+                  f"{result['kib_per_connection']:.0f} KiB/connection (peak RSS {result['peak_rss_mib']} MiB), "
+                  f"peak threads {result['peak_threads']}, /metrics p95 {result['metrics_latency']['p95']:.3f}s")
+    return results
+
+def bench_import_time(module="main", repeat=5):
+    """Cold import time of ``module`` from ``python -X importtime`` (best of ``repeat``).
+
+    Returns the module's cumulative time and its slowest direct imports, in ms.
+    """
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stderr
+        # "import time: self [us] | cumulative | imported package", nested imports indented by two spaces.
+        rows = [line.split("|") for line in output.splitlines() if line.startswith("import time:") and "cumulative" not in line]
+        direct = {name.strip(): int(cumulative) / 1000 for _, cumulative, name in rows if name.startswith("   ") and not name.startswith("    ")}
+        total = next(int(cumulative) / 1000 for _, cumulative, name in rows if name.strip() == module)
+        if best is None or total < best["total_ms"]:
+            best = {"total_ms": round(total, 1),
+                    "slowest_imports": {name: round(ms, 1) for name, ms in sorted(direct.items(), key=lambda item: -item[1])[:5]}}
+    print(f"import {module}: {best['total_ms']:.0f}ms (slowest: "
+          + ", ".join(f"{name} {ms:.0f}ms" for name, ms in best["slowest_imports"].items()) + ")")
+    return best
+
+def measure_memory(func, *args):
+    """Run ``func`` under tracemalloc; returns (result, peak traced MiB)."""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2 ** 20
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Return the p95 latencies (and import time) that regressed by more than ``tolerance`` (a fraction)."""
+    regressions = []
+    checks = [("end_to_end", results["pipeline"]["end_to_end"], baseline["pipeline"]["end_to_end"])]
+    checks += [(f"stage {name}", summary, baseline["pipeline"]["stages"].get(name))
+               for name, summary in results["pipeline"]["stages"].items()]
+    if "concurrency" in results and "concurrency" in baseline:
+        checks.append(("concurrent /progress", results["concurrency"]["latency"], baseline["concurrency"]["latency"]))
+    for name, current, previous in checks:
+        if previous and previous["p95"] > 0 and current["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95']:.2f}s -> {current['p95']:.2f}s")
+    if "import_time" in baseline and results["import_time"]["total_ms"] > baseline["import_time"]["total_ms"] * (1 + tolerance):
+        regressions.append(f"import main: {baseline['import_time']['total_ms']:.0f}ms -> {results['import_time']['total_ms']:.0f}ms")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against local stand-ins for every upstream service.")
+    parser.add_argument("--iterations", type=int, default=5, help="sequential pipeline runs (default: 5)")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent /progress clients, 0 to skip (default: 4)")
+    parser.add_argument("--runs-per-client", type=int, default=2, help="runs per concurrent client (default: 2)")
+    parser.add_argument("--latency-scale", type=float, default=0.2,
+                        help="multiplier on the fakes' latency profiles; 1.0 approximates the live APIs (default: 0.2)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake requests answered with 503 (default: 0)")
+    parser.add_argument("--payload-scale", type=float, default=1.0, help="multiplier on fake payload sizes (default: 1.0)")
+    parser.add_argument("--single-model", action="store_true", help="route every AI step to the default model")
+    parser.add_argument("--draft-variants", type=int, default=0, choices=range(len(DRAFT_VARIANTS) + 1), metavar="N",
+                        help=f"write N speculative drafts per run (at most {len(DRAFT_VARIANTS)}; default: one draft)")
+    parser.add_argument("--micro", action="store_true", help="also run the keyword aggregation, SEMRush parse, result shaping, prompt table and rate limit micro-benchmarks")
+    parser.add_argument("--serving-load", metavar="N[,N...]",
+                        help="also compare the Flask and ASGI paths with N concurrent connections each")
+    parser.add_argument("--serving-route", choices=("progress", "jobs"), default="jobs",
+                        help="stream each --serving-load connection from /progress, or from POST /jobs and its events as the UI does (default: jobs)")
+    parser.add_argument("--serving-worker", nargs=3, metavar=("PATH", "N", "URLS"), help=argparse.SUPPRESS)
+    parser.add_argument("--json", metavar="PATH", help="write the results to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare p95 latencies with an earlier --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression against --baseline (default: 0.2)")
+    args = parser.parse_args()
+
+    if args.serving_worker:
+        path, connections, urls = args.serving_worker
+        print(json.dumps(serving_worker(path, int(connections), json.loads(urls), args.latency_scale, args.error_rate, args.payload_scale,
+                                        args.serving_route)))
+        sys.exit(0)
+
+    upstreams = build_upstreams(args.latency_scale, args.error_rate, args.payload_scale).install(main)
+    scale_rate_limits(args.latency_scale)
+    if args.single_model:
+        use_single_model()
+    if args.draft_variants:
+        use_draft_variants(args.draft_variants, main.config["draft_grace"] * args.latency_scale)
+    results = {"settings": vars(args)}
+    results["import_time"] = bench_import_time()
+    with tempfile.TemporaryDirectory() as directory:
+        isolate_state(directory)
+        results["content_fetch"] = bench_content_fetch()
+        results["semrush"] = bench_semrush()
+        if args.micro:
+            bench_keyword_aggregation()
+            bench_semrush_parse()
+            results["records"] = bench_records()
+            results["prompt_tables"] = bench_prompt_tables()
+            results["rate_limits"] = bench_rate_limits()
+        results["pipeline"], pipeline_peak = measure_memory(bench_pipeline, args.iterations)
+        if args.clients:
+            results["concurrency"], concurrency_peak = measure_memory(bench_concurrent_clients, args.clients, args.runs_per_client)
+        else:
+            concurrency_peak = 0.0
+        if args.serving_load:
+            results["serving_load"] = bench_serving_load([int(n) for n in args.serving_load.split(",")], args)
+    results["memory"] = {
+        "pipeline_peak_mib": round(pipeline_peak, 1),
+        "concurrency_peak_mib": round(concurrency_peak, 1),
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    results["upstream_requests"] = upstreams.request_counts()
+    results["ai_models"] = dict(upstreams.ai.model_requests)
+    print(f"memory: pipeline peak {results['memory']['pipeline_peak_mib']} MiB, concurrent peak "
+          f"{results['memory']['concurrency_peak_mib']} MiB (traced), max RSS {results['memory']['max_rss_mib']} MiB")
+    print(f"upstream requests: {results['upstream_requests']}, AI models: {results['ai_models']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
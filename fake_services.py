@@ -0,0 +1,310 @@
+## Deterministic local stand-ins for SerpAPI, SEMRush, Jina Reader and the AI client
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, unquote, urlsplit
+
+class Latency:
+    """A latency distribution in seconds.
+
+    ``kind`` is ``fixed`` (``a`` seconds), ``uniform`` (between ``a`` and ``b``)
+    or ``lognormal`` (median ``a``, shape ``b``). ``scale`` multiplies every draw,
+    which makes it easy to shrink a realistic profile for quick runs.
+    """
+
+    def __init__(self, kind="fixed", a=0.0, b=0.0, scale=1.0):
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self.scale = scale
+
+    def sample(self, rng):
+        if self.kind == "fixed":
+            value = self.a
+        elif self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = self.a * math.exp(rng.gauss(0, self.b))
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.kind}")
+        return value * self.scale
+
+class Behaviour:
+    """How a fake service responds: latency, share of 503s and payload size.
+
+    ``rate_limit`` (requests per second, with a burst of the same size) makes the
+    service answer 429 with ``Retry-After: 1`` once it is exceeded, like the live APIs.
+    ``script`` lists statuses to answer the first requests with (e.g. ``[503, 503]``)
+    before the service behaves normally; a scripted 429 also carries ``Retry-After: 1``.
+    An entry may also be a ``(status, body)`` pair, e.g. SEMRush's
+    ``(200, "ERROR 132 :: API UNITS BALANCE IS ZERO")``.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, payload_size=50, seed=0, rate_limit=None, script=None):
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.rate_limit = rate_limit
+        self.script = list(script or [])
+        self._tokens = rate_limit
+        self._updated = time.monotonic()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Return ``(delay, fail)`` for one request."""
+        with self._lock:
+            return self.latency.sample(self._rng), self._rng.random() < self.error_rate
+
+    def scripted(self):
+        """The next scripted status, or ``None`` once the script has run out."""
+        with self._lock:
+            return self.script.pop(0) if self.script else None
+
+    def admit(self):
+        """Whether a request fits within ``rate_limit``."""
+        if self.rate_limit is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+def stable_random(*parts):
+    """A ``random.Random`` seeded from ``parts``, so payloads are identical across runs."""
+    return random.Random(zlib.crc32("\x1f".join(map(str, parts)).encode("utf-8")))
+
+def serp_payload(query, size):
+    rng = stable_random("serp", query)
+    return {"organic_results": [
+        {"position": position, "link": f"https://competitor{rng.randrange(10 ** 6)}.example/{position}",
+         "title": f"{query} guide {position}"}
+        for position in range(1, size + 1)
+    ]}
+
+def semrush_payload(url, size, vocabulary=400):
+    rng = stable_random("semrush", url)
+    rows = ["Keyword;Position;Search Volume;CPC;Competition"]
+    for _ in range(size):
+        rows.append(f"keyword {rng.randrange(vocabulary)};{rng.randrange(1, 50)};{rng.randrange(10, 100000)};"
+                    f"{rng.random() * 5:.2f};{rng.random():.2f}")
+    return "\r\n".join(rows) + "\r\n"
+
+def page_payload(url, size):
+    """Markdown of roughly ``size`` characters with some shared boilerplate."""
+    rng = stable_random("page", url)
+    paragraphs = ["Subscribe to our newsletter for the latest updates.", f"# Article at {url}"]
+    length = 0
+    while length < size:
+        words = " ".join(f"term{rng.randrange(2000)}" for _ in range(rng.randrange(40, 120)))
+        paragraphs.append(words.capitalize() + ".")
+        length += len(words)
+    paragraphs.append("© All rights reserved. Privacy Policy | Terms of Service")
+    return "\n\n".join(paragraphs)
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        behaviour = self.server.behaviour
+        if not behaviour.admit():
+            self.server.count(throttled=True)
+            return self.reply(429, b"Too Many Requests", "text/plain", {"Retry-After": "1"})
+        delay, fail = behaviour.draw()
+        time.sleep(delay)
+        self.server.count()
+        status = behaviour.scripted()
+        if status is not None:
+            status, body = status if isinstance(status, tuple) else (status, "Scripted failure")
+            return self.reply(status, body.encode("utf-8"), "text/plain", {"Retry-After": "1"} if status == 429 else None)
+        if fail:
+            return self.reply(503, b"Service Unavailable", "text/plain")
+        parts = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        kind = self.server.kind
+        if kind == "serpapi":
+            body = json.dumps(serp_payload(params.get("q", ""), behaviour.payload_size))
+            return self.reply(200, body.encode("utf-8"), "application/json")
+        if kind == "semrush":
+            return self.reply(200, semrush_payload(params.get("url", ""), behaviour.payload_size).encode("utf-8"), "text/csv")
+        if kind == "jina":
+            url = unquote(parts.path.lstrip("/"))
+            body = json.dumps({"code": 200, "data": {"content": page_payload(url, behaviour.payload_size)}})
+            return self.reply(200, body.encode("utf-8"), "application/json")
+        self.reply(404, b"Not Found", "text/plain")
+
+    def do_POST(self):
+        """OpenAI-compatible ``/chat/completions``, as used by the async path in asgi.py."""
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.server.kind != "openai" or not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.reply(404, b"Not Found", "text/plain")
+        behaviour = self.server.models.get(f"openai:{request.get('model')}", self.server.behaviour)
+        delay, fail = behaviour.draw()
+        self.server.count()
+        if fail:
+            time.sleep(delay)
+            return self.reply(503, b"Service Unavailable", "text/plain")
+        words = completion_words(request.get("model", ""), request.get("messages", []), behaviour.payload_size)
+        if not request.get("stream"):
+            time.sleep(delay)
+            text = " ".join(words)
+            prompt_tokens = sum(len(message["content"]) for message in request.get("messages", [])) // 4
+            body = json.dumps({"choices": [{"message": {"role": "assistant", "content": text}}],
+                               "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4}})
+            return self.reply(200, body.encode("utf-8"), "application/json")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunks = completion_chunks(words)
+        try:
+            for chunk in chunks:
+                time.sleep(delay / len(chunks))
+                event = {"choices": [{"delta": {"content": chunk}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the completion mid-stream.
+            pass
+
+    def reply(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a cancelled draft).
+            pass
+
+class FakeServer(ThreadingHTTPServer):
+    """One fake upstream API on 127.0.0.1, served from a background thread."""
+
+    daemon_threads = True
+    # The default backlog of 5 drops bursts of concurrent connects into SYN retries.
+    request_queue_size = 1024
+
+    def __init__(self, kind, behaviour):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.kind = kind
+        self.behaviour = behaviour
+        # Per-model behaviours for the openai server, keyed like the aisuite model names.
+        self.models = {}
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def count(self, throttled=False):
+        with self._lock:
+            self.requests += 1
+            self.throttled += throttled
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+def completion_words(model, messages, size):
+    rng = stable_random("ai", model, messages[-1]["content"][:200] if messages else "")
+    return [f"word{rng.randrange(5000)}" for _ in range(size)]
+
+def completion_chunks(words, chunk_words=8):
+    return [" ".join(words[i:i + chunk_words]) + " " for i in range(0, len(words), chunk_words)]
+
+class FakeAIClient:
+    """Mimics ``aisuite.Client().chat.completions.create``, streaming or not.
+
+    Each completion waits ``latency`` and returns ``payload_size`` words; a
+    streamed completion spreads the latency over its chunks. ``models`` maps model
+    names to their own behaviour (``behaviour`` covers the rest), and a call whose
+    latency exceeds its ``timeout`` raises ``TimeoutError`` after the timeout. The
+    ``openai`` fake server returns the same completions over HTTP.
+    """
+
+    def __init__(self, behaviour, models=None):
+        self.behaviour = behaviour
+        self.models = models or {}
+        self.requests = 0
+        self.model_requests = Counter()
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature=None, stream=False, timeout=None):
+        behaviour = self.models.get(model, self.behaviour)
+        delay, fail = behaviour.draw()
+        with self._lock:
+            self.requests += 1
+            self.model_requests[model] += 1
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake AI provider timed out after {timeout}s")
+        if fail:
+            time.sleep(delay)
+            raise RuntimeError("Fake AI provider error")
+        words = completion_words(model, messages, behaviour.payload_size)
+        text = " ".join(words)
+        if stream:
+            return self._stream(words, delay)
+        time.sleep(delay)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text) // 4)
+        )
+
+    def _stream(self, words, delay):
+        chunks = completion_chunks(words)
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))])
+
+class FakeUpstreams:
+    """Start the fake services and point a loaded ``main`` module at them."""
+
+    def __init__(self, serpapi=None, semrush=None, jina=None, ai=None, ai_models=None):
+        self.servers = {
+            "serpapi": FakeServer("serpapi", serpapi or Behaviour(Latency("fixed", 0.5), payload_size=10)),
+            "semrush": FakeServer("semrush", semrush or Behaviour(Latency("fixed", 0.5), payload_size=50, seed=1)),
+            "jina": FakeServer("jina", jina or Behaviour(Latency("fixed", 0.5), payload_size=8000, seed=2)),
+        }
+        ai = ai or Behaviour(Latency("fixed", 1.0), payload_size=200, seed=3)
+        self.ai = FakeAIClient(ai, ai_models)
+        self.servers["openai"] = FakeServer("openai", ai)
+        self.servers["openai"].models = ai_models or {}
+
+    def install(self, main):
+        main.config["serpapi_url"] = self.servers["serpapi"].url + "search.json"
+        main.config["semrush_url"] = self.servers["semrush"].url
+        main.config["jina_url"] = self.servers["jina"].url
+        main.config["openai_base_url"] = self.servers["openai"].url + "v1"
+        main.http_session = main.build_http_session()
+        main.client = self.ai
+        return self
+
+    def request_counts(self):
+        counts = {name: server.requests for name, server in self.servers.items()}
+        counts["ai"] = self.ai.requests + counts.pop("openai")
+        return counts
+
+    def close(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
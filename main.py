@@ -1,14 +1,32 @@
-import aisuite as ai
 import os
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from collections import Counter
-from urllib.parse import quote
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from urllib.parse import quote, urlsplit, urlunsplit
 import logging
 import json
-from flask import Flask, request, render_template, Response
+import re
+from flask import Flask, request, render_template, Response, jsonify, url_for
 import sys
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+import argparse
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+import functools
+import itertools
+import array
+import csv
+import hashlib
+import queue
+import heapq
+import sqlite3
+import threading
+import uuid
+import time
+import zlib
 
 def format_sse_message(type_str, **kwargs):
     data = {"type": type_str}
@@ -24,54 +42,920 @@ config = {
     "semrush_display_limit": 50,
     "semrush_display_filter": "%2B%7CPo%7CLt%7C50",
     "semrush_display_sort": "po_asc",
+    "semrush_workers": 5,
+    "semrush_timeout": 30,
+    "semrush_chunk_size": 64 * 1024,
+    "serpapi_timeout": 30,
     "jina_api_timeout": 15,
-    "openai_model": "openai:gpt-4o-mini",
-    "openai_temperature": 0.8
+    "jina_read_timeout": 30,
+    "content_fetch_workers": 5,
+    # Upstream endpoints; benchmark.py points these at local stand-ins.
+    "serpapi_url": "https://serpapi.com/search.json",
+    "semrush_url": "https://api.semrush.com/",
+    "jina_url": "https://r.jina.ai/",
+    # OpenAI-compatible chat completions endpoint used by the async path in asgi.py.
+    "openai_base_url": "https://api.openai.com/v1",
+    "http_connect_timeout": 5,
+    "http_retries": 3,
+    "http_backoff_factor": 0.5,
+    "upstream_concurrency": {"serpapi": 2, "semrush": 10, "jina": 10, "ai": 8},
+    # Token buckets shared by every run: "rate" requests per second, set a little under the
+    # provider's limit, refill up to "burst" (a rate of None disables throttling).
+    # "daily_units" caps what a provider bills per UTC day, None for no cap: SerpAPI and
+    # Jina count a unit per request, SEMRush one per keyword row returned.
+    "rate_limits": {
+        "serpapi": {"rate": 2, "burst": 2, "daily_units": None},
+        "semrush": {"rate": 9, "burst": 10, "daily_units": None},
+        "jina": {"rate": 3, "burst": 10, "daily_units": None}
+    },
+    # Units used per provider and day, shared by every process and kept across restarts.
+    "quota_db_path": ".cache/quota.sqlite3",
+    "cache_enabled": True,
+    "cache_path": ".cache/responses.sqlite3",
+    "cache_max_bytes": 256 * 1024 * 1024,
+    "content_store_path": ".cache/pages",
+    "content_store_max_bytes": 256 * 1024 * 1024,
+    # Seconds between rescans of the page directory, which other processes also write to.
+    "content_store_rescan_interval": 30,
+    "sse_preview_chars": 500,
+    "sse_preview_rows": 5,
+    "cache_ttls": {"serpapi": 24 * 3600, "semrush": 7 * 24 * 3600, "jina": 3 * 24 * 3600, "ai": 30 * 24 * 3600, "digest": 30 * 24 * 3600},
+    "ai_cache_enabled": False,
+    "ai_cache_memory_entries": 128,
+    "context_token_budget": 48000,
+    "context_dedupe_threshold": 0.8,
+    # With two or more variants the draft step writes one draft per variant in parallel
+    # (a variant may set "model" and/or "temperature"; without a model the draft route is
+    # used), scores them locally and proofreads the best. Once the first draft is in, the
+    # others get "draft_grace" more seconds. For example:
+    # [{"temperature": 0.7}, {"temperature": 1.0}, {"model": "openai:gpt-4.1-mini", "temperature": 0.8}]
+    "draft_variants": [],
+    "draft_grace": 15,
+    "draft_target_words": 1500,
+    "plan_summary_tokens": 500,
+    # Row and token limits of the tables interpolated into the plan, SEO and final prompts.
+    "prompt_tables": {"keywords": {"rows": 40, "tokens": 800}, "competitors": {"rows": 10, "tokens": 600}},
+    "analysis_mode": "single",
+    "analysis_map_workers": 5,
+    "digest_page_token_limit": 12000,
+    # Models to try for each AI step, in order; later models are fallbacks when a call
+    # errors or times out. Unpinned routes prefer whichever model has been fastest for
+    # the step. Steps without a route use "default", which is pinned so the steps that
+    # shape the article keep their model.
+    "ai_routes": {
+        "default": {"models": ["openai:gpt-4o-mini", "openai:gpt-4o"], "pinned": True, "temperature": 0.8, "timeout": 120},
+        "analysis": {"models": ["openai:gpt-4o-mini", "openai:gpt-4.1-mini"], "pinned": True, "timeout": 180},
+        "digest": {"models": ["openai:gpt-4.1-nano", "openai:gpt-4o-mini"], "temperature": 0.3, "timeout": 30},
+        "seo": {"models": ["openai:gpt-4.1-nano", "openai:gpt-4o-mini"], "timeout": 60}
+    },
+    "ai_models": {
+        "openai:gpt-4o-mini": {"context_tokens": 128000},
+        "openai:gpt-4o": {"context_tokens": 128000},
+        "openai:gpt-4.1-mini": {"context_tokens": 1047576},
+        "openai:gpt-4.1-nano": {"context_tokens": 1047576}
+    },
+    "ai_output_token_reserve": 4096,
+    "ai_latency_weight": 0.3,
+    "ai_latency_ttl": 600,
+    # USD per million tokens, used for the cost figures in /metrics and run summaries.
+    "ai_token_prices": {
+        "openai:gpt-4o-mini": {"prompt": 0.15, "completion": 0.60},
+        "openai:gpt-4o": {"prompt": 2.50, "completion": 10.00},
+        "openai:gpt-4.1-mini": {"prompt": 0.40, "completion": 1.60},
+        "openai:gpt-4.1-nano": {"prompt": 0.10, "completion": 0.40}
+    },
+    "stream_ai_output": True,
+    "pipeline_workers": 4,
+    "jobs_db_path": ".cache/jobs.sqlite3",
+    "checkpoints_db_path": ".cache/checkpoints.sqlite3",
+    "job_workers": 2,
+    "job_poll_interval": 1.0,
+    # Workers refresh their running jobs' heartbeat this often (seconds); a running job
+    # whose heartbeat is older than job_stale_after belonged to a process that stopped.
+    "job_heartbeat_interval": 10,
+    "job_stale_after": 60,
+    # A job's streamed AI tokens are merged into one delta event per this many seconds
+    # (and per step) before they are written to the job log, rather than a commit each.
+    "job_delta_flush_interval": 0.25,
+    # asgi.py: threads for routes bridged to the Flask app, and how often a job event
+    # stream served on the event loop checks the job log.
+    "asgi_bridge_workers": 16,
+    "asgi_job_poll_interval": 0.25,
+    "batch_workers": 4
 }
 
 # --- Initialization ---
-client = ai.Client()
-load_dotenv()
+# aisuite is imported where it is first needed; it accounts for most of the
+# import time of this module.
+
+Settings = namedtuple("Settings", ["serpapi_key", "semrush_api_key", "jina_api_key", "openai_api_key"])
+
+@functools.cache
+def get_settings():
+    """API keys, read once from the environment after loading ``.env``."""
+    load_dotenv()
+    return Settings(
+        serpapi_key=os.getenv("SERPAPI_KEY"),
+        semrush_api_key=os.getenv("SEMRUSH_API_KEY"),
+        jina_api_key=os.getenv("JINA_API_KEY"),
+        openai_api_key=os.getenv("OPENAI_API_KEY")
+    )
+
+# Built by get_client() on first use; tests and benchmarks may assign a stand-in.
+client = None
+client_lock = threading.Lock()
+
+def get_client():
+    """The aisuite client, constructed (and aisuite imported) on first use."""
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                get_settings()
+                import aisuite
+                client = aisuite.Client()
+    return client
 
 # --- Helper Functions ---
 
+def build_http_session():
+    """Create the pooled session shared by every upstream API call.
+
+    Each upstream host gets its own adapter sized to the number of concurrent
+    requests allowed against it, so connections are kept alive and reused across
+    calls. Idempotent GETs are retried with exponential backoff on 429/5xx and
+    connection failures; read timeouts are not retried so a slow host costs at
+    most one read timeout.
+    """
+    retry = Retry(
+        total=config["http_retries"],
+        read=0,
+        backoff_factor=config["http_backoff_factor"],
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    # Several runs share the session, so pools match the per-provider concurrency
+    # limits rather than one run's worker count.
+    pool_sizes = {
+        config["serpapi_url"]: config["upstream_concurrency"]["serpapi"],
+        config["semrush_url"]: config["upstream_concurrency"]["semrush"],
+        config["jina_url"]: config["upstream_concurrency"]["jina"]
+    }
+    session = requests.Session()
+    for prefix, pool_size in pool_sizes.items():
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+    return session
+
+class QuotaExhausted(Exception):
+    """Raised instead of calling a provider whose daily unit budget is used up."""
+
+class QuotaStore:
+    """SQLite-backed count of the units each provider has billed per UTC day.
+
+    Every process pointed at the same file shares one count, and the count survives
+    restarts. ``reserve`` checks the budget and adds the units in one statement, so
+    two processes cannot both take the last units.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota_usage ("
+                "provider TEXT NOT NULL, day TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (provider, day))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def used(self, provider, day):
+        with self._lock:
+            row = self._connect().execute("SELECT used FROM quota_usage WHERE provider = ? AND day = ?", (provider, day)).fetchone()
+        return row[0] if row else 0
+
+    def reserve(self, provider, day, units, daily_units=None):
+        """Add ``units`` unless that would exceed ``daily_units``; returns (reserved, units used today)."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR IGNORE INTO quota_usage (provider, day, used) VALUES (?, ?, 0)", (provider, day))
+            reserved = conn.execute(
+                "UPDATE quota_usage SET used = used + ? WHERE provider = ? AND day = ? AND (? IS NULL OR used + ? <= ?)",
+                (units, provider, day, daily_units, units, daily_units)
+            ).rowcount == 1
+            used = conn.execute("SELECT used FROM quota_usage WHERE provider = ? AND day = ?", (provider, day)).fetchone()[0]
+            conn.commit()
+        return reserved, used
+
+    def refund(self, provider, day, units):
+        """Take back ``units``; returns the units used today."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE quota_usage SET used = MAX(0, used - ?) WHERE provider = ? AND day = ?", (units, provider, day))
+            row = conn.execute("SELECT used FROM quota_usage WHERE provider = ? AND day = ?", (provider, day)).fetchone()
+            conn.commit()
+        return row[0] if row else 0
+
+class RateLimiter:
+    """Token bucket and daily unit budget for one provider, shared by all runs.
+
+    Requests waiting for a token are queued per owner (the run making them) and
+    served round-robin, so one run's burst of lookups cannot starve another run.
+    ``request`` charges the units up front and returns a ticket (an Event set once
+    it is admitted); ``poll`` hands out the tokens available now and returns how
+    long the caller should wait before polling again, which lets the threaded and
+    the asyncio paths share the same limiter. With a ``store`` (a QuotaStore) and a
+    ``daily_units`` budget, the day's units are counted there instead of in this
+    process alone; without a budget the count stays in memory, as it only feeds /quota.
+    """
+
+    def __init__(self, provider, rate=None, burst=1, daily_units=None, store=None):
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.daily_units = daily_units
+        self.store = store
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.day = None
+        self.used = 0
+        self.waiting = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def persistent(self):
+        """Whether ``request``, ``cancel`` and ``refund`` write to the quota store."""
+        return self.store is not None and self.daily_units is not None
+
+    def _roll_day(self):
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if today != self.day:
+            self.day, self.used = today, self.store.used(self.provider, today) if self.persistent else 0
+
+    def _take_back(self, units):
+        if self.persistent:
+            self.used = self.store.refund(self.provider, self.day, units)
+        else:
+            self.used = max(0, self.used - units)
+
+    def request(self, owner=None, units=1):
+        ticket = threading.Event()
+        with self._lock:
+            self._roll_day()
+            if self.persistent:
+                reserved, self.used = self.store.reserve(self.provider, self.day, units, self.daily_units)
+            else:
+                reserved = self.daily_units is None or self.used + units <= self.daily_units
+                if reserved:
+                    self.used += units
+            if not reserved:
+                raise QuotaExhausted(f"The daily {self.provider} budget of {self.daily_units} units is used up.")
+            if self.rate is None:
+                ticket.set()
+            else:
+                self.waiting.setdefault(owner, deque()).append(ticket)
+        return ticket
+
+    def poll(self, ticket):
+        with self._lock:
+            if self.rate is not None:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                while self.waiting and self.tokens >= 1:
+                    owner, tickets = next(iter(self.waiting.items()))
+                    tickets.popleft().set()
+                    self.tokens -= 1
+                    if tickets:
+                        self.waiting.move_to_end(owner)
+                    else:
+                        del self.waiting[owner]
+            return 0 if ticket.is_set() else (1 - self.tokens) / self.rate
+
+    def cancel(self, ticket, units=1):
+        """Withdraw the ticket of a request that will not be sent, returning its units (and token)."""
+        with self._lock:
+            self._take_back(units)
+            if ticket.is_set():
+                self.tokens = min(self.burst, self.tokens + 1)
+                return
+            for owner, tickets in self.waiting.items():
+                if ticket in tickets:
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del self.waiting[owner]
+                    break
+
+    def acquire(self, owner=None, units=1):
+        """Block until a request is admitted; returns the seconds spent waiting."""
+        ticket = self.request(owner, units)
+        started = time.monotonic()
+        while (delay := self.poll(ticket)) > 0:
+            ticket.wait(delay)
+        return time.monotonic() - started
+
+    def refund(self, units):
+        with self._lock:
+            self._take_back(units)
+
+    def status(self):
+        with self._lock:
+            self._roll_day()
+            if self.persistent:
+                # Other processes may have used units since this one last looked.
+                self.used = self.store.used(self.provider, self.day)
+            return {"used": self.used, "daily_units": self.daily_units,
+                    "remaining": None if self.daily_units is None else max(0, self.daily_units - self.used),
+                    "queued": sum(len(tickets) for tickets in self.waiting.values())}
+
+def build_rate_limiters():
+    return {provider: RateLimiter(provider, **limits, store=quota_store) for provider, limits in config["rate_limits"].items()}
+
+def refund_units(provider, units):
+    """Return reserved units a request did not use to the provider's daily budget."""
+    limiter = rate_limiters.get(provider)
+    if limiter is not None:
+        limiter.refund(units)
+
+def quota_status():
+    """Units used and left today per provider, for the ``quota`` SSE event."""
+    return {provider: limiter.status() for provider, limiter in rate_limiters.items()}
+
+http_session = build_http_session()
+upstream_slots = {provider: threading.BoundedSemaphore(limit) for provider, limit in config["upstream_concurrency"].items()}
+quota_store = QuotaStore(config["quota_db_path"])
+rate_limiters = build_rate_limiters()
+
+def http_timeout(read_timeout):
+    return (config["http_connect_timeout"], read_timeout)
+
 def handle_api_errors(response, api_name):
     if response.status_code != 200:
         logging.error(f"Failed to retrieve data from {api_name}. Status code: {response.status_code}")
         return False
     return True
 
+def run_concurrently(func, items, max_workers):
+    """Call ``func`` on every item with a bounded thread pool.
+
+    Yields ``(index, result, error)`` tuples in completion order, where ``index`` is
+    the item's position in ``items`` and ``error`` is the exception raised, if any.
+    """
+    if not items:
+        return
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = {executor.submit(contextvars.copy_context().run, func, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+    finally:
+        # Drop queued calls if the consumer stops early (e.g. the client disconnected).
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def upstream_get(provider, url, units=1, **kwargs):
+    """GET through the shared session once the provider's rate limiter admits it.
+
+    ``units`` is what the request may bill against the daily budget; they are
+    refunded if the request raises, since no response means nothing was billed.
+    The request holds one of the provider's concurrency slots while it runs.
+    """
+    limiter = rate_limiters.get(provider)
+    if limiter is not None:
+        note_call(throttled=limiter.acquire(active_run_metrics.get(), units))
+    try:
+        with upstream_slots[provider]:
+            response = http_session.get(url, **kwargs)
+    except BaseException:
+        refund_units(provider, units)
+        raise
+    call = current_call.get()
+    if call is not None:
+        call["responses"].append(response)
+    return response
+
+class CallMemo:
+    """Share the results of identical upstream calls made within one batch.
+
+    The first caller for a key performs the call; concurrent and later callers
+    for the same key wait for and reuse its result. Failures (an exception, ``None``
+    or an ``ERROR:`` message) are passed to the callers already waiting but not kept,
+    so the next caller tries again.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.reused = Counter()
+
+    def call(self, source, key, func, *args):
+        with self._lock:
+            future = self._futures.get((source, key))
+            owner = future is None
+            if owner:
+                future = self._futures[(source, key)] = Future()
+                self.calls[source] += 1
+            else:
+                self.reused[source] += 1
+                note_call(shared=True)
+        if owner:
+            try:
+                result = func(*args)
+                future.set_result(result)
+                failed = result is None or (isinstance(result, str) and result.startswith("ERROR:"))
+            except Exception as e:
+                future.set_exception(e)
+                failed = True
+            if failed:
+                with self._lock:
+                    del self._futures[(source, key)]
+        return future.result()
+
+active_call_memo = contextvars.ContextVar("active_call_memo", default=None)
+
+def shared_call(source, key, func, *args):
+    memo = active_call_memo.get()
+    if memo is None:
+        return func(*args)
+    return memo.call(source, key, func, *args)
+
+# --- Metrics ---
+
+class Metrics:
+    """Thread-safe counters for upstream calls and pipeline stages.
+
+    ``render`` exports them in the Prometheus text exposition format. Labels are
+    limited to the operation, AI step and pipeline stage; per-URL detail is kept
+    in each run's ``RunMetrics`` summary instead.
+    """
+
+    HELP = {
+        "seo_upstream_calls_total": ("counter", "Upstream calls by operation and cache outcome."),
+        "seo_upstream_errors_total": ("counter", "Upstream calls that raised."),
+        "seo_upstream_seconds_total": ("counter", "Wall time spent in upstream calls."),
+        "seo_upstream_bytes_total": ("counter", "Response bytes received from upstream APIs."),
+        "seo_upstream_retries_total": ("counter", "HTTP retries and redirects followed."),
+        "seo_upstream_throttled_seconds_total": ("counter", "Time upstream calls waited for their provider's rate limiter."),
+        "seo_ai_tokens_total": ("counter", "AI tokens by step and kind (prompt or completion)."),
+        "seo_ai_cost_usd_total": ("counter", "Estimated AI spend by step."),
+        "seo_ai_model_calls_total": ("counter", "AI completions by step and the model that answered."),
+        "seo_ai_fallbacks_total": ("counter", "AI calls that fell back to a later model on their route."),
+        "seo_stage_seconds_total": ("counter", "Wall time spent in pipeline stages."),
+        "seo_stage_runs_total": ("counter", "Pipeline stage executions."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = Counter()
+
+    def add(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] += value
+
+    def record_call(self, call):
+        operation = call["operation"]
+        cache = "hit" if call["cache_hit"] else "shared" if call["shared"] else "miss"
+        self.add("seo_upstream_calls_total", 1, operation=operation, cache=cache)
+        self.add("seo_upstream_seconds_total", call["seconds"], operation=operation)
+        self.add("seo_upstream_bytes_total", call["bytes"], operation=operation)
+        self.add("seo_upstream_retries_total", call["retries"], operation=operation)
+        self.add("seo_upstream_throttled_seconds_total", call["throttled"], operation=operation)
+        if call["error"]:
+            self.add("seo_upstream_errors_total", 1, operation=operation)
+        if operation == "ai":
+            self.add("seo_ai_tokens_total", call["prompt_tokens"], step=call["target"], kind="prompt")
+            self.add("seo_ai_tokens_total", call["completion_tokens"], step=call["target"], kind="completion")
+            self.add("seo_ai_cost_usd_total", call["cost"], step=call["target"])
+            if call["model"]:
+                self.add("seo_ai_model_calls_total", 1, step=call["target"], model=call["model"])
+                self.add("seo_ai_fallbacks_total", call["fallbacks"], step=call["target"])
+
+    def record_stages(self, timings):
+        for stage, timing in timings.items():
+            if isinstance(timing, dict) and "duration" in timing:
+                self.add("seo_stage_seconds_total", timing["duration"], stage=stage)
+                self.add("seo_stage_runs_total", 1, stage=stage)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        for name, (kind, help_text) in self.HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in values:
+                if metric == name:
+                    label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                    lines.append(f"{name}{{{label_text}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+class RunMetrics:
+    """Every upstream call made during one topic run, summarized for the ``metrics`` SSE event."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def record_call(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self, slowest=5):
+        with self._lock:
+            calls = list(self.calls)
+        operations = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "throttled": 0.0, "bytes": 0, "retries": 0, "cache_hits": 0, "errors": 0})
+        ai_steps = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "seconds": 0.0,
+                                        "fallbacks": 0, "models": Counter()})
+        for call in calls:
+            totals = operations[call["operation"]]
+            totals["calls"] += 1
+            totals["seconds"] += call["seconds"]
+            totals["throttled"] += call["throttled"]
+            totals["bytes"] += call["bytes"]
+            totals["retries"] += call["retries"]
+            totals["cache_hits"] += call["cache_hit"]
+            totals["errors"] += call["error"]
+            if call["operation"] == "ai":
+                step = ai_steps[call["target"]]
+                step["calls"] += 1
+                step["seconds"] += call["seconds"]
+                for key in ("prompt_tokens", "completion_tokens", "cost", "fallbacks"):
+                    step[key] += call[key]
+                if call["model"]:
+                    step["models"][call["model"]] += 1
+        return {
+            "operations": {name: {**totals, "seconds": round(totals["seconds"], 3), "throttled": round(totals["throttled"], 3)}
+                           for name, totals in operations.items()},
+            "ai_steps": {name: {**step, "seconds": round(step["seconds"], 3), "cost": round(step["cost"], 6)} for name, step in ai_steps.items()},
+            "total_cost": round(sum(call["cost"] for call in calls), 6),
+            "slowest_calls": [
+                {"operation": call["operation"], "target": call["target"], "seconds": round(call["seconds"], 3)}
+                for call in heapq.nlargest(slowest, calls, key=lambda call: call["seconds"])
+            ]
+        }
+
+metrics = Metrics()
+current_call = contextvars.ContextVar("current_call", default=None)
+active_run_metrics = contextvars.ContextVar("active_run_metrics", default=None)
+
+def note_call(**fields):
+    """Annotate the upstream call currently being measured, if any."""
+    call = current_call.get()
+    if call is not None:
+        call.update(fields)
+
+@contextmanager
+def measured_call(operation, target):
+    """Measure one upstream call and record it in the process and run metrics.
+
+    Code running inside the block annotates the call through ``note_call`` (cache
+    hits, token usage); responses fetched with ``upstream_get`` contribute their
+    byte counts and retry history automatically.
+    """
+    call = {"operation": operation, "target": target, "seconds": 0.0, "throttled": 0.0, "bytes": 0, "retries": 0,
+            "cache_hit": False, "shared": False, "error": False,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "model": None, "fallbacks": 0, "responses": []}
+    token = current_call.set(call)
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call["error"] = True
+        raise
+    finally:
+        call["seconds"] = time.perf_counter() - started
+        current_call.reset(token)
+        for response in call.pop("responses"):
+            raw = getattr(response, "raw", None)
+            if raw is None:
+                # httpx responses (the ASGI path) count their own bytes; retries are noted by the caller.
+                call["bytes"] += getattr(response, "num_bytes_downloaded", 0)
+                continue
+            call["bytes"] += raw.tell()
+            if getattr(raw, "retries", None) is not None:
+                call["retries"] += len(raw.retries.history)
+        metrics.record_call(call)
+        run_metrics = active_run_metrics.get()
+        if run_metrics is not None:
+            run_metrics.record_call(call)
+
+def instrumented(operation):
+    """Decorator measuring each call with ``measured_call``; the first argument is the target."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(target, *args, **kwargs):
+            with measured_call(operation, target):
+                return func(target, *args, **kwargs)
+        return wrapper
+    return decorate
+
+def note_ai_usage(model, messages, result, usage=None):
+    """Record token counts and estimated cost for an AI completion.
+
+    Uses the provider's reported usage when available and falls back to the
+    character-based estimate (streamed responses do not report usage).
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or sum(estimate_tokens(message["content"]) for message in messages)
+    completion_tokens = getattr(usage, "completion_tokens", None) or estimate_tokens(result or "")
+    prices = config["ai_token_prices"].get(model, {})
+    cost = (prompt_tokens * prices.get("prompt", 0) + completion_tokens * prices.get("completion", 0)) / 1_000_000
+    note_call(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=cost)
+
+# --- Response Cache ---
+
+class ResponseCache:
+    """Persistent, size-bounded cache for upstream API responses.
+
+    Entries live in a single SQLite file as zlib-compressed JSON, keyed by a
+    SHA-256 digest of the source name, the normalized query or URL and the
+    request parameters that change the response. Each source has its own TTL,
+    and the least recently used entries are evicted once the stored payloads
+    exceed ``max_bytes``.
+    """
+
+    def __init__(self, path, ttls, max_bytes):
+        self.path = path
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, source TEXT NOT NULL, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        return self._conn
+
+    @staticmethod
+    def make_key(source, key_parts):
+        payload = json.dumps({"source": source, "key": key_parts}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, source, key_parts):
+        key = self.make_key(source, key_parts)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttls.get(source, 0):
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                conn.commit()
+                row = None
+            if row is None:
+                self.misses[source] += 1
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits[source] += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, source, key_parts, value):
+        key = self.make_key(source, key_parts)
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, source, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, source, blob, len(blob), now, now)
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        sources = sorted(set(self.hits) | set(self.misses))
+        return {source: {"hits": self.hits[source], "misses": self.misses[source]} for source in sources}
+
+response_cache = ResponseCache(config["cache_path"], config["cache_ttls"], config["cache_max_bytes"])
+
+def cache_get(source, key_parts):
+    if not config["cache_enabled"]:
+        return None
+    value = response_cache.get(source, key_parts)
+    if value is not None:
+        note_call(cache_hit=True)
+        logging.info(f"Cache hit for {source}.")
+    return value
+
+def cache_set(source, key_parts, value):
+    if config["cache_enabled"]:
+        response_cache.set(source, key_parts, value)
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+# --- Content Store ---
+
+class ContentStore:
+    """Size-capped store for fetched page text, referenced by content ID.
+
+    Each page is written once as a zlib-compressed file named by the SHA-256 of
+    its text, so pipeline results, checkpoints and SSE messages only carry IDs and
+    previews. Once the store grows past ``max_bytes`` the least recently used
+    pages are deleted.
+
+    Several processes may share the directory. The in-memory index is only this
+    process's view of it: a miss falls back to the file itself, reads touch the
+    file's mtime, and writes rescan the directory every ``rescan_interval``
+    seconds (and whenever this process's view is over the cap) so pages written
+    and read by other processes count against the cap in LRU order.
+    """
+
+    def __init__(self, path, max_bytes, rescan_interval=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._sizes = None
+        self._scanned = 0
+
+    def _index(self, rescan=False):
+        if self._sizes is None or rescan:
+            self._scanned = time.monotonic()
+            os.makedirs(self.path, exist_ok=True)
+            entries = [entry for entry in os.scandir(self.path) if entry.is_file() and not entry.name.startswith('.')]
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            self._sizes = OrderedDict((entry.name, entry.stat().st_size) for entry in entries)
+        return self._sizes
+
+    def put(self, text):
+        content_id = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            sizes = self._index()
+            # Check the file, not just the index: another process may have written or evicted it.
+            if self._discover(content_id, touch=True):
+                sizes.move_to_end(content_id)
+                return content_id
+            blob = zlib.compress(text.encode('utf-8'))
+            temp_path = os.path.join(self.path, f".{content_id}.{threading.get_ident()}")
+            with open(temp_path, 'wb') as f:
+                f.write(blob)
+            os.replace(temp_path, os.path.join(self.path, content_id))
+            sizes[content_id] = len(blob)
+            total = sum(sizes.values())
+            if total > self.max_bytes or time.monotonic() - self._scanned >= self.rescan_interval:
+                sizes = self._index(rescan=True)
+                total = sum(sizes.values())
+            while total > self.max_bytes and len(sizes) > 1:
+                evicted, size = sizes.popitem(last=False)
+                total -= size
+                try:
+                    os.remove(os.path.join(self.path, evicted))
+                except FileNotFoundError:
+                    pass
+        return content_id
+
+    def get(self, content_id):
+        """Return the stored text, or ``None`` if the ID is unknown or was evicted."""
+        if not re.fullmatch(r"[0-9a-f]{64}", content_id or ""):
+            return None
+        with self._lock:
+            sizes = self._index()
+            if content_id not in sizes and not self._discover(content_id):
+                return None
+            sizes.move_to_end(content_id)
+        path = os.path.join(self.path, content_id)
+        try:
+            with open(path, 'rb') as f:
+                text = zlib.decompress(f.read()).decode('utf-8')
+            os.utime(path)
+            return text
+        except FileNotFoundError:
+            with self._lock:
+                self._sizes.pop(content_id, None)
+            return None
+
+    def _discover(self, content_id, touch=False):
+        """Index the page's file if it exists (e.g. another process wrote it); False, and unindexed, if not."""
+        path = os.path.join(self.path, content_id)
+        try:
+            if touch:
+                os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self._sizes.pop(content_id, None)
+            return False
+        self._sizes[content_id] = size
+        return True
+
+content_store = ContentStore(config["content_store_path"], config["content_store_max_bytes"], config["content_store_rescan_interval"])
+
+def page_content(item):
+    """Full text of a fetched page, whether held inline (``Content``) or by ``ContentId``."""
+    if item.get('Content') is not None:
+        return item['Content']
+    if item.get('ContentId'):
+        content = content_store.get(item['ContentId'])
+        if content is None:
+            logging.warning(f"Content for {item.get('Link')} is no longer in the content store.")
+        return content
+    return None
+
+def preview(text, limit=None):
+    limit = limit or config["sse_preview_chars"]
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
 # --- Step 2: SerpAPI Data Retrieval ---
 
-def get_serpapi_data(topic_query):
-    base_url = "https://serpapi.com/search.json"
+def serpapi_request(topic_query):
+    """Return the SerpAPI query parameters and cache key for a topic."""
     params = {
         "q": topic_query,
         "hl": "en",
         "gl": "us",
         "google_domain": "google.com",
-        "api_key": os.getenv("SERPAPI_KEY")
+        "api_key": get_settings().serpapi_key
     }
-    response = requests.get(base_url, params=params)
+    cache_key = {"q": normalize_query(topic_query), "hl": params["hl"], "gl": params["gl"], "google_domain": params["google_domain"]}
+    return params, cache_key
+
+@dataclass(slots=True)
+class SerpResult:
+    """One organic search result. ``row()`` gives the column-named dict used in caches and SSE payloads."""
+    position: int
+    link: str
+    title: str
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['Position'], row['Link'], row['Title'])
+
+    def row(self):
+        return {'Position': self.position, 'Link': self.link, 'Title': self.title}
+
+def parse_serpapi_results(results):
+    data = []
+    for result in results.get('organic_results', []):
+        data.append({
+            'Position': result.get('position'),
+            'Link': result.get('link'),
+            'Title': result.get('title')
+        })
+    return data
+
+@instrumented("serpapi")
+def get_serpapi_data(topic_query):
+    """Return the organic results for a topic as ``SerpResult`` records (empty on failure)."""
+    params, cache_key = serpapi_request(topic_query)
+    cached = cache_get("serpapi", cache_key)
+    if cached is not None:
+        return [SerpResult.from_row(row) for row in cached]
+    try:
+        response = upstream_get("serpapi", config["serpapi_url"], params=params, timeout=http_timeout(config["serpapi_timeout"]))
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request error retrieving SerpAPI data: {e}")
+        return []
     if handle_api_errors(response, "SerpAPI"):
-        results = response.json()
-        data = []
-        for result in results.get('organic_results', []):
-            data.append({
-                'Position': result.get('position'),
-                'Link': result.get('link'),
-                'Title': result.get('title')
-            })
-        df_serp = pd.DataFrame(data)
+        data = parse_serpapi_results(response.json())
+        if data:
+            cache_set("serpapi", cache_key, data)
         logging.info("Successfully retrieved SerpAPI data.")
-        return df_serp
+        return [SerpResult.from_row(row) for row in data]
     else:
-        return pd.DataFrame()
+        return []
 
 # --- Step 3: SEMRush Data Retrieval and Processing ---
 
-def get_semrush_data(url, api_key=os.getenv("SEMRUSH_API_KEY")):
-    base_url = "https://api.semrush.com/"
+@instrumented("semrush")
+def get_semrush_data(url, api_key=None):
+    return shared_call("semrush", normalize_url(url), request_semrush_data, url, api_key or get_settings().semrush_api_key)
+
+def semrush_request(url, api_key):
+    """Return the SEMRush request URL and cache key for a competitor URL."""
+    base_url = config["semrush_url"]
     type_param = "url_organic"
     export_columns = "Ph,Po,Nq,Cp,Co"
     full_url = (
@@ -80,74 +964,270 @@ def get_semrush_data(url, api_key=os.getenv("SEMRUSH_API_KEY")):
         f"&url={quote(url)}&database={config['semrush_database']}"
         f"&display_filter={config['semrush_display_filter']}&display_sort={config['semrush_display_sort']}"
     )
-    response = requests.get(full_url)
-    if handle_api_errors(response, "SEMRush"):
-        decoded_output = response.content.decode('utf-8')
-        lines = decoded_output.split('\r\n')
-        headers = lines[0].split(';')
-        json_data = []
-        for line in lines[1:]:
-            if line:
-                values = line.split(';')
-                record = {header: value for header, value in zip(headers, values)}
-                json_data.append(record)
-        return json_data
-    else:
-        return []
+    cache_key = {
+        "url": normalize_url(url),
+        "export_columns": export_columns,
+        "database": config['semrush_database'],
+        "display_limit": config['semrush_display_limit'],
+        "display_filter": config['semrush_display_filter'],
+        "display_sort": config['semrush_display_sort'],
+        "format": "columns"
+    }
+    return full_url, cache_key
+
+def request_semrush_data(url, api_key):
+    full_url, cache_key = semrush_request(url, api_key)
+    cached = cache_get("semrush", cache_key)
+    if cached is not None:
+        return KeywordTable.from_columns(cached)
+    # SEMRush bills per row returned, so the full display_limit is reserved and the rest refunded.
+    units = config["semrush_display_limit"]
+    response = upstream_get("semrush", full_url, units=units, timeout=http_timeout(config["semrush_timeout"]), stream=True)
+    with response:
+        if handle_api_errors(response, "SEMRush"):
+            response.encoding = 'utf-8'
+            keywords = parse_semrush_response(response.iter_lines(chunk_size=config["semrush_chunk_size"], decode_unicode=True), url)
+            if keywords is None:
+                refund_units("semrush", units)
+                return None
+            refund_units("semrush", units - len(keywords))
+            cache_set("semrush", cache_key, keywords.to_columns())
+            return keywords
+        else:
+            refund_units("semrush", units)
+            return None
 
-def process_semrush_data(df_results):
-    df_results['SEMRush_Data'] = df_results['Link'].apply(get_semrush_data)
+SEMRUSH_COLUMN_TYPES = {
+    "Keyword": str,
+    "Position": int,
+    "Search Volume": int,
+    "CPC": float,
+    "Competition": float
+}
+
+class KeywordTable:
+    """One URL's SEMRush keywords, held by column.
+
+    Numeric columns are typed ``array``s and the others lists, so a table of
+    thousands of keywords costs a few objects per column rather than a dict per
+    row: at 10 URLs x 10,000 keywords the tables retain 22 MiB against 51 MiB
+    of row dicts. ``rows`` builds dicts for the few rows an SSE preview shows;
+    caches and checkpoints store ``to_columns``.
+    """
+    __slots__ = ("columns",)
+
+    def __init__(self, columns=None):
+        self.columns = columns or {}
+
+    @staticmethod
+    def empty_column(header):
+        typecode = {int: 'q', float: 'd'}.get(SEMRUSH_COLUMN_TYPES.get(header, str))
+        return array.array(typecode) if typecode else []
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Rebuild a table from ``to_columns`` output."""
+        table = cls({header: cls.empty_column(header) for header in columns})
+        for header, values in columns.items():
+            table.columns[header].extend(values)
+        return table
+
+    @classmethod
+    def from_rows(cls, rows):
+        headers = list(rows[0]) if rows else []
+        return cls.from_columns({header: [row[header] for row in rows] for header in headers})
+
+    def __len__(self):
+        return len(self.columns["Keyword"]) if self.columns else 0
+
+    def column(self, header):
+        return self.columns[header]
+
+    def rows(self, limit=None):
+        count = len(self) if limit is None else min(limit, len(self))
+        return [{header: values[index] for header, values in self.columns.items()} for index in range(count)]
+
+    def to_columns(self):
+        return {header: list(values) for header, values in self.columns.items()}
+
+def parse_semrush_response(lines, url):
+    """Parse a SEMRush response body, telling "nothing found" apart from its other errors.
+
+    SEMRush answers errors with status 200 and an ``ERROR <code> :: <message>`` body.
+    Returns a ``KeywordTable``, empty for ``ERROR 50 :: NOTHING FOUND`` (the URL
+    ranks for no keywords, which is worth caching), or ``None`` for any other body
+    that is not a keyword table, such as a wrong key or an exhausted unit balance.
+    """
+    lines = filter(None, lines)
+    first = next(lines, "")
+    if first.startswith("ERROR 50 "):
+        logging.warning(f"SEMRush found no keywords for {url}.")
+        return KeywordTable()
+    keywords = parse_semrush_csv(itertools.chain([first], lines))
+    if keywords is None:
+        logging.error(f"SEMRush returned no keyword table for {url}: {first[:200]}")
+    return keywords
+
+def parse_semrush_csv(lines):
+    """Parse SEMRush's semicolon-separated export into a typed ``KeywordTable``.
+
+    ``lines`` may be any iterable of text lines, so the response body is consumed
+    incrementally instead of being decoded and split in one go. Numeric columns
+    are converted once here; unparseable values become 0. Returns ``None`` when
+    the first line is not a keyword table header (e.g. ``ERROR 50 :: NOTHING FOUND``).
+    """
+    reader = csv.reader(filter(None, lines), delimiter=';')
+    headers = next(reader, None)
+    if not headers or "Keyword" not in headers:
+        return None
+    table = KeywordTable({header: KeywordTable.empty_column(header) for header in headers})
+    columns = [(table.columns[header].append, SEMRUSH_COLUMN_TYPES.get(header, str)) for header in headers]
+    for values in reader:
+        if len(values) != len(headers):
+            continue
+        # Each value goes straight onto its column; only the numeric ones are recast.
+        for (append, convert), value in zip(columns, values):
+            if convert is str:
+                append(value)
+                continue
+            try:
+                append(convert(value))
+            except ValueError:
+                append(convert())
+    return table
+
+def fetch_semrush_concurrently(urls, max_workers=None):
+    """Look up SEMRush keywords for every URL with a bounded thread pool.
+
+    Returns ``(results, failures)``: ``results`` holds one ``KeywordTable`` per URL
+    in the order given (empty for failed lookups) and ``failures`` lists the URLs whose
+    request errored, timed out or was rejected by the API.
+    """
+    results = [KeywordTable() for _ in urls]
+    failures = []
+    for index, data, error in run_concurrently(get_semrush_data, urls, max_workers or config["semrush_workers"]):
+        if error is not None:
+            logging.error(f"SEMRush lookup failed for {urls[index]}: {error}")
+        if error is not None or data is None:
+            failures.append(urls[index])
+        else:
+            results[index] = data
+    return results, failures
+
+def process_semrush_data(serp_results):
+    """Look up every result's keywords; returns ``(semrush_results, failures, final_keywords)``."""
+    urls = [result.link for result in serp_results]
+    semrush_results, failures = fetch_semrush_concurrently(urls)
+    if failures:
+        logging.warning(f"SEMRush data missing for {len(failures)} of {len(urls)} URLs.")
     logging.info("Successfully retrieved SEMRush data.")
-    all_keywords = []
-    for data in df_results['SEMRush_Data']:
-        if data:
-            all_keywords.extend([item['Keyword'] for item in data])
-
-    keyword_counts = Counter(all_keywords)
-    highest_count = max(keyword_counts.values())
-    second_highest_count = sorted(set(keyword_counts.values()), reverse=True)[1] if len(set(keyword_counts.values())) > 1 else 0
-    top_keywords = [keyword for keyword, count in keyword_counts.items() if count == highest_count or count == second_highest_count]
-
-    if highest_count == 2:
-        top_keywords = [keyword for keyword, count in keyword_counts.items() if count in [1, 2]]
-
-    search_volume_keywords = sorted(
-        [(item['Keyword'], int(item['Search Volume'])) for data in df_results['SEMRush_Data'] if data for item in data],
-        key=lambda x: x[1],
-        reverse=True)[:10]
-
-    final_keywords = set(top_keywords + [keyword for keyword, _ in search_volume_keywords])
-    final_keywords_df = pd.DataFrame(
-        [(keyword, 
-        next((item['Search Volume'] for data in df_results['SEMRush_Data'] if data for item in data if item['Keyword'] == keyword), 0),
-        keyword_counts[keyword])
-        for keyword in final_keywords],
-        columns=['Keyword', 'Search Volume', 'Frequency']
-    )
-    final_keywords_df = final_keywords_df.sort_values(by=['Frequency', 'Search Volume'], ascending=[False, False])
+    final_keywords = select_final_keywords(build_keyword_index(urls, semrush_results))
 
     logging.info("Successfully processed SEMRush data and extracted keywords.")
-    return final_keywords_df
+    return semrush_results, failures, final_keywords
+
+def build_keyword_index(urls, semrush_results):
+    """Index every SEMRush keyword in a single pass over all rows.
+
+    Returns a dict mapping each keyword to a ``KeywordStats`` entry holding its
+    number of occurrences, the search volume of its first occurrence, its highest
+    search volume and its ``(url, position)`` pairs.
+    """
+    keyword_index = {}
+    lookup = keyword_index.get
+    for url, data in zip(urls, semrush_results):
+        if not data:
+            continue
+        for keyword, volume, position in zip(data.column('Keyword'), data.column('Search Volume'), data.column('Position')):
+            entry = lookup(keyword)
+            if entry is None:
+                keyword_index[keyword] = KeywordStats(volume, [(url, position)])
+            else:
+                entry.count += 1
+                if volume > entry.max_volume:
+                    entry.max_volume = volume
+                entry.positions.append((url, position))
+    return keyword_index
+
+class KeywordStats:
+    __slots__ = ("count", "first_volume", "max_volume", "positions")
+
+    def __init__(self, volume, positions):
+        self.count = 1
+        self.first_volume = volume
+        self.max_volume = volume
+        self.positions = positions
+
+@dataclass(slots=True)
+class KeywordRecord:
+    """A selected keyword with the search volume of its first occurrence and its competitor count."""
+    keyword: str
+    search_volume: int
+    frequency: int
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['Keyword'], row['Search Volume'], row['Frequency'])
+
+    def row(self):
+        return {'Keyword': self.keyword, 'Search Volume': self.search_volume, 'Frequency': self.frequency}
+
+def select_final_keywords(keyword_index, volume_top_k=10):
+    """Pick the keywords shared by the most competitors plus the highest-volume ones.
+
+    Returns ``KeywordRecord``s ordered by frequency, then search volume, both descending.
+    """
+    if not keyword_index:
+        return []
+
+    distinct_counts = heapq.nlargest(2, {entry.count for entry in keyword_index.values()})
+    highest_count = distinct_counts[0]
+    second_highest_count = distinct_counts[1] if len(distinct_counts) > 1 else 0
+    top_counts = {1, 2} if highest_count == 2 else {highest_count, second_highest_count}
+    top_keywords = [keyword for keyword, entry in keyword_index.items() if entry.count in top_counts]
+
+    search_volume_keywords = heapq.nlargest(volume_top_k, keyword_index, key=lambda keyword: keyword_index[keyword].max_volume)
+
+    final_keywords = [KeywordRecord(keyword, keyword_index[keyword].first_volume, keyword_index[keyword].count)
+                      for keyword in dict.fromkeys(top_keywords + search_volume_keywords)]
+    final_keywords.sort(key=lambda record: (record.frequency, record.search_volume), reverse=True)
+    return final_keywords
 
 # --- Step 4: Content Fetching ---
 
+@instrumented("jina")
 def fetch_content(url):
+    return shared_call("jina", normalize_url(url), request_content, url)
+
+def jina_request(url):
+    """Return the Jina Reader request URL, headers and cache key for a page."""
     headers = {
-        'Authorization': f'Bearer {os.getenv("JINA_API_KEY")}',
+        'Authorization': f'Bearer {get_settings().jina_api_key}',
         'X-Retain-Images': 'none',
         "Accept": "application/json",
         'X-Timeout': str(config["jina_api_timeout"])
     }
+    cache_key = {"url": normalize_url(url), "retain_images": headers['X-Retain-Images']}
+    return f'{config["jina_url"]}{url}', headers, cache_key
+
+def parse_jina_response(url, response_json, cache_key):
+    if response_json['code'] == 200:
+        logging.info(f"Successfully fetched content from {url}.")
+        content = response_json['data']['content']
+        cache_set("jina", cache_key, content)
+        return content
+    logging.warning(f"Jina API error for {url}: {response_json.get('error', 'Unknown error')}")
+    return f"ERROR: {url} blocks Jina API or other error occurred."
+
+def request_content(url):
+    full_url, headers, cache_key = jina_request(url)
+    cached = cache_get("jina", cache_key)
+    if cached is not None:
+        return cached
     try:
-        response = requests.get(f'https://r.jina.ai/{url}', headers=headers)
+        response = upstream_get("jina", full_url, headers=headers, timeout=http_timeout(config["jina_read_timeout"]))
         if handle_api_errors(response, "Jina AI Reader"):
-            response_json = response.json()
-            if response_json['code'] == 200:
-                logging.info(f"Successfully fetched content from {url}.")
-                return response_json['data']['content']
-            else:
-                logging.warning(f"Jina API error for {url}: {response_json.get('error', 'Unknown error')}")
-                return f"ERROR: {url} blocks Jina API or other error occurred."
+            return parse_jina_response(url, response.json(), cache_key)
         else:
             return f"ERROR: Failed to use Jina API for {url}."
 
@@ -158,17 +1238,442 @@ def fetch_content(url):
         logging.error(f"Unknown error fetching content from {url}: {e}")
         return f"ERROR: Unknown error processing {url}."
 
+def fetch_contents_concurrently(urls, max_workers=None):
+    """Fetch every URL with a bounded thread pool.
+
+    Yields ``(index, content)`` tuples in completion order, where ``index`` is the
+    URL's position in ``urls`` so callers can rebuild SERP order.
+    """
+    for index, content, error in run_concurrently(fetch_content, urls, max_workers or config["content_fetch_workers"]):
+        yield index, content if error is None else f"ERROR: Unknown error processing {urls[index]}."
+
+# --- Context Packing ---
+
+BOILERPLATE_PATTERN = re.compile(
+    r"cookie|subscribe|newsletter|sign up|log in|all rights reserved|privacy policy|terms of (?:use|service)"
+    r"|share (?:this|on)|follow us|advertisement|skip to (?:main )?content",
+    re.IGNORECASE
+)
+LINK_ONLY_LINE = re.compile(r"^\s*(?:[-*+]\s+|\d+\.\s+)?(?:!?\[[^\]]*\]\([^)]*\)\s*[|·•,-]?\s*)+$")
+MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+MINHASH_MASKS = [int.from_bytes(hashlib.blake2b(str(i).encode(), digest_size=8).digest(), 'big') for i in range(MINHASH_PERMUTATIONS)]
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English prose)."""
+    return (len(text) + 3) // 4
+
+def strip_boilerplate(content):
+    """Split page markdown into paragraphs, dropping navigation and boilerplate.
+
+    Link-only blocks (menus, breadcrumbs, share bars) and short blocks mentioning
+    cookies, newsletters, logins and the like are removed; images are dropped and
+    links are reduced to their anchor text.
+    """
+    paragraphs = []
+    for block in re.split(r"\n\s*\n", content):
+        lines = [line for line in block.splitlines() if line.strip()]
+        if not lines or all(LINK_ONLY_LINE.match(line) for line in lines):
+            continue
+        text = MARKDOWN_LINK.sub(r"\1", MARKDOWN_IMAGE.sub("", "\n".join(lines))).strip()
+        if not text or (len(text) < 200 and BOILERPLATE_PATTERN.search(text)):
+            continue
+        paragraphs.append(text)
+    return paragraphs
+
+def shingle_hashes(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+def minhash_signature(shingles):
+    return tuple(min(shingle ^ mask for shingle in shingles) for mask in MINHASH_MASKS)
+
+class NearDuplicateIndex:
+    """MinHash/LSH index of paragraphs seen so far across all sources.
+
+    Candidates that share an LSH band are confirmed with exact Jaccard similarity
+    on their shingle sets before a paragraph is treated as a near-duplicate.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.buckets = {}
+        self.shingles = []
+
+    def add_if_new(self, text):
+        shingles = shingle_hashes(text)
+        signature = minhash_signature(shingles)
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        bands = [(band, signature[band * rows:(band + 1) * rows]) for band in range(MINHASH_BANDS)]
+        candidates = {candidate for band in bands for candidate in self.buckets.get(band, ())}
+        for candidate in candidates:
+            seen = self.shingles[candidate]
+            if len(shingles & seen) / len(shingles | seen) >= self.threshold:
+                return False
+        for band in bands:
+            self.buckets.setdefault(band, []).append(len(self.shingles))
+        self.shingles.append(shingles)
+        return True
+
+def allocate_budget(demands, weights, budget):
+    """Split ``budget`` across sources in proportion to ``weights``.
+
+    Sources that need less than their share keep only what they need and the
+    remainder is redistributed among the others.
+    """
+    allocation = [0] * len(demands)
+    remaining = set(index for index, demand in enumerate(demands) if demand > 0)
+    while remaining and budget > 0:
+        total_weight = sum(weights[index] for index in remaining)
+        shares = {index: budget * weights[index] / total_weight for index in remaining}
+        satisfied = {index for index in remaining if demands[index] - allocation[index] <= shares[index]}
+        if not satisfied:
+            for index in remaining:
+                allocation[index] += int(shares[index])
+            break
+        for index in satisfied:
+            budget -= demands[index] - allocation[index]
+            allocation[index] = demands[index]
+        remaining -= satisfied
+    return allocation
+
+def pack_context(content_fetch_results, token_budget=None):
+    """Pack fetched page contents into a deduplicated, token-budgeted context.
+
+    Pages are processed in SERP order: boilerplate is stripped, paragraphs that
+    near-duplicate one already kept from a higher-ranked page are dropped, and the
+    token budget is split across pages weighted by ``1 / position`` so top results
+    keep more of their text. Returns ``(content_list, stats)``.
+    """
+    token_budget = token_budget or config["context_token_budget"]
+    pages = analyzable_pages(content_fetch_results)
+    dedupe_index = NearDuplicateIndex(config["context_dedupe_threshold"])
+    stats = {"original_tokens": 0, "boilerplate_paragraphs": 0, "duplicate_paragraphs": 0}
+
+    page_paragraphs = []
+    for item in pages:
+        content = page_content(item) or ""
+        stats["original_tokens"] += estimate_tokens(content)
+        paragraphs = strip_boilerplate(content)
+        stats["boilerplate_paragraphs"] += sum(1 for block in re.split(r"\n\s*\n", content) if block.strip()) - len(paragraphs)
+        unique = [paragraph for paragraph in paragraphs if dedupe_index.add_if_new(paragraph)]
+        stats["duplicate_paragraphs"] += len(paragraphs) - len(unique)
+        page_paragraphs.append(unique)
+
+    demands = [sum(estimate_tokens(paragraph) for paragraph in paragraphs) for paragraphs in page_paragraphs]
+    weights = [1 / (item.get('Position') or rank + 1) for rank, item in enumerate(pages)]
+    allocation = allocate_budget(demands, weights, token_budget)
+
+    content_list = []
+    for paragraphs, allowance in zip(page_paragraphs, allocation):
+        kept = []
+        for paragraph in paragraphs:
+            cost = estimate_tokens(paragraph)
+            if cost > allowance:
+                # Skip it; shorter paragraphs further down the page may still fit.
+                continue
+            kept.append(paragraph)
+            allowance -= cost
+        if kept:
+            content_list.append("\n\n".join(kept))
+
+    stats["packed_tokens"] = sum(estimate_tokens(content) for content in content_list)
+    stats["tokens_saved"] = stats["original_tokens"] - stats["packed_tokens"]
+    logging.info(f"Packed competitor content: {stats}")
+    return content_list, stats
+
+# --- Prompt Tables ---
+
+TABLE_CELL_BREAK = re.compile(r"[\t\r\n]+")
+
+def prompt_table(rows, columns, max_rows, token_budget):
+    """Render ``rows`` as a tab-separated table of ``columns``.
+
+    Rows are kept in order until ``max_rows`` or ``token_budget`` is reached and a
+    last line counts the rest. The text depends only on the rows, so prompts built
+    from it (and their AI cache keys) are identical for identical data.
+    """
+    lines = ["\t".join(columns)]
+    used = estimate_tokens(lines[0])
+    for row in rows[:max_rows]:
+        line = "\t".join(TABLE_CELL_BREAK.sub(" ", str(row[column])) for column in columns)
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    omitted = len(rows) - (len(lines) - 1)
+    if omitted:
+        lines.append(f"({omitted} more rows omitted)")
+    return "\n".join(lines)
+
+def keywords_table(final_keywords):
+    limits = config["prompt_tables"]["keywords"]
+    return prompt_table([record.row() for record in final_keywords], ['Keyword', 'Search Volume', 'Frequency'],
+                        limits["rows"], limits["tokens"])
+
+def competitors_table(serp_results):
+    limits = config["prompt_tables"]["competitors"]
+    return prompt_table([result.row() for result in serp_results], ['Position', 'Link', 'Title'],
+                        limits["rows"], limits["tokens"])
+
 # --- Step 5-10: AI Model Interactions ---
 
-def interact_with_ai(messages, model=config["openai_model"], temperature=config["openai_temperature"]):
-    try:
-        response = client.chat.completions.create(model=model, messages=messages, temperature=temperature)
-        result = response.choices[0].message.content
-        return result
-    except Exception as e:
-        logging.error(f"Error during AI interaction: {e}")
+completion_memory_cache = OrderedDict()
+completion_memory_lock = threading.Lock()
+
+def get_cached_completion(key_parts):
+    """Look up a completion in the in-memory LRU, then in the disk cache."""
+    key = ResponseCache.make_key("ai", key_parts)
+    with completion_memory_lock:
+        if key in completion_memory_cache:
+            completion_memory_cache.move_to_end(key)
+            response_cache.hits["ai_memory"] += 1
+            note_call(cache_hit=True)
+            return completion_memory_cache[key]
+    result = cache_get("ai", key_parts)
+    if result is not None:
+        remember_completion(key, result)
+    return result
+
+def set_cached_completion(key_parts, result):
+    remember_completion(ResponseCache.make_key("ai", key_parts), result)
+    cache_set("ai", key_parts, result)
+
+def remember_completion(key, result):
+    with completion_memory_lock:
+        completion_memory_cache[key] = result
+        completion_memory_cache.move_to_end(key)
+        while len(completion_memory_cache) > config["ai_cache_memory_entries"]:
+            completion_memory_cache.popitem(last=False)
+
+class ModelLatency:
+    """Exponentially weighted response time of each model per AI step.
+
+    Estimates older than ``ttl`` seconds are dropped, so a model demoted by a
+    burst of failures gets measured again.
+    """
+
+    def __init__(self, weight, ttl):
+        self.weight = weight
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._seconds = {}
+
+    def record(self, step, model, seconds):
+        with self._lock:
+            previous = self._estimate(step, model)
+            value = seconds if previous is None else previous + self.weight * (seconds - previous)
+            self._seconds[(step, model)] = (value, time.monotonic())
+
+    def estimate(self, step, model):
+        with self._lock:
+            return self._estimate(step, model)
+
+    def _estimate(self, step, model):
+        value, recorded = self._seconds.get((step, model), (None, 0.0))
+        return value if time.monotonic() - recorded <= self.ttl else None
+
+model_latency = ModelLatency(config["ai_latency_weight"], config["ai_latency_ttl"])
+
+def ai_route(step):
+    return config["ai_routes"].get(step or "default", config["ai_routes"]["default"])
+
+def route_for(step, messages, model=None, temperature=None):
+    """Return the models to try for ``step`` in order, and the parameters to call them with.
+
+    Models whose context window cannot hold the prompt are skipped. Pinned routes
+    keep their configured order; the others try each model once, then order them
+    by recorded latency. An explicit ``model`` bypasses the route.
+    """
+    default = config["ai_routes"]["default"]
+    route = ai_route(step)
+    params = {"temperature": temperature if temperature is not None else route.get("temperature", default["temperature"]),
+              "timeout": route.get("timeout", default["timeout"])}
+    if model:
+        return [model], params
+    needed = sum(estimate_tokens(message["content"]) for message in messages) + config["ai_output_token_reserve"]
+    context_tokens = lambda candidate: config["ai_models"].get(candidate, {}).get("context_tokens", float("inf"))
+    models = [candidate for candidate in route["models"] if context_tokens(candidate) >= needed] \
+        or [max(route["models"], key=context_tokens)]
+    if not route.get("pinned"):
+        # Untried models sort first (0.0), so each gets measured once.
+        models.sort(key=lambda candidate: model_latency.estimate(step, candidate) or 0.0)
+    return models, params
+
+def completion_cache_key(step, model, temperature, messages):
+    """Cache key of a completion; routed completions are shared by every model on the route."""
+    return {"model": model or f"route:{step or 'default'}", "temperature": temperature, "messages": messages}
+
+def interact_with_ai(messages, model=None, temperature=None, bypass_cache=False, step=None):
+    """Complete ``messages`` with the models routed for ``step`` (see ``route_for``).
+
+    A call that errors or times out falls through to the next model; returns
+    ``None`` once every model has failed.
+    """
+    with measured_call("ai", step or "other"):
+        models, params = route_for(step, messages, model, temperature)
+        use_cache = config["ai_cache_enabled"] and not bypass_cache
+        cache_key = completion_cache_key(step, model, params["temperature"], messages)
+        if use_cache:
+            cached = get_cached_completion(cache_key)
+            if cached is not None:
+                return cached
+        for attempt, candidate in enumerate(models):
+            started = time.perf_counter()
+            try:
+                with upstream_slots["ai"]:
+                    response = get_client().chat.completions.create(model=candidate, messages=messages, **params)
+                result = response.choices[0].message.content
+            except Exception as e:
+                # A failure counts as a call that took the whole timeout.
+                model_latency.record(step, candidate, params["timeout"])
+                logging.warning(f"AI call to {candidate} for {step or 'other'} failed: {e}")
+                continue
+            model_latency.record(step, candidate, time.perf_counter() - started)
+            note_call(model=candidate, fallbacks=attempt)
+            note_ai_usage(candidate, messages, result, getattr(response, "usage", None))
+            if use_cache and result is not None:
+                set_cached_completion(cache_key, result)
+            return result
+        logging.error(f"Error during AI interaction: every model failed for {step or 'other'} ({', '.join(models)}).")
+        return None
+
+def stream_with_ai(messages, model=None, temperature=None, bypass_cache=False, step=None):
+    """Streaming variant of ``interact_with_ai``.
+
+    Yields text deltas as the model produces them and returns the full completion
+    (or ``None`` on error) as the generator's return value. A cached completion is
+    yielded as a single delta. Falls back to the next model only while nothing has
+    been yielded yet.
+    """
+    with measured_call("ai", step or "other"):
+        models, params = route_for(step, messages, model, temperature)
+        use_cache = config["ai_cache_enabled"] and not bypass_cache
+        cache_key = completion_cache_key(step, model, params["temperature"], messages)
+        if use_cache:
+            cached = get_cached_completion(cache_key)
+            if cached is not None:
+                yield cached
+                return cached
+        for attempt, candidate in enumerate(models):
+            started = time.perf_counter()
+            parts = []
+            try:
+                with upstream_slots["ai"]:
+                    stream = get_client().chat.completions.create(model=candidate, messages=messages, stream=True, **params)
+                    for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+            except Exception as e:
+                model_latency.record(step, candidate, params["timeout"])
+                if parts:
+                    # Part of this answer has already been sent; another model's cannot be spliced in.
+                    logging.error(f"Streaming AI call to {candidate} for {step or 'other'} failed mid-stream: {e}")
+                    return None
+                logging.warning(f"Streaming AI call to {candidate} for {step or 'other'} failed: {e}")
+                continue
+            model_latency.record(step, candidate, time.perf_counter() - started)
+            result = "".join(parts)
+            note_call(model=candidate, fallbacks=attempt)
+            note_ai_usage(candidate, messages, result)
+            if use_cache:
+                set_cached_completion(cache_key, result)
+            return result
+        logging.error(f"Error during streaming AI interaction: every model failed for {step or 'other'} ({', '.join(models)}).")
         return None
 
+# --- Draft Selection ---
+
+MARKDOWN_HEADING = re.compile(r"^\s*#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+OUTLINE_ITEM = re.compile(r"^\s*(?:#{1,6}|\d+(?:\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+.+$", re.MULTILINE)
+DRAFT_SCORE_WEIGHTS = {"keywords": 0.5, "headings": 0.3, "length": 0.2}
+
+def heading_words(text):
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 3}
+
+def score_draft(draft, plan, final_keywords):
+    """Score a draft from 0 to 1 without calling a model.
+
+    Combines the share of target keywords it mentions, the share of the plan's
+    headings it has a matching heading for (at least half the heading's words),
+    and its length against ``draft_target_words``.
+    """
+    text = draft.lower()
+    keywords = [record.keyword.lower() for record in final_keywords]
+    draft_headings = set().union(*map(heading_words, MARKDOWN_HEADING.findall(draft)))
+    plan_headings = [words for words in map(heading_words, OUTLINE_ITEM.findall(plan or "")) if words]
+    parts = {
+        "keywords": sum(keyword in text for keyword in keywords) / len(keywords) if keywords else 1.0,
+        "headings": sum(len(words & draft_headings) * 2 >= len(words) for words in plan_headings) / len(plan_headings)
+        if plan_headings else 1.0,
+        "length": min(1.0, len(draft.split()) / config["draft_target_words"])
+    }
+    parts["score"] = sum(DRAFT_SCORE_WEIGHTS[name] * value for name, value in parts.items())
+    return {name: round(value, 3) for name, value in parts.items()}
+
+def select_draft(drafts, plan, final_keywords):
+    """Return the index of the best-scoring draft (``None`` if all failed) and every variant's scores."""
+    scores = [None if not draft else {**config["draft_variants"][index], **score_draft(draft, plan, final_keywords)}
+              for index, draft in enumerate(drafts)]
+    scored = [index for index, score in enumerate(scores) if score]
+    winner = max(scored, key=lambda index: scores[index]["score"]) if scored else None
+    return winner, scores
+
+def write_draft_variants(messages, variants):
+    """Write one draft per variant in parallel; yields ``(index, draft)`` as they finish.
+
+    ``draft`` is ``None`` for a variant that failed. Once the first draft is in the
+    rest get ``draft_grace`` seconds; drafts still being written after that are
+    abandoned (their calls finish in the background).
+    """
+    executor = ThreadPoolExecutor(max_workers=len(variants))
+    try:
+        futures = {
+            executor.submit(contextvars.copy_context().run, interact_with_ai, messages,
+                            variant.get("model"), variant.get("temperature"), False, "draft"): index
+            for index, variant in enumerate(variants)
+        }
+        pending, deadline = set(futures), None
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                logging.info(f"Selecting among drafts after the grace period; {len(pending)} still being written.")
+                return
+            for future in finished:
+                draft = None if future.exception() else future.result()
+                if draft and deadline is None:
+                    deadline = time.monotonic() + config["draft_grace"]
+                yield futures[future], draft
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def summarize_plan(plan, token_budget=None):
+    """The plan's headings and numbered outline lines, within ``token_budget`` tokens.
+
+    A plan without any outline lines is cut to the budget instead.
+    """
+    token_budget = token_budget or config["plan_summary_tokens"]
+    lines = [line.strip() for line in OUTLINE_ITEM.findall(plan or "")] or [line for line in (plan or "").splitlines() if line.strip()]
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            kept.append("...")
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
 # --- Main Workflow ---
 
 def main():
@@ -176,101 +1681,204 @@ def main():
     topic_query = input("Enter the topic you want to write about: ")  # Direct topic input
     
     # Step 2: Retrieve SERP Data
-    df_serp = get_serpapi_data(topic_query)
+    serp_results = get_serpapi_data(topic_query)
 
-    if df_serp.empty:
+    if not serp_results:
         print("Could not retrieve essential data. Exiting.")
         return
 
     # Step 3: Retrieve SEMrush Data
-    df_results = df_serp.copy()
-    final_keywords_df = process_semrush_data(df_results)
+    _, _, final_keywords = process_semrush_data(serp_results)
 
     # Step 4: Retrieve Onpage Content
-    df_results['Content'] = df_results['Link'].apply(fetch_content)
+    contents = [None] * len(serp_results)
+    for index, content in fetch_contents_concurrently([result.link for result in serp_results]):
+        contents[index] = content
 
     # Step 5: Content Analysis
-    content_analysis = perform_content_analysis(df_results, topic_query)
+    pages = [{**result.row(), 'Content': content} for result, content in zip(serp_results, contents)]
+    content_analysis = perform_content_analysis(pages, topic_query)
     print(f"Content Analysis:\n{content_analysis}\n")
 
     # Step 6: Generate Content Plan
-    content_plan = generate_content_plan(content_analysis, topic_query, final_keywords_df)
+    content_plan = generate_content_plan(content_analysis, topic_query, final_keywords)
     print(f"Content Plan:\n{content_plan}\n")
 
     # Step 7: Generate Content Draft
-    content_draft = create_content_draft(content_plan, content_analysis)
+    content_draft = create_content_draft(content_plan, content_analysis, final_keywords)
     print(f"Content Draft:\n{content_draft}\n")
 
     # Step 8: Proofread the Draft Post
-    proofread_draft = proofread_content_draft(content_draft, content_plan, content_analysis)
+    proofread_draft = proofread_content_draft(content_draft, content_plan)
     print(f"Proofread Draft:\n{proofread_draft}\n")
 
     # Step 9: SEO Recommendations
-    seo_recommendations = provide_seo_recommendations(proofread_draft, final_keywords_df)
+    seo_recommendations = provide_seo_recommendations(proofread_draft, final_keywords)
     print(f"SEO Recommendations:\n{seo_recommendations}\n")
 
     # Step 10: Final Deliverable
-    final_deliverable = compile_final_deliverable(proofread_draft, seo_recommendations, final_keywords_df, df_serp, content_analysis)
+    final_deliverable = compile_final_deliverable(proofread_draft, seo_recommendations, final_keywords, serp_results, content_analysis)
     print(f"Final Deliverable:\n{final_deliverable}\n")
 
-def perform_content_analysis(df_results, topic_query):
-    content_list = [item['Content'] for item in df_results if item.get('Content') and not item['Content'].startswith('ERROR:')]
-    messages_content_analysis = [
+def build_content_analysis_messages(content_list, topic_query):
+    return [
         {"role": "system", "content": "You are a meticulous content researcher with expertise in analyzing web content, particularly articles and blogs. You have access to a list of webpage contents related to the topic a user is interested in."},
         {"role": "user", "content": f"Analyze the provided content below. First, determine if each piece of content is a blog or an article. Disregard any content that is not a blog or an article. For each identified blog or article, add it to a review list. Then, thoroughly review each item on this list and provide an analysis that includes: (1) Common topics and subtopics covered across these blogs/articles. (2) Any contradicting viewpoints among the top 10 results. (3) For users searching for '{topic_query}', identify information gaps - what are they likely interested in that isn't covered, or what questions might they have that remain unanswered by these sources?\n\n"
                                 + "\n".join([f"WEB CONTENT {i + 1}\n{content}" for i, content in enumerate(content_list)])
         }
     ]
-    return interact_with_ai(messages_content_analysis)
 
-def generate_content_plan(content_analysis, topic_query, final_keywords_df):
-    messages_content_plan = [
+def build_page_digest_messages(content):
+    return [
+        {"role": "system", "content": "You are a meticulous content researcher with expertise in analyzing web content, particularly articles and blogs. You summarize a single webpage into a compact, structured digest that another researcher will compare against digests of other pages."},
+        {"role": "user", "content": f"Summarize the webpage content below as a structured digest with these sections:\n"
+                                f"- Type: blog, article or other (e.g. product page, forum, directory).\n"
+                                f"- Topics: the main topics and subtopics covered, as a short bulleted list.\n"
+                                f"- Key Claims: the main claims, recommendations and viewpoints, including any figures quoted.\n"
+                                f"- Unique Points: anything this page covers that a typical page on the subject would not.\n"
+                                f"Keep the digest under 300 words. Please provide the digest only, without any additional commentary or explanations.\n\n"
+                                f"WEB CONTENT\n{content}"
+        }
+    ]
+
+def summarize_page(item):
+    """Digest a single fetched page, reusing a cached digest for unchanged content.
+
+    Digests do not depend on the topic, so pages shared between topics are only
+    summarized once per content version. Like routed completions (see
+    ``completion_cache_key``), a digest is keyed on the digest route rather than
+    on the model that wrote it, which may be a fallback: any model on the route
+    serves, and changing the route's models starts a fresh set of digests.
+    """
+    content = "\n\n".join(strip_boilerplate(page_content(item) or ""))
+    char_limit = config["digest_page_token_limit"] * 4
+    if len(content) > char_limit:
+        content = content[:char_limit]
+    cache_key = {
+        "url": normalize_url(item['Link']),
+        "content": hashlib.sha256(content.encode('utf-8')).hexdigest(),
+        "route": ai_route("digest")["models"]
+    }
+    digest = cache_get("digest", cache_key)
+    if digest is None:
+        digest = interact_with_ai(build_page_digest_messages(content), step="digest")
+        if digest is not None:
+            cache_set("digest", cache_key, digest)
+    return digest
+
+def summarize_pages_concurrently(pages, max_workers=None):
+    """Digest every page with a bounded thread pool.
+
+    Yields ``(index, digest)`` tuples in completion order; ``digest`` is ``None``
+    for pages whose summarization failed.
+    """
+    for index, digest, error in run_concurrently(summarize_page, pages, max_workers or config["analysis_map_workers"]):
+        if error is not None:
+            logging.error(f"Failed to summarize {pages[index]['Link']}: {error}")
+        yield index, digest
+
+def analyzable_pages(content_fetch_results):
+    """The successfully fetched pages whose text is still available, with it inline as ``Content``.
+
+    Pages stored by ``ContentId`` are dropped when the content store has evicted
+    them (e.g. a run resumed long after its content stage), rather than analyzed
+    as empty text.
+    """
+    pages = []
+    for item in content_fetch_results:
+        if not item.get('Success', True):
+            continue
+        content = page_content(item)
+        if content and not content.startswith('ERROR:'):
+            pages.append({**item, 'Content': content})
+    return pages
+
+def build_digest_analysis_messages(digests, topic_query):
+    return [
+        {"role": "system", "content": "You are a meticulous content researcher with expertise in analyzing web content, particularly articles and blogs. You have access to structured digests of the webpages ranking for the topic a user is interested in."},
+        {"role": "user", "content": f"Analyze the page digests provided below. Disregard any page whose type is not a blog or an article. Then, thoroughly review the remaining digests and provide an analysis that includes: (1) Common topics and subtopics covered across these blogs/articles. (2) Any contradicting viewpoints among the top 10 results. (3) For users searching for '{topic_query}', identify information gaps - what are they likely interested in that isn't covered, or what questions might they have that remain unanswered by these sources?\n\n"
+                                + "\n".join([f"PAGE DIGEST {i + 1}\n{digest}" for i, digest in enumerate(digests)])
+        }
+    ]
+
+def perform_content_analysis(content_results, topic_query):
+    pages = analyzable_pages(content_results)
+    if not pages:
+        return None
+    if config["analysis_mode"] == "map_reduce":
+        digests = [None] * len(pages)
+        for index, digest in summarize_pages_concurrently(pages):
+            digests[index] = digest
+        digests = [digest for digest in digests if digest]
+        if not digests:
+            return None
+        return interact_with_ai(build_digest_analysis_messages(digests, topic_query), step="analysis")
+    content_list, _ = pack_context(pages)
+    return interact_with_ai(build_content_analysis_messages(content_list, topic_query), step="analysis")
+
+def build_content_plan_messages(content_analysis, topic_query, final_keywords):
+    return [
         {"role": "system", "content": "You are an expert content strategist skilled in crafting detailed and actionable content plans. You are adept at creating outlines that are clear, comprehensive, and tailored to the specific needs of a given topic. You have access to a detailed analysis of competitor content related to the topic a user is interested in."},
         {"role": "user", "content": f"Considering the content analysis provided, develop a comprehensive content plan. The plan should include:\n\n"
                                 f"Topic: {topic_query}\n"
                                 f"An outline with a hierarchical structure of headings and subheadings that logically organize the content.\n\n"
-                                f"Incorporate these SEO keywords: {final_keywords_df}. Ensure these keywords are naturally integrated into the headings and subheadings where relevant.\n\n"
+                                f"Incorporate these SEO keywords:\n{keywords_table(final_keywords)}\n\nEnsure these keywords are naturally integrated into the headings and subheadings where relevant.\n\n"
                                 f"While developing the plan, make sure to:\n"
                                 f"Address the common topics and subtopics identified in the content analysis.\n"
                                 f"Highlight any areas with contradicting viewpoints, and suggest a balanced approach to these topics.\n\n"
                                 f"CONTENT ANALYSIS:\n {content_analysis}"
         }
     ]
-    return interact_with_ai(messages_content_plan)
 
-def create_content_draft(content_plan, content_analysis):
-    messages_content_draft = [
+def generate_content_plan(content_analysis, topic_query, final_keywords):
+    return interact_with_ai(build_content_plan_messages(content_analysis, topic_query, final_keywords), step="plan")
+
+def build_content_draft_messages(content_plan, content_analysis):
+    return [
         {"role": "system", "content": "You are a skilled content writer specializing in crafting engaging, informative, and SEO-friendly blog posts. You excel at following detailed content plans and adapting your writing style to meet specific guidelines and objectives. You have access to a content plan and an analysis of competitor content related to the topic a user is interested in."},
         {"role": "user", "content": f"Using the provided Content Plan and the insights from the Competitor Content Analysis, write a comprehensive article. Focus on delivering high-quality content that is engaging, informative, and optimized for search engines. Adhere to the structure and guidelines set in the Content Plan, and ensure the article addresses the topics and keywords specified. The article should be written in a style that is accessible and appealing to the target audience, while also being mindful of SEO best practices. Please provide the article only, without any additional commentary or explanations.\n\n"
                                 f"Content Plan:\n {content_plan}\n\n"
                                 f"Competitor Content Analysis:\n {content_analysis}"
         }
     ]
-    return interact_with_ai(messages_content_draft)
 
-def proofread_content_draft(content_draft, content_plan, content_analysis):
-    messages_proofread_draft = [
-        {"role": "system", "content": "You are an expert content editor with a keen eye for detail, specializing in refining and polishing written content. You excel at ensuring content is engaging, error-free, and adheres to SEO best practices. You have access to a draft article, its corresponding content plan, and an analysis of competitor content related to the topic a user is interested in."},
-        {"role": "user", "content": f"Review the provided Content Draft, ensuring it aligns with the Content Plan and surpasses the quality of competitor content as detailed in the Competitor Content Analysis. Your task is to refine the draft, focusing on enhancing its engagement, clarity, and readability. Ensure the content is free of grammatical errors, follows SEO best practices, and is well-structured. Make any necessary adjustments to improve the overall quality and impact of the article. Please provide the revised article only, without any additional commentary or explanations.\n\n"
+def create_content_draft(content_plan, content_analysis, final_keywords=()):
+    messages = build_content_draft_messages(content_plan, content_analysis)
+    variants = config["draft_variants"]
+    if len(variants) < 2:
+        return interact_with_ai(messages, step="draft")
+    drafts = [None] * len(variants)
+    for index, draft in write_draft_variants(messages, variants):
+        drafts[index] = draft
+    winner, _ = select_draft(drafts, content_plan, final_keywords)
+    return None if winner is None else drafts[winner]
+
+def build_proofread_draft_messages(content_draft, content_plan):
+    return [
+        {"role": "system", "content": "You are an expert content editor with a keen eye for detail, specializing in refining and polishing written content. You excel at ensuring content is engaging, error-free, and adheres to SEO best practices. You have access to a draft article and the outline of its content plan related to the topic a user is interested in."},
+        {"role": "user", "content": f"Review the provided Content Draft, ensuring it follows the Plan Outline. Your task is to refine the draft, focusing on enhancing its engagement, clarity, and readability. Ensure the content is free of grammatical errors, follows SEO best practices, and is well-structured. Make any necessary adjustments to improve the overall quality and impact of the article. Please provide the revised article only, without any additional commentary or explanations.\n\n"
                                 f"Content Draft:\n {content_draft}\n\n"
-                                f"Content Plan:\n {content_plan}\n\n"
-                                f"Competitor Content Analysis:\n {content_analysis}"
+                                f"Plan Outline:\n{summarize_plan(content_plan)}"
         }
     ]
-    return interact_with_ai(messages_proofread_draft)
 
-def provide_seo_recommendations(proofread_draft, final_keywords_df):
-    messages_seo_recommendations = [
+def proofread_content_draft(content_draft, content_plan):
+    return interact_with_ai(build_proofread_draft_messages(content_draft, content_plan), step="proofread")
+
+def build_seo_recommendations_messages(proofread_draft, final_keywords):
+    return [
         {"role": "system", "content": "You are a seasoned SEO expert specializing in optimizing blog articles for search engines. You are adept at crafting compelling title tags and meta descriptions that improve click-through rates and accurately reflect the content. You have access to the final version of a blog article and a list of its targeting keywords related to the topic a user is interested in."},
         {"role": "user", "content": f"Examine the provided Content and the list of Targeting Keywords. Develop an optimized URL slug for the article. Generate three variations of a Title Tag, each designed to capture attention and encourage clicks. Additionally, create three variations of a Meta Description that accurately summarize the article's content and entice users to read further. Ensure each suggestion is SEO-friendly and aligns with current best practices. Please provide only the URL slug, Title Tags, and Meta Descriptions, without any additional commentary or explanations.\n\n"
                                 f"Content:\n {proofread_draft}\n\n"
-                                f"Targeting Keywords:\n {final_keywords_df}\n"
+                                f"Targeting Keywords:\n{keywords_table(final_keywords)}\n"
         }
     ]
-    return interact_with_ai(messages_seo_recommendations)
 
-def compile_final_deliverable(proofread_draft, seo_recommendations, final_keywords_df, df_serp, content_analysis):
-    messages_final_deliverable = [
+def provide_seo_recommendations(proofread_draft, final_keywords):
+    return interact_with_ai(build_seo_recommendations_messages(proofread_draft, final_keywords), step="seo")
+
+def build_final_deliverable_messages(proofread_draft, seo_recommendations, final_keywords, serp_results, content_analysis):
+    return [
         {"role": "system", "content": "You are a meticulous Senior Project Manager with expertise in presenting comprehensive project deliverables. You excel at organizing and summarizing complex information into a clear, concise, and client-ready format. You have access to all the outputs generated during a content creation process related to the topic a user is interested in."},
         {"role": "user", "content": f"Compile the following information into a well-structured document for client presentation. The document should clearly outline the entire content generation process and include: \n\n"
                                 f"- Title & Meta Description: Present the SEO-optimized title and meta description options, highlighting the chosen or recommended ones. Include alternative options for consideration.\n"
@@ -282,142 +1890,1016 @@ def compile_final_deliverable(proofread_draft, seo_recommendations, final_keywor
                                 f"Ensure the deliverable is client-friendly, easy to understand, and provides a comprehensive overview of the project. Please provide the final deliverable document only, without any additional commentary or explanations.\n\n"
                                 f"Content:\n {proofread_draft}\n\n"
                                 f"SEO Recommendations:\n {seo_recommendations}\n"
-                                f"Targeting Keywords:\n {final_keywords_df}\n"
-                                f"Competitors:\n {df_serp}\n"
+                                f"Targeting Keywords:\n{keywords_table(final_keywords)}\n"
+                                f"Competitors:\n{competitors_table(serp_results)}\n"
                                 f"Competitors Analysis:\n {content_analysis}\n"
         }
     ]
-    return interact_with_ai(messages_final_deliverable)
+
+def compile_final_deliverable(proofread_draft, seo_recommendations, final_keywords, serp_results, content_analysis):
+    return interact_with_ai(build_final_deliverable_messages(proofread_draft, seo_recommendations, final_keywords, serp_results, content_analysis), step="final")
+
+# --- Pipeline ---
+
+class PipelineHalted(Exception):
+    """Raised by a stage that has already reported why the run cannot continue."""
+
+PipelineStage = namedtuple("PipelineStage", ["name", "deps", "run"])
+
+def run_ai_step(step, message, title, messages):
+    """Run one AI step of the /progress stream and return its output.
+
+    Emits the step's ``progress`` event, then either forwards token deltas as
+    ``delta`` events while the completion streams in or waits for the whole
+    completion, and finally emits the ``complete`` event with the full text.
+    """
+    yield format_sse_message("progress", step=step, message=message)
+    if config["stream_ai_output"]:
+        stream = stream_with_ai(messages, step=step)
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as finished:
+                result = finished.value
+                break
+            yield format_sse_message("delta", step=step, data=delta)
+    else:
+        result = interact_with_ai(messages, step=step)
+    if result is None:
+        raise RuntimeError(f"The AI model returned no output for the {step} step.")
+    yield format_sse_message("complete", step=step, title=title, data=result)
+    return result
+
+def prompt_for(context, step, messages):
+    """Apply any prompt override stored for ``step`` in the run's context.
+
+    An override may replace the system prompt (``system``) and/or append extra
+    guidance to the user prompt (``instructions``).
+    """
+    override = context.get("prompt_overrides", {}).get(step)
+    if not override:
+        return messages
+    messages = [dict(message) for message in messages]
+    if override.get("system"):
+        messages[0]["content"] = override["system"]
+    if override.get("instructions"):
+        messages[-1]["content"] += f"\n\nAdditional instructions:\n{override['instructions']}"
+    return messages
+
+def forward_events(events, emit):
+    """Pass every SSE message from a stage generator to ``emit`` and return its result."""
+    while True:
+        try:
+            emit(next(events))
+        except StopIteration as finished:
+            return finished.value
+
+def serp_stage(context):
+    yield format_sse_message("progress", step="serp", message="Retrieving SERP Data...")
+    serp_results = get_serpapi_data(context["topic_query"])
+    if not serp_results:
+        error_message = "Failed to retrieve data from SerpAPI."
+        yield format_sse_message("complete", step="serp", title="Could not retrieve SERP data.", data=error_message)
+        raise PipelineHalted(error_message)
+
+    yield format_sse_message("complete", step="serp", title="SERP Data Retrieved", data=serp_rows(serp_results))
+    return serp_results
+
+def serp_rows(serp_results):
+    return [result.row() for result in serp_results]
+
+def semrush_stage(context):
+    yield format_sse_message("progress", step="semrush", message="Processing SEMRush Data...")
+    serp_results = context["serp"]
+
+    semrush_results, semrush_failures, final_keywords = process_semrush_data(serp_results)
+    if semrush_failures:
+        yield format_sse_message("progress", step="semrush",
+                               message=f"SEMRush data unavailable for {len(semrush_failures)} of {len(serp_results)} URLs",
+                               failed_urls=semrush_failures)
+
+    output, complete_data = semrush_stage_output(serp_results, semrush_results, final_keywords)
+    yield format_sse_message("complete", step="semrush", title="SEMRush Data Retrieved and Processed", data=complete_data)
+    return output
+
+def semrush_stage_output(serp_results, semrush_results, final_keywords):
+    """Return the semrush stage's output and the (trimmed) data for its ``complete`` event."""
+    semrush_data = [{**result.row(), 'SEMRush Data': data} for result, data in zip(serp_results, semrush_results)]
+    common_keywords = [
+        {'Keyword': record.keyword, 'Frequency': record.frequency, 'Search Volume': record.search_volume}
+        for record in final_keywords
+    ]
+
+    # Only the top rows per URL go over SSE; the full tables stay in the run context.
+    semrush_preview = [
+        {**item, 'SEMRush Data': item['SEMRush Data'].rows(config["sse_preview_rows"]) if item['SEMRush Data'] else [],
+         'Keyword Count': len(item['SEMRush Data'] or [])}
+        for item in semrush_data
+    ]
+    return {"results": semrush_data, "keywords": final_keywords}, {"semrush_results": semrush_preview, "common_keywords": common_keywords}
+
+def content_stage(context):
+    serp_results = context["serp"]
+    urls = [result.link for result in serp_results]
+    total_urls = len(urls)
+    content_fetch_results = [None] * total_urls
+
+    yield format_sse_message("progress", step="content",
+                           message=f"Fetching content from {total_urls} URLs ({min(config['content_fetch_workers'], total_urls)} at a time)...",
+                           current=0,
+                           total=total_urls)
+
+    completed = 0
+    for index, content in fetch_contents_concurrently(urls):
+        completed += 1
+        content_fetch_results[index] = content_result(serp_results[index], content)
+
+        # Send individual URL completion status
+        yield format_sse_message("url_complete",
+                               url=urls[index],
+                               success=content_fetch_results[index]['Success'],
+                               current=completed,
+                               total=total_urls)
+
+    # Send final completion message
+    yield format_sse_message("complete", step="content",
+                           title="Content Fetching Complete",
+                           data=content_fetch_results)
+    return content_fetch_results
+
+def content_result(result, content):
+    """Store a fetched page and return its result row; full text goes to the content store."""
+    success = not content.startswith("ERROR:")
+    return {
+        **result.row(),
+        'ContentId': content_store.put(content) if success else None,
+        'Length': len(content) if success else 0,
+        'Preview': preview(content),
+        'Success': success
+    }
+
+def analysis_stage(context):
+    pages = analyzable_pages(context["content"])
+    if not pages:
+        error_message = "No competitor page content is available to analyze."
+        yield format_sse_message("error", step="analysis", message=error_message)
+        raise PipelineHalted(error_message)
+    if config["analysis_mode"] == "map_reduce":
+        digests = [None] * len(pages)
+        yield format_sse_message("progress", step="analysis", message=f"Summarizing {len(pages)} pages...",
+                               current=0, total=len(pages))
+        for completed, (index, digest) in enumerate(summarize_pages_concurrently(pages), start=1):
+            digests[index] = digest
+            yield format_sse_message("progress", step="analysis", message=f"Summarized {completed} of {len(pages)} pages",
+                                   current=completed, total=len(pages))
+        digests = [digest for digest in digests if digest]
+        if not digests:
+            # As in perform_content_analysis: there is nothing to reduce.
+            error_message = "Could not summarize any competitor page."
+            yield format_sse_message("error", step="analysis", message=error_message)
+            raise PipelineHalted(error_message)
+        analysis_messages = build_digest_analysis_messages(digests, context["topic_query"])
+    else:
+        content_list, packing_stats = pack_context(pages)
+        yield format_sse_message("progress", step="analysis",
+                               message=f"Packed competitor content into {packing_stats['packed_tokens']} tokens ({packing_stats['tokens_saved']} saved)",
+                               stats=packing_stats)
+        analysis_messages = build_content_analysis_messages(content_list, context["topic_query"])
+    return (yield from run_ai_step("analysis", "Analyzing Content...", "Analyzing Content",
+                                   prompt_for(context, "analysis", analysis_messages)))
+
+# Progress message, completion title and prompt builder of each AI step after the analysis.
+AI_STEPS = {
+    "plan": ("Generating Content Plan...", "Content Planning",
+             lambda context: build_content_plan_messages(context["analysis"], context["topic_query"], context["semrush"]["keywords"])),
+    "draft": ("Creating Content Draft...", "Content Draft",
+              lambda context: build_content_draft_messages(context["plan"], context["analysis"])),
+    "proofread": ("Proofreading Content...", "Proofreading",
+                  lambda context: build_proofread_draft_messages(context["draft"], context["plan"])),
+    "seo": ("Generating SEO Recommendations...", "SEO Recommendations",
+            lambda context: build_seo_recommendations_messages(context["proofread"], context["semrush"]["keywords"])),
+    "final": ("Compiling Final Deliverable...", "Final Deliverable",
+              lambda context: build_final_deliverable_messages(context["proofread"], context["seo"], context["semrush"]["keywords"],
+                                                               context["serp"], context["analysis"]))
+}
+
+def ai_stage(step):
+    message, title, build_messages = AI_STEPS[step]
+
+    def run(context):
+        return (yield from run_ai_step(step, message, title, prompt_for(context, step, build_messages(context))))
+    return run
+
+def draft_stage(context):
+    """The draft step; with ``draft_variants`` configured, writes them in parallel and keeps the best."""
+    variants = config["draft_variants"]
+    if len(variants) < 2:
+        return (yield from ai_stage("draft")(context))
+    message, title, build_messages = AI_STEPS["draft"]
+    yield format_sse_message("progress", step="draft", message=f"Writing {len(variants)} candidate drafts...")
+    messages = prompt_for(context, "draft", build_messages(context))
+    drafts = [None] * len(variants)
+    for completed, (index, draft) in enumerate(write_draft_variants(messages, variants), start=1):
+        drafts[index] = draft
+        yield format_sse_message("progress", step="draft", message=f"Finished {completed} of {len(variants)} drafts",
+                               current=completed, total=len(variants))
+    winner, scores = select_draft(drafts, context["plan"], context["semrush"]["keywords"])
+    if winner is None:
+        raise RuntimeError("The AI model returned no output for the draft step.")
+    yield format_sse_message("complete", step="draft", title=title, data=drafts[winner], winner=winner, scores=scores)
+    return drafts[winner]
+
+# SEMRush lookups only need the SERP links, so they overlap content fetching and analysis.
+PIPELINE_STAGES = [
+    PipelineStage("serp", (), serp_stage),
+    PipelineStage("semrush", ("serp",), semrush_stage),
+    PipelineStage("content", ("serp",), content_stage),
+    PipelineStage("analysis", ("content",), analysis_stage),
+    PipelineStage("plan", ("analysis", "semrush"), ai_stage("plan")),
+    PipelineStage("draft", ("plan",), draft_stage),
+    PipelineStage("proofread", ("draft",), ai_stage("proofread")),
+    PipelineStage("seo", ("proofread", "semrush"), ai_stage("seo")),
+    PipelineStage("final", ("seo",), ai_stage("final"))
+]
+
+def downstream_stages(stage_name, stages=PIPELINE_STAGES):
+    """Return ``stage_name`` and every stage that transitively depends on it."""
+    affected = {stage_name}
+    for stage in stages:
+        if affected.intersection(stage.deps):
+            affected.add(stage.name)
+    return affected
+
+def run_pipeline(stages, context, emit, cancelled=None, checkpoints=None):
+    """Run pipeline stages as soon as their dependencies have completed.
+
+    Each stage is a generator that yields SSE messages (passed to ``emit``) and
+    returns its output, which is stored in ``context`` under the stage name.
+    Stages whose dependencies failed are skipped. With a ``RunCheckpoints``,
+    stages checkpointed by an earlier attempt are restored (replaying their
+    ``complete`` event) instead of re-run, and newly completed stages are saved.
+    Returns per-stage timings in seconds relative to the start of the run.
+    """
+    run_started = time.perf_counter()
+    timings = {}
+    done = set()
+    failed = set()
+    running = {}
+
+    if checkpoints is not None:
+        for name, (output, complete_message) in checkpoints.load().items():
+            context[name] = output
+            done.add(name)
+            timings[name] = {"restored": True}
+            if complete_message:
+                emit(complete_message)
+
+    def run_stage(stage):
+        started = time.perf_counter()
+        complete_messages = []
+
+        def stage_emit(message):
+            if message.startswith('data: {"type": "complete"'):
+                complete_messages.append(message)
+            emit(message)
+
+        context[stage.name] = forward_events(stage.run(context), stage_emit)
+        if checkpoints is not None:
+            checkpoints.save(stage.name, context[stage.name], complete_messages[-1] if complete_messages else None)
+        return started, time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=config["pipeline_workers"]) as executor:
+        while True:
+            if not (cancelled and cancelled.is_set()):
+                for stage in stages:
+                    if stage.name not in done and stage.name not in failed and stage.name not in running \
+                            and all(dep in done for dep in stage.deps):
+                        running[stage.name] = executor.submit(contextvars.copy_context().run, run_stage, stage)
+            if not running:
+                break
+            finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                try:
+                    started, ended = future.result()
+                except PipelineHalted as e:
+                    logging.warning(f"Pipeline halted at {name}: {e}")
+                    failed.add(name)
+                    continue
+                except Exception as e:
+                    logging.exception(f"Pipeline stage {name} failed.")
+                    emit(format_sse_message("error", step=name, message=str(e)))
+                    failed.add(name)
+                    continue
+                done.add(name)
+                timings[name] = {"start": round(started - run_started, 3), "duration": round(ended - started, 3)}
+
+    timings["total"] = round(time.perf_counter() - run_started, 3)
+    logging.info(f"Pipeline stage timings: {timings}")
+    return timings
+
+# --- Checkpoints ---
+
+RECORD_TYPES = {record_type.__name__: record_type for record_type in (SerpResult, KeywordRecord)}
+
+def to_checkpoint(value):
+    if isinstance(value, list) and value and isinstance(value[0], (SerpResult, KeywordRecord)):
+        return {"__records__": type(value[0]).__name__, "rows": [record.row() for record in value]}
+    if isinstance(value, KeywordTable):
+        return {"__table__": value.to_columns()}
+    if isinstance(value, list):
+        return [to_checkpoint(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_checkpoint(item) for key, item in value.items()}
+    return value
+
+def from_checkpoint(value):
+    if isinstance(value, dict):
+        if "__records__" in value:
+            return [RECORD_TYPES[value["__records__"]].from_row(row) for row in value["rows"]]
+        if "__table__" in value:
+            return KeywordTable.from_columns(value["__table__"])
+        if "__frame__" in value:
+            # Checkpoints written while stages passed DataFrames around.
+            record_type = KeywordRecord if "Keyword" in value["columns"] else SerpResult
+            return [record_type.from_row(row) for row in value["__frame__"]]
+        return {key: from_checkpoint(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_checkpoint(item) for item in value]
+    return value
+
+class CheckpointStore:
+    """SQLite-backed store of per-stage pipeline outputs, keyed by run ID.
+
+    Alongside each stage's output the store keeps the stage's ``complete`` SSE
+    message, so a resumed run can show restored steps exactly as they were first
+    reported. Runs also remember their topic and any prompt overrides.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, topic TEXT NOT NULL, prompt_overrides TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "run_id TEXT NOT NULL, stage TEXT NOT NULL, output BLOB NOT NULL, complete_message TEXT, "
+                "created REAL NOT NULL, PRIMARY KEY (run_id, stage))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def register_run(self, run_id, topic):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR IGNORE INTO runs (run_id, topic, prompt_overrides, created) VALUES (?, ?, '{}', ?)",
+                         (run_id, topic, time.time()))
+            conn.commit()
+
+    def get_run(self, run_id):
+        with self._lock:
+            row = self._connect().execute("SELECT topic, prompt_overrides FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {"run_id": run_id, "topic": row[0], "prompt_overrides": json.loads(row[1])}
+
+    def set_prompt_override(self, run_id, stage, override):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT prompt_overrides FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            overrides = json.loads(row[0]) if row else {}
+            overrides[stage] = override
+            conn.execute("UPDATE runs SET prompt_overrides = ? WHERE run_id = ?", (json.dumps(overrides), run_id))
+            conn.commit()
+
+    def save(self, run_id, stage, output, complete_message):
+        blob = zlib.compress(json.dumps(to_checkpoint(output)).encode('utf-8'))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_id, stage, output, complete_message, created) VALUES (?, ?, ?, ?, ?)",
+                (run_id, stage, blob, complete_message, time.time())
+            )
+            conn.commit()
+
+    def load(self, run_id):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT stage, output, complete_message FROM checkpoints WHERE run_id = ? ORDER BY created", (run_id,)
+            ).fetchall()
+        return {stage: (from_checkpoint(json.loads(zlib.decompress(output))), message) for stage, output, message in rows}
+
+    def invalidate(self, run_id, stage_names):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM checkpoints WHERE run_id = ? AND stage = ?", [(run_id, stage) for stage in stage_names])
+            conn.commit()
+
+class RunCheckpoints:
+    """A ``CheckpointStore`` bound to one run, as used by ``run_pipeline``."""
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+
+    def load(self):
+        return self.store.load(self.run_id)
+
+    def save(self, stage, output, complete_message):
+        self.store.save(self.run_id, stage, output, complete_message)
+
+checkpoint_store = CheckpointStore(config["checkpoints_db_path"])
+
+def prepare_rerun(run_id, stage, prompt_override=None):
+    """Discard the checkpoints of ``stage`` and everything downstream of it.
+
+    The next ``run_topic`` call for ``run_id`` then resumes from ``stage``,
+    optionally with a new prompt override for it.
+    """
+    if stage not in {pipeline_stage.name for pipeline_stage in PIPELINE_STAGES}:
+        raise ValueError(f"Unknown pipeline stage: {stage}")
+    if prompt_override:
+        checkpoint_store.set_prompt_override(run_id, stage, prompt_override)
+    checkpoint_store.invalidate(run_id, downstream_stages(stage))
+
+def prompt_override_from(params):
+    """Build a prompt override from request parameters, or None if none was given."""
+    override = {key: params.get(key) for key in ("system", "instructions") if params.get(key)}
+    return override or None
+
+# --- Jobs ---
+
+class JobStore:
+    """SQLite-backed job queue and event log.
+
+    Jobs move from ``queued`` to ``running`` to ``done`` or ``failed``. Every SSE
+    message a job emits is appended to its event log with a sequence number so
+    clients can replay the run and resume tailing after a reconnect. Several
+    processes may share the file: a running job records the store that claimed it
+    (``owner``, one per process) and a heartbeat, so only jobs whose process stopped
+    are requeued.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, topic TEXT NOT NULL, status TEXT NOT NULL, "
+                "created REAL NOT NULL, started REAL, finished REAL, owner TEXT, heartbeat REAL)"
+            )
+            # Job databases created before owners and heartbeats were recorded.
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("owner TEXT", "heartbeat REAL"):
+                if column.split()[0] not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def create(self, topic):
+        job_id = uuid.uuid4().hex
+        with self._changed:
+            conn = self._connect()
+            conn.execute("INSERT INTO jobs (id, topic, status, created) VALUES (?, ?, 'queued', ?)", (job_id, topic, time.time()))
+            conn.commit()
+            self._changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT id, topic, status, created, started, finished FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "topic", "status", "created", "started", "finished"), row))
+
+    def claim(self):
+        """Mark the oldest queued job as running by this store and return it.
+
+        The update only applies while the job is still queued, so when another
+        process claims it first this one moves on to the next job.
+        """
+        with self._lock:
+            conn = self._connect()
+            while True:
+                row = conn.execute("SELECT id, topic FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, owner = ?, heartbeat = ? WHERE id = ? AND status = 'queued'",
+                    (now, self.owner, now, row[0])
+                ).rowcount
+                conn.commit()
+                if claimed:
+                    return {"id": row[0], "topic": row[1]}
+
+    def finish(self, job_id, status):
+        with self._changed:
+            conn = self._connect()
+            conn.execute("UPDATE jobs SET status = ?, finished = ? WHERE id = ?", (status, time.time(), job_id))
+            conn.commit()
+            self._changed.notify_all()
+
+    def requeue(self, job_id):
+        """Queue a finished job again; returns False if it is still queued or running."""
+        with self._changed:
+            conn = self._connect()
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, finished = NULL "
+                "WHERE id = ? AND status IN ('done', 'failed')", (job_id,)
+            ).rowcount
+            conn.commit()
+            self._changed.notify_all()
+        return bool(updated)
+
+    def heartbeat(self):
+        """Mark the jobs this store is running as still alive."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'", (time.time(), self.owner))
+            conn.commit()
+
+    def requeue_stale(self, stale_after):
+        """Put jobs whose process stopped (no heartbeat for ``stale_after`` seconds) back on the queue.
+
+        Their event log is cleared; the rerun resumes from the job's checkpoints.
+        """
+        stale = "status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)"
+        with self._changed:
+            conn = self._connect()
+            cutoff = time.time() - stale_after
+            conn.execute(f"DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE {stale})", (cutoff,))
+            requeued = conn.execute(f"UPDATE jobs SET status = 'queued', started = NULL, owner = NULL WHERE {stale}", (cutoff,)).rowcount
+            conn.commit()
+            if requeued:
+                self._changed.notify_all()
+        return requeued
+
+    def append_event(self, job_id, message):
+        with self._changed:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO job_events (job_id, seq, message) "
+                "VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?), ?)",
+                (job_id, job_id, message)
+            )
+            conn.commit()
+            self._changed.notify_all()
+
+    def events_after(self, job_id, seq):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT seq, message FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+            ).fetchall()
+
+    def wait_for_change(self, timeout):
+        with self._changed:
+            self._changed.wait(timeout)
+
+job_store = JobStore(config["jobs_db_path"])
+job_workers = []
+job_workers_lock = threading.Lock()
+
+class JobEventWriter:
+    """``emit`` for a job: appends its SSE messages to the job log, merging ``delta`` events.
+
+    Consecutive deltas of a step are held back and written as one delta once
+    ``flush_interval`` seconds have passed since the first, or as soon as any other
+    message (or a delta of another step) arrives, so the log keeps its order.
+    """
+
+    def __init__(self, store, job_id, flush_interval):
+        self.store = store
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._step = None
+        self._parts = []
+        self._held_since = None
+
+    def __call__(self, message):
+        with self._lock:
+            if message.startswith('data: {"type": "delta"'):
+                event = json.loads(message[len("data: "):])
+                if self._parts and event["step"] != self._step:
+                    self._flush()
+                if not self._parts:
+                    self._step, self._held_since = event["step"], time.monotonic()
+                self._parts.append(event["data"])
+                if time.monotonic() - self._held_since >= self.flush_interval:
+                    self._flush()
+                return
+            self._flush()
+            self.store.append_event(self.job_id, message)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._parts:
+            self.store.append_event(self.job_id, format_sse_message("delta", step=self._step, data="".join(self._parts)))
+            self._parts = []
+
+def run_topic(topic_query, emit, cancelled=None, run_id=None):
+    """Run the whole pipeline for one topic, emitting every SSE message except ``done``.
+
+    Every completed stage is checkpointed under ``run_id``; calling again with the
+    same ``run_id`` resumes after the last completed stage.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    run_metrics = RunMetrics()
+    metrics_token = active_run_metrics.set(run_metrics)
+    checkpoint_store.register_run(run_id, topic_query)
+    run = checkpoint_store.get_run(run_id)
+    emit(format_sse_message("start", message=f"Starting content generation for topic: {run['topic']}", run_id=run_id))
+    context = {"topic_query": run['topic'], "run_id": run_id, "prompt_overrides": run['prompt_overrides']}
+    try:
+        timings = run_pipeline(PIPELINE_STAGES, context, emit, cancelled, RunCheckpoints(checkpoint_store, run_id))
+    finally:
+        active_run_metrics.reset(metrics_token)
+    metrics.record_stages(timings)
+    emit(format_sse_message("timings", data=timings))
+    cache_stats = response_cache.stats()
+    logging.info(f"Response cache stats: {cache_stats}")
+    emit(format_sse_message("cache_stats", data=cache_stats))
+    run_summary = run_metrics.summary()
+    logging.info(f"Run metrics for {run_id}: {run_summary['operations']}, AI cost ${run_summary['total_cost']:.4f}")
+    emit(format_sse_message("metrics", data=run_summary))
+    emit(format_sse_message("quota", data=quota_status()))
+    return context
+
+def job_worker():
+    while True:
+        job = job_store.claim()
+        if job is None:
+            job_store.wait_for_change(timeout=config["job_poll_interval"])
+            continue
+        logging.info(f"Worker {threading.current_thread().name} running job {job['id']} for topic: {job['topic']}")
+        emit = JobEventWriter(job_store, job['id'], config["job_delta_flush_interval"])
+        try:
+            context = run_topic(job['topic'], emit, run_id=job['id'])
+            emit.flush()
+            job_store.finish(job['id'], "done" if "final" in context else "failed")
+        except Exception as e:
+            logging.exception(f"Job {job['id']} failed.")
+            emit(format_sse_message("error", message=str(e)))
+            job_store.finish(job['id'], "failed")
+
+def job_heartbeat():
+    """Keep this process's running jobs alive and requeue those of processes that stopped."""
+    while True:
+        job_store.heartbeat()
+        requeued = job_store.requeue_stale(config["job_stale_after"])
+        if requeued:
+            logging.info(f"Requeued {requeued} job(s) whose worker process stopped.")
+        time.sleep(config["job_heartbeat_interval"])
+
+def start_job_workers():
+    """Start the background worker pool (and its heartbeat) once per process."""
+    with job_workers_lock:
+        if job_workers:
+            return
+        heartbeat = threading.Thread(target=job_heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        job_workers.append(heartbeat)
+        for number in range(config["job_workers"]):
+            worker = threading.Thread(target=job_worker, name=f"job-worker-{number + 1}", daemon=True)
+            worker.start()
+            job_workers.append(worker)
+
+# --- Batch Mode ---
+
+def read_topics(path):
+    """Read topics from a CSV (``topic`` column, else the first column) or JSONL file."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            topics = [json.loads(line)['topic'] for line in f if line.strip()]
+        else:
+            rows = list(csv.reader(f))
+            if rows and 'topic' in [cell.strip().lower() for cell in rows[0]]:
+                column = [cell.strip().lower() for cell in rows[0]].index('topic')
+                rows = rows[1:]
+            else:
+                column = 0
+            topics = [row[column] for row in rows if len(row) > column]
+    # Topics that would write to the same deliverable file are only generated once.
+    unique = {}
+    for topic in topics:
+        if topic.strip():
+            unique.setdefault(topic_slug(topic), topic.strip())
+    return list(unique.values())
+
+def topic_slug(topic):
+    return re.sub(r'[^a-z0-9]+', '-', topic.lower()).strip('-') or 'topic'
+
+def run_batch(topics_path, output_dir):
+    """Generate deliverables for every topic in ``topics_path`` concurrently.
+
+    SEMRush and Jina results are shared between topics through a ``CallMemo``, so
+    each unique competitor URL is looked up once per batch. Every upstream call
+    still goes through the per-provider slots in ``upstream_slots``.
+    """
+    topics = read_topics(topics_path)
+    os.makedirs(output_dir, exist_ok=True)
+    memo = CallMemo()
+    memo_token = active_call_memo.set(memo)
+    logging.info(f"Starting batch of {len(topics)} topics from {topics_path}.")
+
+    def generate(topic):
+        context = run_topic(topic, lambda message: None)
+        if not context.get("final"):
+            raise RuntimeError("pipeline did not produce a final deliverable")
+        path = os.path.join(output_dir, f"{topic_slug(topic)}.md")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(context["final"])
+        return path
+
+    failed = []
+    try:
+        for index, path, error in run_concurrently(generate, topics, config["batch_workers"]):
+            if error is not None:
+                logging.error(f"Topic '{topics[index]}' failed: {error}")
+                failed.append(topics[index])
+            else:
+                logging.info(f"Wrote deliverable for '{topics[index]}' to {path}.")
+    finally:
+        active_call_memo.reset(memo_token)
+
+    summary = {
+        "topics": len(topics),
+        "failed": failed,
+        "upstream_calls": dict(memo.calls),
+        "shared_results": dict(memo.reused)
+    }
+    logging.info(f"Batch complete: {summary}")
+    return summary
 
 app = Flask(__name__)
 
+# --- SSE Encoding ---
+
+# Dicts carrying one of these keys are entities: sent once, then referenced.
+ENTITY_KEYS = {"Link": "result", "Keyword": "keyword"}
+# Keyword fields that do not depend on the URL; the rest (Position, Frequency) stay inline.
+KEYWORD_SHARED_FIELDS = ("Search Volume", "CPC", "Competition")
+
+class SSEEncoder:
+    """Per-connection encoder from pipeline messages to the incremental wire format.
+
+    Pipeline messages are self-contained (checkpoints, the job log and batch mode
+    rely on that). On the wire, result rows and keywords are keyed by their link or
+    keyword text; an ``entities`` event ahead of a payload carries only the fields
+    the client has not seen yet, and the payload points at them with
+    ``{"$ref": [kind, id]}`` plus any per-use fields (and ``$fields`` when only
+    some of the entity's fields belong to this payload). An
+    AI step's ``complete`` event omits its text (``streamed: true``) when this
+    connection already delivered it as ``delta`` events. Entities are per
+    connection: a client that reconnects must drop the ones it has.
+    """
+
+    def __init__(self):
+        self.entities = {}
+        self.streamed = defaultdict(list)
+
+    def encode(self, message):
+        """Return the list of SSE messages to send for one pipeline message."""
+        event = json.loads(message[len("data: "):])
+        if event["type"] == "delta":
+            self.streamed[event["step"]].append(event["data"])
+            return [message]
+        if event["type"] != "complete" or "data" not in event:
+            return [message]
+        if isinstance(event["data"], str):
+            streamed_text = "".join(self.streamed.pop(event["step"], []))
+            if streamed_text and streamed_text == event["data"]:
+                del event["data"]
+                return [format_sse_message(**{"type_str": event.pop("type"), **event, "streamed": True})]
+            return [message]
+        patches = defaultdict(dict)
+        event["data"] = self.reference(event["data"], patches)
+        encoded = format_sse_message(**{"type_str": event.pop("type"), **event})
+        return [format_sse_message("entities", data=patches), encoded] if patches else [encoded]
+
+    def reference(self, value, patches):
+        if isinstance(value, list):
+            return [self.reference(item, patches) for item in value]
+        if not isinstance(value, dict):
+            return value
+        value = {key: self.reference(item, patches) for key, item in value.items()}
+        for key, kind in ENTITY_KEYS.items():
+            if key in value and isinstance(value[key], str):
+                entity_id = value.pop(key)
+                shared = {field: value[field] for field in KEYWORD_SHARED_FIELDS if field in value} if kind == "keyword" else value
+                inline = {field: item for field, item in value.items() if field not in shared}
+                inline.update(self.patch(kind, entity_id, shared, patches))
+                reference = {"$ref": [kind, entity_id]}
+                if set(self.entities[(kind, entity_id)]) - set(shared):
+                    # The entity also holds fields from other payloads; name the ones used here.
+                    reference["$fields"] = list(shared)
+                return {**reference, **inline}
+        return value
+
+    def patch(self, kind, entity_id, fields, patches):
+        """Record unseen fields for the next ``entities`` event.
+
+        Keywords may carry different values for the same field in one payload, so a
+        keyword field that disagrees with what was already sent is returned to be
+        kept inline. Result rows are patched in place, since later events update them.
+        """
+        known = self.entities.setdefault((kind, entity_id), {})
+        conflicting = {}
+        for field, item in fields.items():
+            if field in known and known[field] == item:
+                continue
+            if kind == "keyword" and field in known:
+                conflicting[field] = item
+            else:
+                known[field] = patches[kind].setdefault(entity_id, {})[field] = item
+        return conflicting
+
+def sse_response(messages):
+    """Stream SSE messages, gzip-compressed when the client accepts it.
+
+    Each message is sync-flushed so events still reach the client immediately.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if "gzip" not in request.headers.get("Accept-Encoding", ""):
+        return Response(messages, mimetype='text/event-stream', headers=headers)
+
+    def compressed():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for message in messages:
+            yield compressor.compress(message.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return Response(compressed(), mimetype='text/event-stream', headers=headers)
+
 # --- Routes ---
+@app.before_request
+def ensure_job_workers():
+    """Start the job workers with the app, so jobs interrupted by a restart resume."""
+    if not job_workers:
+        start_job_workers()
+
 @app.route('/')
 def index():
     return render_template('index.html')  # Create index.html later
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/quota')
+def quota_endpoint():
+    return jsonify(quota_status())
+
+@app.route('/content/<content_id>')
+def page_content_endpoint(content_id):
+    content = content_store.get(content_id)
+    if content is None:
+        return jsonify({"error": "Content not found."}), 404
+    return Response(content, mimetype='text/markdown')
+
 @app.route('/progress')
 def progress():
     topic_query = request.args.get('topic')
+    # Passing the run_id from an earlier start event resumes that run; adding
+    # rerun=<stage> (optionally with system/instructions) redoes that stage onwards.
+    run_id = request.args.get('run_id')
+    rerun_stage = request.args.get('rerun')
+    known_run = run_id is not None and checkpoint_store.get_run(run_id) is not None
+    if rerun_stage:
+        if not run_id:
+            return jsonify({"error": "rerun requires a run_id."}), 400
+        if not known_run:
+            return jsonify({"error": "Run not found."}), 400
+        try:
+            prepare_rerun(run_id, rerun_stage, prompt_override_from(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    elif not known_run and not (topic_query or '').strip():
+        return jsonify({"error": "A topic is required."}), 400
+
     def generate():
-        yield format_sse_message("start", message=f"Starting content generation for topic: {topic_query}")
-
-        ## SERP Retrieval
-        yield format_sse_message("progress", step="serp", message="Retrieving SERP Data...")
-        df_serp = get_serpapi_data(topic_query)
-        if df_serp.empty:
-            error_message = "Failed to retrieve data from SerpAPI."
-            yield format_sse_message("complete", step="serp", title="Could not retrieve SERP data.", data=error_message)
-            return
-        
-        serp_data = []
-        for index, row in df_serp.iterrows():
-            serp_data.append({
-                'Position': row['Position'],
-                'Link': row['Link'],
-                'Title': row['Title']
-            })
-
-        yield format_sse_message("complete", step="serp", title="SERP Data Retrieved", data=serp_data)
-
-
-        ## SEMRush Retrieval
-        yield format_sse_message("progress", step="semrush", message="Processing SEMRush Data...")
-        df_results = df_serp.copy()
-
-        semrush_data_list = process_semrush_data(df_results)
-
-        semrush_data = []
-        for index, row in df_results.iterrows():
-            semrush_data.append({
-                'Position': row['Position'],
-                'Link': row['Link'],
-                'Title': row['Title'],
-                'SEMRush Data': row['SEMRush_Data']
-            })
-
-        common_keywords = []
-        for index, row in semrush_data_list.iterrows():
-            common_keywords.append({
-                'Keyword': row['Keyword'],
-                'Frequency': row['Frequency'],
-                'Search Volume': row['Search Volume']
-            })
-
-        yield format_sse_message("complete", step="semrush", title="SEMRush Data Retrieved and Processed",
-                               data={"semrush_results": semrush_data, "common_keywords": common_keywords})
-    
-        
-        ## Fetching Content
-        yield format_sse_message("progress", step="content", message="Starting content fetch...")
-        
-        content_fetch_results = []
-        total_urls = len(df_results)
-
-        for index, row in df_results.iterrows():
-            url = row['Link']
-            # Notify that we're starting to fetch this URL
-            yield format_sse_message("progress", step="content", 
-                                   message=f"Fetching content from {url}",
-                                   current=index + 1,
-                                   total=total_urls)
-            # Force flush the message
-            if hasattr(sys.stdout, 'flush'):
-                sys.stdout.flush()
-            
-            content = fetch_content(url)
-            success = not content.startswith("ERROR:")
-            
-            content_fetch_results.append({
-                'Position': row['Position'],
-                'Link': url,
-                'Title': row['Title'],
-                'SEMRush Data': row['SEMRush_Data'],
-                'Content': content,
-                'Success': success
-            })
-            
-            # Send individual URL completion status
-            yield format_sse_message("url_complete", 
-                                   url=url,
-                                   success=success,
-                                   current=index + 1,
-                                   total=total_urls)
-            # Force flush the message
-            if hasattr(sys.stdout, 'flush'):
-                sys.stdout.flush()
-
-        # Send final completion message
-        yield format_sse_message("complete", step="content", 
-                               title="Content Fetching Complete", 
-                               data=content_fetch_results)
-
-
-        yield format_sse_message("progress", step="analysis", message="Analyzing Content...")
-        content_analysis = perform_content_analysis(content_fetch_results, topic_query)
-        yield format_sse_message("complete", step="analysis", title="Analyzing Content", data=content_analysis)
-
-        yield format_sse_message("progress", step="plan", message="Generating Content Plan...")
-        content_plan = generate_content_plan(content_analysis, topic_query, semrush_data)
-        yield format_sse_message("complete", step="plan", title="Content Planning", data=content_plan)
-
-        yield format_sse_message("progress", step="draft", message="Creating Content Draft...")
-        content_draft = create_content_draft(content_plan, content_analysis)
-        yield format_sse_message("complete", step="draft", title="Content Draft", data=content_draft)
-
-        yield format_sse_message("progress", step="proofread", message="Proofreading Content...")
-        proofread_draft = proofread_content_draft(content_draft, content_plan, content_analysis)
-        yield format_sse_message("complete", step="proofread", title="Proofreading", data=proofread_draft)
-
-        yield format_sse_message("progress", step="seo", message="Generating SEO Recommendations...")
-        seo_recommendations = provide_seo_recommendations(proofread_draft, semrush_data)
-        yield format_sse_message("complete", step="seo", title="SEO Recommendations", data=seo_recommendations)
-
-        yield format_sse_message("progress", step="final", message="Compiling Final Deliverable...")
-        final_deliverable = compile_final_deliverable(proofread_draft, seo_recommendations, semrush_data, df_serp, content_analysis)
-        yield format_sse_message("complete", step="final", title="Final Deliverable", data=final_deliverable)
-
-    return Response(generate(), mimetype='text/event-stream')
+        events = queue.Queue()
+        cancelled = threading.Event()
+
+        def run():
+            try:
+                run_topic(topic_query, events.put, cancelled, run_id)
+            except Exception as e:
+                logging.exception(f"Run for topic {topic_query!r} failed.")
+                events.put(format_sse_message("error", message=str(e)))
+            finally:
+                events.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        encoder = SSEEncoder()
+        try:
+            while (message := events.get()) is not None:
+                yield from encoder.encode(message)
+        finally:
+            # Stop scheduling further stages if the client went away.
+            cancelled.set()
+        yield format_sse_message("done")
+
+    return sse_response(generate())
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    payload = request.get_json(silent=True) or request.form
+    topic_query = (payload.get('topic') or '').strip()
+    if not topic_query:
+        return jsonify({"error": "A topic is required."}), 400
+    job_id = job_store.create(topic_query)
+    return jsonify({"id": job_id, "status": "queued", "events_url": url_for('job_events', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/rerun', methods=['POST'])
+def rerun_job(job_id):
+    payload = request.get_json(silent=True) or request.form
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    if job["status"] not in ("done", "failed"):
+        return jsonify({"error": "The job is still running."}), 409
+    try:
+        prepare_rerun(job_id, payload.get('stage'), prompt_override_from(payload))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job_store.requeue(job_id)
+    # The event log is kept, so clients can carry on from their Last-Event-ID.
+    return jsonify({"id": job_id, "status": "queued", "events_url": url_for('job_events', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "Job not found."}), 404
+    # EventSource sends Last-Event-ID when it reconnects; replay everything after it.
+    last_seq = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+
+    def generate():
+        seq = last_seq
+        encoder = SSEEncoder()
+        while True:
+            finished = job_store.get(job_id)["status"] in ("done", "failed")
+            events = job_store.events_after(job_id, seq)
+            for seq, message in events:
+                # Only the last message of a group carries the id, so a reconnect
+                # mid-group replays the whole group.
+                *leading, last = encoder.encode(message)
+                yield from leading
+                yield f"id: {seq}\n{last}"
+            if finished and not events:
+                break
+            if not events:
+                job_store.wait_for_change(timeout=config["job_poll_interval"])
+        yield format_sse_message("done")
+
+    return sse_response(generate())
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate SEO content from live SERP, SEMRush and competitor data.")
+    parser.add_argument("--batch", metavar="TOPICS_FILE", help="CSV or JSONL file of topics to generate without the web UI")
+    parser.add_argument("--output-dir", default="deliverables", help="directory for batch deliverables (default: deliverables)")
+    args = parser.parse_args()
+    if args.batch:
+        summary = run_batch(args.batch, args.output_dir)
+        sys.exit(1 if summary["failed"] else 0)
     app.run(host='0.0.0.0', port=81, debug=True)
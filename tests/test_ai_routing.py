@@ -0,0 +1,90 @@
+## Model routing and fallback of the AI steps, against fake_services.FakeAIClient
+import pytest
+
+import main
+from fake_services import Behaviour, FakeAIClient, Latency
+
+FAST = Behaviour(Latency("fixed", 0.01), payload_size=20)
+SLOW = Behaviour(Latency("fixed", 1.0), payload_size=20)
+
+MESSAGES = [{"role": "user", "content": "Outline an article about coffee grinders."}]
+
+@pytest.fixture
+def routes(monkeypatch):
+    """Route the "test" step through the given models; returns the fake client they are called on."""
+
+    def configure(models, pinned, behaviours, timeout=0.2, context_tokens=None):
+        monkeypatch.setitem(main.config, "ai_routes", {
+            "default": main.config["ai_routes"]["default"],
+            "test": {"models": models, "pinned": pinned, "timeout": timeout}
+        })
+        monkeypatch.setitem(main.config, "ai_models", {model: {"context_tokens": tokens} for model, tokens in (context_tokens or {}).items()})
+        monkeypatch.setitem(main.config, "ai_cache_enabled", False)
+        monkeypatch.setattr(main, "model_latency", main.ModelLatency(main.config["ai_latency_weight"], main.config["ai_latency_ttl"]))
+        client = FakeAIClient(FAST, behaviours)
+        monkeypatch.setattr(main, "client", client)
+        return client
+
+    return configure
+
+def test_timeout_falls_through_to_the_next_model(routes):
+    client = routes(["fake:slow", "fake:fast"], pinned=True, behaviours={"fake:slow": SLOW})
+    assert main.interact_with_ai(MESSAGES, step="test")
+    assert client.model_requests == {"fake:slow": 1, "fake:fast": 1}
+
+def test_streamed_timeout_falls_through_to_the_next_model(routes):
+    client = routes(["fake:slow", "fake:fast"], pinned=True, behaviours={"fake:slow": SLOW})
+    assert list(main.stream_with_ai(MESSAGES, step="test"))
+    assert client.model_requests == {"fake:slow": 1, "fake:fast": 1}
+
+def test_every_model_failing_returns_none(routes):
+    client = routes(["fake:slow", "fake:slower"], pinned=True, behaviours={"fake:slow": SLOW, "fake:slower": SLOW})
+    assert main.interact_with_ai(MESSAGES, step="test") is None
+    assert client.model_requests == {"fake:slow": 1, "fake:slower": 1}
+
+def test_pinned_route_keeps_its_order(routes):
+    client = routes(["fake:first", "fake:second"], pinned=True, behaviours={"fake:first": Behaviour(Latency("fixed", 0.1))})
+    for _ in range(3):
+        main.interact_with_ai(MESSAGES, step="test")
+    # The second model would have been faster, but a pinned route never reorders.
+    assert main.route_for("test", MESSAGES)[0] == ["fake:first", "fake:second"]
+    assert client.model_requests == {"fake:first": 3}
+
+def test_unpinned_route_prefers_the_faster_model(routes):
+    client = routes(["fake:first", "fake:second"], pinned=False, behaviours={"fake:first": Behaviour(Latency("fixed", 0.1))})
+    for _ in range(3):
+        main.interact_with_ai(MESSAGES, step="test")
+    assert main.route_for("test", MESSAGES)[0] == ["fake:second", "fake:first"]
+    # Each model is measured once, then the faster one takes the remaining calls.
+    assert client.model_requests == {"fake:first": 1, "fake:second": 2}
+
+def test_oversized_prompt_skips_the_small_context_model(routes):
+    client = routes(["fake:small", "fake:large"], pinned=True, behaviours={},
+                    context_tokens={"fake:small": 8000, "fake:large": 128000})
+    prompt = [{"role": "user", "content": "word " * 8000}]
+    assert main.route_for("test", prompt)[0] == ["fake:large"]
+    assert main.interact_with_ai(prompt, step="test")
+    assert client.model_requests == {"fake:large": 1}
+    # A prompt that fits still goes to the first model.
+    assert main.route_for("test", MESSAGES)[0] == ["fake:small", "fake:large"]
+
+def test_prompt_too_large_for_every_model_uses_the_largest(routes):
+    routes(["fake:small", "fake:large"], pinned=True, behaviours={},
+           context_tokens={"fake:small": 8000, "fake:large": 16000})
+    prompt = [{"role": "user", "content": "word " * 20000}]
+    assert main.route_for("test", prompt)[0] == ["fake:large"]
+
+def test_digest_written_by_a_fallback_model_is_reused(routes, monkeypatch, tmp_path):
+    client = routes(["fake:slow", "fake:fast"], pinned=True, behaviours={"fake:slow": SLOW})
+    monkeypatch.setitem(main.config["ai_routes"], "digest", main.config["ai_routes"]["test"])
+    monkeypatch.setitem(main.config, "cache_enabled", True)
+    monkeypatch.setattr(main, "response_cache", main.ResponseCache(str(tmp_path / "cache.sqlite3"), main.config["cache_ttls"], 2 ** 20))
+    page = {"Link": "https://example.com/grinders", "Content": "Burr grinders crush beans evenly."}
+    digest = main.summarize_page(page)
+    assert digest and client.model_requests == {"fake:slow": 1, "fake:fast": 1}
+    # The fallback's digest is served from the cache, for as long as the route keeps its models.
+    assert main.summarize_page(page) == digest
+    assert client.model_requests == {"fake:slow": 1, "fake:fast": 1}
+    monkeypatch.setitem(main.config["ai_routes"], "digest", {**main.config["ai_routes"]["test"], "models": ["fake:fast"]})
+    main.summarize_page(page)
+    assert client.model_requests == {"fake:slow": 1, "fake:fast": 2}
@@ -0,0 +1,32 @@
+## Routing of the ASGI app between its native handlers and the Flask app
+import asyncio
+import json
+
+import pytest
+
+asgi = pytest.importorskip("asgi")
+
+def call(path, query):
+    """Send one GET through ``asgi.app``; returns the status and the decoded JSON body."""
+    started, chunks = {}, []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            started.update(message)
+        else:
+            chunks.append(message["body"])
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "headers": []}
+    asyncio.run(asgi.app(scope, receive, send))
+    return started["status"], json.loads(b"".join(chunks))
+
+def test_resuming_a_run_is_left_to_flask():
+    # Only main.py's /progress knows run_id and rerun; the native route would start a new run.
+    assert call("/progress", b"run_id=unknown&rerun=draft") == (400, {"error": "Run not found."})
+    assert call("/progress", b"rerun=draft") == (400, {"error": "rerun requires a run_id."})
+
+def test_native_progress_requires_a_topic():
+    assert call("/progress", b"") == (400, {"error": "A topic is required."})
@@ -0,0 +1,19 @@
+## Batch mode: deliverables per topic, and the call memo shared only within one batch
+import main
+
+def test_batch_memo_does_not_outlive_the_batch(tmp_path, monkeypatch):
+    seen = []
+
+    def run_topic(topic, emit):
+        seen.append(main.active_call_memo.get())
+        return {"final": f"# {topic}"}
+
+    monkeypatch.setattr(main, "run_topic", run_topic)
+    topics = tmp_path / "topics.csv"
+    topics.write_text("topic\ncoffee grinders\nespresso machines\n")
+    summary = main.run_batch(str(topics), str(tmp_path / "out"))
+    assert summary["failed"] == []
+    assert (tmp_path / "out" / f"{main.topic_slug('coffee grinders')}.md").read_text() == "# coffee grinders"
+    # Both topics shared the batch's memo, and it was unset once the batch finished.
+    assert seen[0] is seen[1] is not None
+    assert main.active_call_memo.get() is None
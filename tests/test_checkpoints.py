@@ -0,0 +1,84 @@
+## Resuming a checkpointed run, and rerunning a stage (with a prompt override) and everything downstream of it
+import json
+
+import pytest
+
+import main
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Replace every stage with a stub that records its runs; returns that record (stage name, prompt override)."""
+    monkeypatch.setattr(main, "checkpoint_store", main.CheckpointStore(str(tmp_path / "checkpoints.sqlite3")))
+    ran, failing = [], {"draft"}
+
+    def stub(name):
+        def run(context):
+            ran.append((name, context["prompt_overrides"].get(name)))
+            if name in failing:
+                failing.discard(name)
+                raise RuntimeError(f"{name} failed")
+            yield main.format_sse_message("complete", step=name, title=name, data=f"{name} output")
+            return f"{name} output"
+        return run
+
+    monkeypatch.setattr(main, "PIPELINE_STAGES", [stage._replace(run=stub(stage.name)) for stage in main.PIPELINE_STAGES])
+    return ran
+
+def run(run_id, topic="coffee grinders"):
+    """Run the pipeline for ``run_id``; returns its context and the steps of its ``complete`` events."""
+    messages = []
+    context = main.run_topic(topic, messages.append, run_id=run_id)
+    completed = [message for message in messages if message.startswith('data: {"type": "complete"')]
+    return context, [json.loads(message[len("data: "):])["step"] for message in completed]
+
+def test_resume_reruns_only_the_failed_stage_and_its_dependents(pipeline):
+    context, _ = run("run")
+    assert "final" not in context
+    assert {name for name, _ in pipeline} == {"serp", "semrush", "content", "analysis", "plan", "draft"}
+
+    pipeline.clear()
+    # The topic of a resumed run comes from its checkpoint, not the request.
+    context, completed = run("run", topic="")
+    assert context["topic_query"] == "coffee grinders"
+    assert [name for name, _ in pipeline] == ["draft", "proofread", "seo", "final"]
+    assert context["final"] == "final output"
+    # Restored stages still report their complete events.
+    assert set(completed) == {stage.name for stage in main.PIPELINE_STAGES}
+
+def test_rerun_invalidates_downstream_stages_and_applies_the_override(pipeline):
+    run("run")
+    run("run")
+    pipeline.clear()
+    main.prepare_rerun("run", "analysis", main.prompt_override_from({"instructions": "Compare prices."}))
+    assert set(main.checkpoint_store.load("run")) == {"serp", "semrush", "content"}
+
+    context, _ = run("run")
+    assert [name for name, _ in pipeline] == ["analysis", "plan", "draft", "proofread", "seo", "final"]
+    assert dict(pipeline)["analysis"] == {"instructions": "Compare prices."}
+    assert dict(pipeline)["plan"] is None
+    assert context["final"] == "final output"
+
+def test_prompt_override_rewrites_the_stage_messages():
+    messages = [{"role": "system", "content": "You are a writer."}, {"role": "user", "content": "Write a plan."}]
+    context = {"prompt_overrides": {"plan": {"system": "You are an editor.", "instructions": "Keep it short."}}}
+    assert main.prompt_for(context, "plan", messages) == [
+        {"role": "system", "content": "You are an editor."},
+        {"role": "user", "content": "Write a plan.\n\nAdditional instructions:\nKeep it short."}
+    ]
+    assert main.prompt_for(context, "draft", messages) is messages
+
+def test_rerun_of_an_unknown_stage_is_refused(pipeline):
+    with pytest.raises(ValueError):
+        main.prepare_rerun("run", "publish")
+
+def test_keyword_tables_survive_a_checkpoint(tmp_path):
+    store = main.CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    table = main.parse_semrush_csv(["Keyword;Position;Search Volume;CPC;Competition", "burr grinder;3;1000;1.25;0.4", "coffee grinder;x;4000;0.5;0.1"])
+    store.save("run", "semrush", {"results": [{"Link": "https://a.example/", "SEMRush Data": table}]}, None)
+    restored = store.load("run")["semrush"][0]["results"][0]["SEMRush Data"]
+    assert isinstance(restored, main.KeywordTable)
+    assert restored.rows() == table.rows() == [
+        {"Keyword": "burr grinder", "Position": 3, "Search Volume": 1000, "CPC": 1.25, "Competition": 0.4},
+        {"Keyword": "coffee grinder", "Position": 0, "Search Volume": 4000, "CPC": 0.5, "Competition": 0.1}
+    ]
+    assert restored.column("Search Volume").typecode == "q"
@@ -0,0 +1,50 @@
+## ContentStore shared by several processes, and analysis of pages whose content was evicted
+import os
+
+import pytest
+
+import main
+
+def test_stores_sharing_a_directory_see_each_others_pages(tmp_path):
+    path = str(tmp_path / "content")
+    writer, reader = main.ContentStore(path, 2 ** 20), main.ContentStore(path, 2 ** 20)
+    reader._index()
+    content_id = writer.put("page written after the reader indexed the directory")
+    assert reader.get(content_id) == "page written after the reader indexed the directory"
+
+    # A page the other store evicted is written again rather than assumed present.
+    os.remove(os.path.join(path, content_id))
+    assert reader.get(content_id) is None
+    assert writer.put("page written after the reader indexed the directory") == content_id
+    assert reader.get(content_id) == "page written after the reader indexed the directory"
+
+def test_cap_counts_pages_written_by_other_stores(tmp_path):
+    path = str(tmp_path / "content")
+    pages = [os.urandom(600).hex() for _ in range(4)]
+    first, second = main.ContentStore(path, 1), main.ContentStore(path, 1, rescan_interval=0)
+    first.max_bytes = second.max_bytes = len(main.zlib.compress(pages[0].encode())) * 2 + 100
+    second._index()
+    first_ids = [first.put(pages[0]), first.put(pages[1])]
+    for age, content_id in enumerate(first_ids):
+        os.utime(os.path.join(path, content_id), (1000 + age, 1000 + age))
+    # The second store indexed the directory before the first store's pages existed, yet they count against the cap.
+    second.put(pages[2])
+    second.put(pages[3])
+    remaining = {name for name in os.listdir(path) if not name.startswith('.')}
+    assert len(remaining) == 2
+    assert not remaining & set(first_ids)
+
+def test_analysis_halts_when_every_page_was_evicted(tmp_path, monkeypatch):
+    store = main.ContentStore(str(tmp_path / "content"), 2 ** 20)
+    monkeypatch.setattr(main, "content_store", store)
+    kept = store.put("Text that is still stored.")
+    evicted = store.put("Text that was evicted.")
+    os.remove(os.path.join(store.path, evicted))
+    results = [{"Link": "https://example.com/kept", "Success": True, "ContentId": kept},
+               {"Link": "https://example.com/evicted", "Success": True, "ContentId": evicted}]
+    assert [page["Link"] for page in main.analyzable_pages(results)] == ["https://example.com/kept"]
+
+    stage = main.analysis_stage({"content": results[1:], "topic_query": "topic"})
+    assert '"type": "error"' in next(stage)
+    with pytest.raises(main.PipelineHalted):
+        next(stage)
@@ -0,0 +1,84 @@
+## JobStore shared by several processes: claiming, heartbeats and requeueing stopped jobs
+import sqlite3
+import threading
+import time
+
+import main
+
+def test_each_job_is_claimed_once_across_stores(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    stores = [main.JobStore(path) for _ in range(4)]
+    job_ids = {stores[0].create(f"topic {number}") for number in range(20)}
+    claimed = []
+
+    def work(store):
+        while (job := store.claim()) is not None:
+            claimed.append(job["id"])
+
+    threads = [threading.Thread(target=work, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+def test_only_stale_jobs_are_requeued(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    live, stopped, starting = main.JobStore(path), main.JobStore(path), main.JobStore(path)
+    live_job = live.create("live")
+    stopped_job = live.create("stopped")
+    assert live.claim()["id"] == live_job
+    assert stopped.claim()["id"] == stopped_job
+    live.append_event(live_job, "data: live\n\n")
+    stopped.append_event(stopped_job, "data: stopped\n\n")
+
+    # A process starting up leaves jobs with a recent heartbeat alone.
+    assert starting.requeue_stale(stale_after=60) == 0
+
+    time.sleep(0.3)
+    live.heartbeat()
+    # Only the job whose process stopped heartbeating goes back on the queue, without its events.
+    assert starting.requeue_stale(stale_after=0.2) == 1
+    assert starting.get(live_job)["status"] == "running"
+    assert starting.events_after(live_job, 0) == [(1, "data: live\n\n")]
+    assert starting.get(stopped_job)["status"] == "queued"
+    assert starting.events_after(stopped_job, 0) == []
+    assert starting.claim()["id"] == stopped_job
+
+def test_old_job_databases_gain_owner_and_heartbeat(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, topic TEXT NOT NULL, status TEXT NOT NULL, "
+                 "created REAL NOT NULL, started REAL, finished REAL)")
+    conn.execute("INSERT INTO jobs (id, topic, status, created) VALUES ('old', 'topic', 'running', 0)")
+    conn.commit()
+    conn.close()
+    store = main.JobStore(path)
+    # A job left running before heartbeats existed counts as stale.
+    assert store.requeue_stale(stale_after=60) == 1
+    assert store.claim()["id"] == "old"
+
+def test_deltas_are_merged_before_they_reach_the_job_log(tmp_path):
+    store = main.JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.create("topic")
+    emit = main.JobEventWriter(store, job_id, flush_interval=60)
+    for token in ["Coffee ", "grinders ", "compared."]:
+        emit(main.format_sse_message("delta", step="draft", data=token))
+    emit(main.format_sse_message("delta", step="seo", data="Title: "))
+    emit(main.format_sse_message("delta", step="seo", data="Grinders"))
+    assert store.events_after(job_id, 0) == [(1, main.format_sse_message("delta", step="draft", data="Coffee grinders compared."))]
+    # Any other message writes the held deltas first, so the log keeps its order.
+    emit(main.format_sse_message("complete", step="seo", data="Title: Grinders"))
+    assert [message for _, message in store.events_after(job_id, 1)] == [
+        main.format_sse_message("delta", step="seo", data="Title: Grinders"),
+        main.format_sse_message("complete", step="seo", data="Title: Grinders")
+    ]
+
+def test_deltas_are_written_once_the_flush_interval_passes(tmp_path):
+    store = main.JobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.create("topic")
+    emit = main.JobEventWriter(store, job_id, flush_interval=0.1)
+    emit(main.format_sse_message("delta", step="draft", data="Coffee "))
+    time.sleep(0.15)
+    emit(main.format_sse_message("delta", step="draft", data="grinders"))
+    assert store.events_after(job_id, 0) == [(1, main.format_sse_message("delta", step="draft", data="Coffee grinders"))]
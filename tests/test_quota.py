@@ -0,0 +1,66 @@
+## RateLimiter and QuotaStore: round-robin admission across runs, refunds and daily budgets
+import time
+
+import pytest
+
+import main
+
+def admission_order(limiter, tickets):
+    """Poll until every ticket is admitted; returns their names in admission order."""
+    order = []
+    while len(order) < len(tickets):
+        limiter.poll(next(iter(tickets.values())))
+        order += [name for name, ticket in tickets.items() if ticket.is_set() and name not in order]
+        time.sleep(0.002)
+    return order
+
+def test_waiting_runs_are_served_round_robin():
+    # One token at a time: a run that queued a burst of lookups takes turns with the others.
+    limiter = main.RateLimiter("semrush", rate=1000, burst=1)
+    tickets = {name: limiter.request(owner=name[0]) for name in ("a1", "a2", "a3", "b1", "c1")}
+    assert admission_order(limiter, tickets) == ["a1", "b1", "c1", "a2", "a3"]
+    assert limiter.status()["queued"] == 0
+
+def test_refunds_after_the_budget_is_exhausted(tmp_path):
+    store = main.QuotaStore(str(tmp_path / "quota.sqlite3"))
+    limiter = main.RateLimiter("semrush", daily_units=100, store=store)
+    limiter.request(units=80)
+    with pytest.raises(main.QuotaExhausted):
+        limiter.request(units=50)
+    # The refused request charged nothing.
+    assert limiter.status()["used"] == 80
+    # A process sharing the store sees the same budget.
+    other = main.RateLimiter("semrush", daily_units=100, store=store)
+    with pytest.raises(main.QuotaExhausted):
+        other.request(units=30)
+    limiter.refund(60)
+    assert other.status() == {"used": 20, "daily_units": 100, "remaining": 80, "queued": 0}
+    other.request(units=80)
+    assert limiter.status()["remaining"] == 0
+
+def test_budget_starts_over_on_a_new_utc_day(tmp_path, monkeypatch):
+    store = main.QuotaStore(str(tmp_path / "quota.sqlite3"))
+    persistent = main.RateLimiter("semrush", daily_units=100, store=store)
+    in_memory = main.RateLimiter("serpapi", daily_units=100)
+    for limiter in (persistent, in_memory):
+        limiter.request(units=100)
+        with pytest.raises(main.QuotaExhausted):
+            limiter.request()
+    today = persistent.day
+
+    # Move the clock the limiters read to the same time tomorrow (UTC).
+    gmtime, tomorrow = time.gmtime, time.time() + 24 * 3600
+    monkeypatch.setattr(main.time, "gmtime", lambda seconds=None: gmtime(tomorrow if seconds is None else seconds))
+    for limiter in (persistent, in_memory):
+        limiter.request(units=100)
+        assert limiter.status()["used"] == 100
+        assert limiter.day != today
+    assert store.used("semrush", today) == 100
+    assert store.used("semrush", persistent.day) == 100
+
+def test_unbudgeted_limiter_never_touches_the_store(tmp_path):
+    limiter = main.RateLimiter("jina", store=main.QuotaStore(str(tmp_path / "quota.sqlite3")))
+    limiter.request(units=5)
+    limiter.refund(2)
+    assert limiter.status()["used"] == 3
+    assert not (tmp_path / "quota.sqlite3").exists()
@@ -0,0 +1,122 @@
+## The incremental SSE wire format (SSEEncoder), decoded the way templates/index.html decodes it
+import json
+from collections import defaultdict
+
+import pytest
+
+import main
+
+class Client:
+    """Python port of the event handling in index.html: the entity table, ``resolve`` and streamed text."""
+
+    def __init__(self):
+        self.entities = {}
+        self.live = defaultdict(str)
+        self.results = {}
+        self.last_event_id = None
+
+    def open(self):
+        # onopen: every connection gets a fresh encoder, so the entity table starts over too.
+        self.entities.clear()
+
+    def receive(self, body, until=None):
+        """Handle the events of a response body, stopping after the event with id ``until``."""
+        for block in body.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines())
+            if "data" in fields:
+                self.handle(json.loads(fields["data"]))
+            if "id" in fields:
+                self.last_event_id = fields["id"]
+                if fields["id"] == until:
+                    return
+
+    def handle(self, event):
+        if event["type"] == "entities":
+            for kind, entities in event["data"].items():
+                for entity_id, fields in entities.items():
+                    self.entities.setdefault(kind, {}).setdefault(entity_id, {}).update(fields)
+        elif event["type"] == "delta":
+            self.live[event["step"]] += event["data"]
+        elif event["type"] == "complete":
+            self.results[event["step"]] = self.live.pop(event["step"]) if event.get("streamed") else self.resolve(event["data"])
+
+    def resolve(self, value):
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        resolved = {}
+        if "$ref" in value:
+            kind, entity_id = value["$ref"]
+            entity = self.entities.get(kind, {}).get(entity_id, {})
+            resolved[{"result": "Link", "keyword": "Keyword"}[kind]] = entity_id
+            for key in value.get("$fields") or list(entity):
+                resolved[key] = self.resolve(entity.get(key))
+        for key, item in value.items():
+            if key not in ("$ref", "$fields"):
+                resolved[key] = self.resolve(item)
+        return resolved
+
+@pytest.fixture
+def pipeline_messages(tmp_path, monkeypatch):
+    """Self-contained pipeline messages of a run, and the results a client should end up with."""
+    monkeypatch.setattr(main, "content_store", main.ContentStore(str(tmp_path / "pages"), 2 ** 20))
+    serp_results = [main.SerpResult(1, "https://a.example/grinders", "Best coffee grinders"),
+                    main.SerpResult(2, "https://b.example/burr", "Burr grinder guide")]
+    keyword = lambda name, position, volume: {"Keyword": name, "Position": position, "Search Volume": volume, "CPC": 1.5, "Competition": 0.4}
+    # "burr grinder" has a different search volume for each URL.
+    semrush_results = [main.KeywordTable.from_rows([keyword("burr grinder", 3, 1000), keyword("coffee grinder", 5, 4000)]),
+                       main.KeywordTable.from_rows([keyword("burr grinder", 1, 1200), keyword("grinder settings", 8, 300)])]
+    final_keywords = main.select_final_keywords(main.build_keyword_index([result.link for result in serp_results], semrush_results))
+    _, semrush_data = main.semrush_stage_output(serp_results, semrush_results, final_keywords)
+    content_data = [main.content_result(result, f"Article at {result.link}.") for result in serp_results]
+    draft = "Burr grinders crush beans evenly."
+    messages = [
+        main.format_sse_message("start", message="Starting", run_id="run"),
+        main.format_sse_message("complete", step="serp", title="SERP Data Retrieved", data=main.serp_rows(serp_results)),
+        main.format_sse_message("complete", step="semrush", title="SEMRush Data Retrieved and Processed", data=semrush_data),
+        main.format_sse_message("complete", step="content", title="Content Fetching Complete", data=content_data),
+        *[main.format_sse_message("delta", step="draft", data=part) for part in ("Burr grinders ", "crush beans ", "evenly.")],
+        main.format_sse_message("complete", step="draft", title="Draft Created", data=draft),
+    ]
+    expected = json.loads(json.dumps({"serp": main.serp_rows(serp_results), "semrush": semrush_data, "content": content_data, "draft": draft}))
+    return messages, expected
+
+def test_encoded_events_resolve_to_the_pipeline_payloads(pipeline_messages):
+    messages, expected = pipeline_messages
+    encoder, client = main.SSEEncoder(), Client()
+    wire = "".join(part for message in messages for part in encoder.encode(message))
+    client.receive(wire)
+    assert client.results == expected
+    # Rows and keywords went out by reference, and the streamed draft was not sent twice.
+    assert '"$ref"' in wire and wire.count(expected["draft"]) == 0
+
+@pytest.fixture
+def finished_job(pipeline_messages, tmp_path, monkeypatch):
+    """A finished job whose log holds the pipeline messages; returns its id and a Flask test client."""
+    messages, _ = pipeline_messages
+    store = main.JobStore(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(main, "job_store", store)
+    # Keep the app from starting job workers for the test's store.
+    monkeypatch.setattr(main, "job_workers", [None])
+    job_id = store.create("coffee grinders")
+    store.claim()
+    for message in messages:
+        store.append_event(job_id, message)
+    store.finish(job_id, "done")
+    return job_id, main.app.test_client()
+
+def test_replay_from_a_mid_run_last_event_id(pipeline_messages, finished_job):
+    _, expected = pipeline_messages
+    job_id, http = finished_job
+    client = Client()
+    client.open()
+    # The first connection drops right after the semrush event (the job log's third message).
+    client.receive(http.get(f"/jobs/{job_id}/events").get_data(as_text=True), until="3")
+    assert set(client.results) == {"serp", "semrush"}
+
+    client.open()
+    replay = http.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": client.last_event_id}).get_data(as_text=True)
+    client.receive(replay)
+    assert client.results == expected
+    assert '"type": "done"' in replay
@@ -0,0 +1,18 @@
+## Importing main stays cheap: the AI client and pandas load on first use, not at startup
+import subprocess
+import sys
+
+def import_main(*options):
+    """Import ``main`` in a fresh interpreter; returns the completed process."""
+    script = "import sys, main; print(','.join(sorted(name for name in ('aisuite', 'pandas') if name in sys.modules)))"
+    return subprocess.run([sys.executable, *options, "-c", script], capture_output=True, text=True, check=True)
+
+def test_import_does_not_load_aisuite_or_pandas():
+    assert import_main().stdout.strip() == ""
+
+def test_import_time_is_bounded():
+    # -X importtime lines read "import time: <self us> | <cumulative us> | <module>".
+    timings = [line.split("|") for line in import_main("-X", "importtime").stderr.splitlines() if line.startswith("import time:")]
+    cumulative = {name.strip(): int(total) for _, total, name in timings if total.strip().isdigit()}
+    # About 0.3s here; importing aisuite and pandas up front added another 0.5s. The bound leaves room for slow machines.
+    assert cumulative["main"] < 2_000_000
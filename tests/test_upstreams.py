@@ -0,0 +1,122 @@
+## Retry, Retry-After and read-timeout behaviour of the upstream HTTP calls, against fake_services
+import asyncio
+import time
+
+import pytest
+
+import main
+from fake_services import Behaviour, FakeServer, Latency
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Start a fake upstream and point ``main`` at it, with caching and rate limits off."""
+    servers = []
+
+    def start(kind, behaviour):
+        server = FakeServer(kind, behaviour)
+        servers.append(server)
+        monkeypatch.setitem(main.config, f"{kind}_url", server.url)
+        monkeypatch.setitem(main.config, "cache_enabled", False)
+        # Keep the backoff short, so only a Retry-After header can explain a long wait.
+        monkeypatch.setitem(main.config, "http_backoff_factor", 0.01)
+        monkeypatch.setattr(main, "rate_limiters", {})
+        monkeypatch.setattr(main, "http_session", main.build_http_session())
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_retries_503s_until_success(upstream):
+    server = upstream("semrush", Behaviour(payload_size=5, script=[503, 503]))
+    records = main.request_semrush_data("https://example.com/page", "key")
+    assert server.requests == 3
+    assert len(records) == 5
+    assert isinstance(records.rows(1)[0]["Search Volume"], int)
+
+def test_gives_up_after_the_configured_retries(upstream, monkeypatch):
+    monkeypatch.setitem(main.config, "http_retries", 2)
+    server = upstream("jina", Behaviour(script=[503] * 5))
+    content = main.request_content("https://example.com/page")
+    assert content.startswith("ERROR:")
+    assert server.requests == 3
+
+def test_honours_retry_after(upstream):
+    server = upstream("jina", Behaviour(payload_size=200, script=[429]))
+    started = time.perf_counter()
+    content = main.request_content("https://example.com/page")
+    assert time.perf_counter() - started >= 1.0
+    assert server.requests == 2
+    assert "Article at https://example.com/page" in content
+
+def test_read_timeout_is_not_retried(upstream, monkeypatch):
+    monkeypatch.setitem(main.config, "jina_read_timeout", 0.2)
+    server = upstream("jina", Behaviour(Latency("fixed", 0.6)))
+    started = time.perf_counter()
+    content = main.request_content("https://example.com/page")
+    elapsed = time.perf_counter() - started
+    assert content.startswith("ERROR:")
+    # One read timeout, not one per retry.
+    assert 0.2 <= elapsed < 0.5
+    time.sleep(0.6)
+    assert server.requests == 1
+
+def test_async_path_retries_and_honours_retry_after(upstream):
+    asgi = pytest.importorskip("asgi")
+    server = upstream("jina", Behaviour(payload_size=200, script=[503, 429]))
+
+    async def fetch():
+        try:
+            return await asgi.fetch_content("https://example.com/page")
+        finally:
+            await asgi.get_upstreams().aclose()
+            asgi.upstreams = None
+
+    started = time.perf_counter()
+    content = asyncio.run(fetch())
+    assert time.perf_counter() - started >= 1.0
+    assert server.requests == 3
+    assert "Article at https://example.com/page" in content
+
+def test_units_are_refunded_when_a_request_fails_or_is_cancelled(upstream, monkeypatch):
+    asgi = pytest.importorskip("asgi")
+    upstream("semrush", Behaviour(Latency("fixed", 1.0)))
+    limiter = main.RateLimiter("semrush", daily_units=1000)
+    monkeypatch.setattr(main, "rate_limiters", {"semrush": limiter})
+
+    async def cancel_lookup():
+        try:
+            lookup = asyncio.create_task(asgi.get_semrush_data("https://example.com/page", "key"))
+            await asyncio.sleep(0.2)
+            assert limiter.status()["used"] == main.config["semrush_display_limit"]
+            lookup.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await lookup
+        finally:
+            await asgi.get_upstreams().aclose()
+            asgi.upstreams = None
+
+    asyncio.run(cancel_lookup())
+    assert limiter.status()["used"] == 0
+
+    monkeypatch.setitem(main.config, "semrush_timeout", 0.2)
+    with pytest.raises(main.requests.exceptions.RequestException):
+        main.request_semrush_data("https://example.com/other", "key")
+    assert limiter.status()["used"] == 0
+
+def test_semrush_error_bodies(upstream, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "response_cache", main.ResponseCache(str(tmp_path / "cache.sqlite3"), main.config["cache_ttls"], 2 ** 20))
+    server = upstream("semrush", Behaviour(payload_size=5, script=[(200, "ERROR 132 :: API UNITS BALANCE IS ZERO"),
+                                                                   (200, "ERROR 50 :: NOTHING FOUND")]))
+    monkeypatch.setitem(main.config, "cache_enabled", True)
+    limiter = main.RateLimiter("semrush", daily_units=1000)
+    monkeypatch.setattr(main, "rate_limiters", {"semrush": limiter})
+
+    # Any error but "nothing found" is a failed lookup: not cached, nothing billed.
+    assert main.request_semrush_data("https://example.com/a", "key") is None
+    assert limiter.status()["used"] == 0
+    # "Nothing found" is an empty keyword table, and is cached.
+    assert len(main.request_semrush_data("https://example.com/a", "key")) == 0
+    assert len(main.request_semrush_data("https://example.com/a", "key")) == 0
+    assert server.requests == 2